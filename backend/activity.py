@@ -1,14 +1,303 @@
-from flask import jsonify, request, Blueprint
-from auth_utils import token_required
-from models import db, User, TypingSession
+from flask import jsonify, request, Blueprint, current_app, Response, stream_with_context
+from auth_utils import admin_required, get_token_payload, token_required
+from models import db, TypingSession, TypingDailyRollup
+from heartbeat_buffer import heartbeat_buffer
+from idempotency import idempotent
+from replicas import read_only
+from rate_limit import rate_limiter
+from time_utils import as_utc
+from rollup import overlap_adjusted_seconds, record_closed_sessions
+from stats_cache import stats_cache
+from heatmap import build_heatmap
+from events import activity_events, publish_session_changes
+from etags import activity_etag, activity_version, bump_activity_version, is_fresh, not_modified, with_etag
+from serializers import (
+    SESSION_COLUMNS, SESSION_FIELDS, dumps, gzip_stream, iter_csv, iter_ndjson, json_response,
+    serialize_rows, wants_columnar
+)
 from datetime import datetime, timezone, timedelta
-from sqlalchemy import func, case, cast, Date
+from sqlalchemy import func, or_, text
+import base64
+import binascii
+import json
+import zlib
 
 activity_bp = Blueprint("activity", __name__)
 
+# Endpoints whose (small) JSON body carries the device_id used for rate limiting
+_DEVICE_BODY_ENDPOINTS = {'activity.start_typing_session', 'activity.end_typing_session'}
+
+
+@activity_bp.before_request
+def limit_request_rate():
+    """
+    Per-user, per-device token buckets in front of every activity endpoint
+    
+    Runs before the route touches the database. An excess heartbeat is
+    answered with the device's cached session state when the heartbeat buffer
+    has one and the heartbeat would only have touched it (same language_tag
+    and source); anything else over the limit, language switches included,
+    gets 429 with Retry-After so the client retries it.
+    """
+    if not rate_limiter.enabled:
+        return None
+    
+    # Unauthenticated requests are turned away by token_required
+    payload = get_token_payload()
+    if not payload:
+        return None
+    
+    user = payload.get('user') or {}
+    identity = user.get('uid') or ('github', user.get('id'))
+    
+    device_id = request.args.get('device_id')
+    body = {}
+    if request.endpoint in _DEVICE_BODY_ENDPOINTS:
+        body = request.get_json(silent=True)
+        if not isinstance(body, dict):
+            body = {}
+        device_id = body.get('device_id')
+    device_id = device_id or None
+    
+    heartbeat = request.endpoint == 'activity.start_typing_session'
+    scope = 'heartbeat' if heartbeat else 'default'
+    allowed, retry_after = rate_limiter.consume(scope, (identity, device_id))
+    if allowed:
+        return None
+    
+    if heartbeat and user.get('uid'):
+        session = heartbeat_buffer.peek(user['uid'], device_id, datetime.now(timezone.utc))
+        if session and _only_touches(session, body):
+            rate_limiter.record(scope, 'shed')
+            return jsonify({
+                'success': True,
+                'message': 'Rate limited; session state unchanged',
+                'rate_limited': True,
+                'session': session
+            }), 200
+    
+    rate_limiter.record(scope, 'rejected')
+    response = jsonify({
+        'error': 'Too many requests',
+        'message': f'Rate limit exceeded, retry in {retry_after} seconds'
+    })
+    response.headers['Retry-After'] = str(retry_after)
+    return response, 429
+
+
+def _only_touches(session, body):
+    """Whether a heartbeat body would leave the cached session as it is"""
+    for field in ('language_tag', 'source'):
+        if body.get(field) and body[field] != session[field]:
+            return False
+    return True
+
+
+def _internal_error(error, exc):
+    """
+    500 response for an unexpected exception
+    
+    Database errors carry the SQL text and bound parameters, so the details
+    only go to the server log.
+    """
+    print(f"{error}: {type(exc).__name__}: {exc}")
+    return jsonify({
+        'error': error,
+        'message': 'An internal error occurred'
+    }), 500
+
+
+def _classify_heartbeat(active_session, language_tag, at):
+    """
+    Decide what a start/heartbeat does to the device's active session
+    
+    Returns:
+        str: 'language_switch', 'stale' or 'touch'
+    """
+    if language_tag and active_session.language_tag != language_tag:
+        return 'language_switch'
+    
+    if (at - as_utc(active_session.updated_at)).total_seconds() > current_app.config['STALE_SESSION_SECONDS']:
+        return 'stale'
+    
+    return 'touch'
+
+
+# Heartbeats and batch replays for one device are serialized on a
+# transaction-scoped advisory lock keyed by (uid, device_id), taken in its own
+# statement so the next statement's snapshot includes whatever the previous
+# lock holder committed.
+_DEVICE_LOCK_SQL = text("""
+SELECT pg_advisory_xact_lock(hashtextextended(CAST(:uid AS text) || ':' || coalesce(CAST(:device_id AS text), ''), 0))
+""")
+
+# One statement per heartbeat on PostgreSQL. The active session for the device is
+# locked, then touched, or closed (stale / language switch) and replaced by a new
+# row. uq_typing_sessions_active_device guarantees at most one open session per
+# (uid, device_id); an insert racing a writer outside the advisory lock (e.g.
+# populate_data.py) hits ON CONFLICT DO NOTHING and is retried.
+#
+# :now was taken before waiting for locks, so the row may have been written
+# with a later timestamp in the meantime; timestamps never move backwards.
+_HEARTBEAT_UPSERT_SQL = text("""
+WITH prev AS (
+    SELECT typing_id, language_tag, started_at, updated_at
+    FROM typing_sessions
+    WHERE uid = :uid
+      AND coalesce(device_id, '') = coalesce(CAST(:device_id AS text), '')
+      AND ended_at IS NULL
+    FOR UPDATE
+),
+decision AS (
+    SELECT typing_id, started_at, updated_at,
+           CASE
+               WHEN CAST(:language_tag AS text) IS NOT NULL
+                    AND language_tag IS DISTINCT FROM CAST(:language_tag AS text) THEN 'language_switch'
+               WHEN updated_at < CAST(:now AS timestamptz) - make_interval(secs => :stale_seconds) THEN 'stale'
+               ELSE 'touch'
+           END AS action
+    FROM prev
+),
+touched AS (
+    UPDATE typing_sessions AS t
+    SET updated_at = greatest(CAST(:now AS timestamptz), d.updated_at)
+    FROM decision AS d
+    WHERE t.typing_id = d.typing_id AND d.action = 'touch'
+    RETURNING t.*, d.action
+),
+closed AS (
+    UPDATE typing_sessions AS t
+    SET ended_at = CASE
+            WHEN d.action = 'stale' THEN d.updated_at
+            ELSE greatest(CAST(:now AS timestamptz), d.started_at)
+        END
+    FROM decision AS d
+    WHERE t.typing_id = d.typing_id AND d.action <> 'touch'
+    RETURNING t.*, d.action
+),
+stamp AS (
+    -- greatest() ignores the NULL when nothing was closed
+    SELECT greatest(CAST(:now AS timestamptz), (SELECT max(ended_at) FROM closed)) AS at
+),
+inserted AS (
+    INSERT INTO typing_sessions (uid, started_at, language_tag, source, device_id, created_at, updated_at)
+    SELECT :uid, stamp.at, :language_tag, :source, :device_id, stamp.at, stamp.at
+    FROM stamp
+    WHERE NOT EXISTS (SELECT 1 FROM decision WHERE action = 'touch')
+      -- evaluated first, so the closed row has left the unique index before the insert
+      AND (SELECT count(*) FROM closed) >= 0
+    ON CONFLICT (uid, (coalesce(device_id, ''))) WHERE ended_at IS NULL DO NOTHING
+    RETURNING *, CAST(NULL AS text) AS action
+)
+SELECT 'touched' AS outcome, * FROM touched
+UNION ALL
+SELECT 'closed' AS outcome, * FROM closed
+UNION ALL
+SELECT 'inserted' AS outcome, * FROM inserted
+""")
+
+_SESSION_COLUMNS = [column.name for column in TypingSession.__table__.columns]
+
+
+def _lock_device(uid, device_id):
+    """Serialize session changes for one device until the transaction ends (PostgreSQL only)"""
+    if db.engine.dialect.name == 'postgresql':
+        db.session.execute(_DEVICE_LOCK_SQL, {'uid': uid, 'device_id': device_id})
+
+
+def _apply_heartbeat_upsert(uid, device_id, language_tag, source, now):
+    """
+    Apply a start/heartbeat with a single SQL statement (PostgreSQL only)
+    
+    Returns:
+        tuple: (action, touched_session, closed_sessions, new_session) where
+               action is 'touch', 'language_switch', 'stale' or None (no
+               previous session). Sessions are detached TypingSession objects.
+               closed_sessions is normally empty on 'touch', except when a
+               retry touched a session inserted concurrently after an earlier
+               attempt had closed the previous one. The caller commits.
+    """
+    params = {
+        'uid': uid,
+        'device_id': device_id,
+        'language_tag': language_tag,
+        'source': source,
+        'now': now,
+        'stale_seconds': current_app.config['STALE_SESSION_SECONDS']
+    }
+    
+    _lock_device(uid, device_id)
+    
+    # An insert that conflicts leaves nothing behind but the closes, which stay
+    # in this transaction; the next attempt sees the row that won and touches
+    # or closes it
+    action = None
+    closed_sessions = []
+    while True:
+        rows = db.session.execute(_HEARTBEAT_UPSERT_SQL, params).mappings().all()
+        
+        touched = [row for row in rows if row['outcome'] == 'touched']
+        closed = [row for row in rows if row['outcome'] == 'closed']
+        inserted = [row for row in rows if row['outcome'] == 'inserted']
+        
+        for row in closed:
+            action = action or row['action']
+            closed_sessions.append(_session_from_row(row))
+        
+        if touched:
+            return 'touch', _session_from_row(touched[0]), closed_sessions, None
+        if inserted:
+            return action, None, closed_sessions, _session_from_row(inserted[0])
+
+
+def _apply_heartbeat_orm(uid, device_id, language_tag, source, now):
+    """
+    Read-then-write fallback for databases without the upsert statement
+    
+    Same contract as _apply_heartbeat_upsert.
+    """
+    active_session = TypingSession.query.filter_by(
+        uid=uid,
+        ended_at=None,
+        device_id=device_id
+    ).first()
+    
+    action = None
+    closed_sessions = []
+    
+    if active_session:
+        action = _classify_heartbeat(active_session, language_tag, now)
+        
+        if action == 'touch':
+            active_session.updated_at = now
+            return action, active_session, [], None
+        
+        # Language switch closes now; a stale session closes at its last update
+        active_session.ended_at = now if action == 'language_switch' else active_session.updated_at
+        closed_sessions.append(active_session)
+    
+    new_session = TypingSession(
+        uid=uid,
+        started_at=now,
+        updated_at=now,
+        language_tag=language_tag,
+        source=source,
+        device_id=device_id
+    )
+    db.session.add(new_session)
+    db.session.flush()
+    
+    return action, None, closed_sessions, new_session
+
+
+def _session_from_row(row):
+    """Detached TypingSession built from a RETURNING row, for to_dict() and the rollup"""
+    return TypingSession(**{name: row[name] for name in _SESSION_COLUMNS})
+
 
 @activity_bp.route('/api/activity/start', methods=['POST'])
 @token_required
+@idempotent
 def start_typing_session(current_user):
     """
     Start a new typing session for the authenticated user
@@ -17,16 +306,18 @@ def start_typing_session(current_user):
     {
         "language_tag": "python",  # optional
         "source": "vscode",        # optional, defaults to 'web'
-        "device_id": "uuid"  # optional, for safe retries
+        "device_id": "uuid"        # optional, one open session per device
     }
+    
+    Send an Idempotency-Key header to make retries safe (see idempotency.py).
     """
     try:
         data = request.get_json() or {}
         
-        # Get the user from database by GitHub ID
-        user = User.query.filter_by(github_id=current_user['id']).first()
+        # Internal user id comes straight from the token (see token_required)
+        uid = current_user.get('uid')
         
-        if not user:
+        if not uid:
             return jsonify({
                 'error': 'User not found',
                 'message': 'Please authenticate first'
@@ -35,60 +326,63 @@ def start_typing_session(current_user):
         device_id = data.get('device_id') or None
         new_language_tag = data.get('language_tag')
         
-        # Check if user has an active session (ended_at is NULL)
-        active_session = TypingSession.query.filter_by(
-            uid=user.uid,
-            ended_at=None,
-            device_id=device_id
-        ).first()
+        # Fast path: a recent, same-language heartbeat is absorbed in memory
+        # and written back later by the heartbeat buffer
+        buffered_session = heartbeat_buffer.touch(
+            uid, device_id, new_language_tag, datetime.now(timezone.utc)
+        )
+        if buffered_session:
+            return jsonify({
+                'success': True,
+                'message': 'Session is still active and recent',
+                'session': buffered_session
+            }), 200
         
-        auto_closed_session = None
-        language_switched = False
+        # Write out any buffered heartbeat so the checks below see the latest updated_at
+        heartbeat_buffer.release(uid, device_id)
         
-        if active_session:
-            current_time = datetime.now(timezone.utc)
-            time_since_update = current_time - active_session.updated_at
-            
-            # Check if the language has changed
-            if new_language_tag and active_session.language_tag != new_language_tag:
-                # Language switched - close current session and start new one
-                active_session.ended_at = current_time
-                db.session.commit()
-                
-                auto_closed_session = active_session.to_dict()
-                language_switched = True
-                print(f"Language switch detected: {active_session.language_tag or 'none'} -> {new_language_tag}. Closed session {active_session.typing_id}")
-            
-            # Check if the active session is stale (updated_at is more than 5 minutes old)
-            elif time_since_update.total_seconds() > 300:  # 5 minutes = 300 seconds
-                # Auto-close the stale session: set ended_at to updated_at
-                active_session.ended_at = active_session.updated_at
-                db.session.commit()
-                
-                auto_closed_session = active_session.to_dict()
-                print(f"Auto-closed stale session {active_session.typing_id} (inactive for {time_since_update.total_seconds():.0f} seconds)")
-            
-            # Session is active and recent, same language - just update timestamp
-            else:
-                active_session.updated_at = current_time
-                db.session.commit()
-                return jsonify({
-                    'success': True,
-                    'message': 'Session is still active and recent',
-                    'session': active_session.to_dict()
-                }), 200
-        
-        # Create new typing session
-        new_session = TypingSession(
-            uid=user.uid,
-            started_at=datetime.utcnow(),
-            language_tag=data.get('language_tag'),
-            source=data.get('source', 'web'),
-            device_id=device_id
+        current_time = datetime.now(timezone.utc)
+        apply_heartbeat = (
+            _apply_heartbeat_upsert if db.engine.dialect.name == 'postgresql'
+            else _apply_heartbeat_orm
+        )
+        action, touched_session, closed_sessions, new_session = apply_heartbeat(
+            uid, device_id, new_language_tag, data.get('source', 'web'), current_time
         )
         
-        db.session.add(new_session)
+        # Session is active and recent, same language - only updated_at moved
+        if touched_session is not None:
+            # A plain touch leaves activity_version alone (see etags.py)
+            if closed_sessions:
+                record_closed_sessions(closed_sessions)
+                bump_activity_version([uid])
+            db.session.commit()
+            heartbeat_buffer.remember(uid, device_id, touched_session)
+            if closed_sessions:
+                stats_cache.invalidate(uid)
+                publish_session_changes(uid, closed_sessions)
+            return jsonify({
+                'success': True,
+                'message': 'Session is still active and recent',
+                'session': touched_session.to_dict()
+            }), 200
+        
+        record_closed_sessions(closed_sessions)
+        bump_activity_version([uid])
         db.session.commit()
+        heartbeat_buffer.remember(uid, device_id, new_session)
+        stats_cache.invalidate(uid)
+        publish_session_changes(
+            uid, closed_sessions, new_session, language_switch=action == 'language_switch'
+        )
+        
+        auto_closed_session = closed_sessions[0].to_dict() if closed_sessions else None
+        language_switched = action == 'language_switch'
+        
+        if language_switched:
+            print(f"Language switch detected: {closed_sessions[0].language_tag or 'none'} -> {new_language_tag}. Closed session {closed_sessions[0].typing_id}")
+        elif auto_closed_session:
+            print(f"Auto-closed stale session {closed_sessions[0].typing_id}")
         
         response_data = {
             'success': True,
@@ -108,14 +402,12 @@ def start_typing_session(current_user):
         
     except Exception as e:
         db.session.rollback()
-        return jsonify({
-            'error': 'Failed to start session',
-            'message': str(e)
-        }), 500
+        return _internal_error('Failed to start session', e)
 
 
 @activity_bp.route('/api/activity/end', methods=['POST'])
 @token_required
+@idempotent
 def end_typing_session(current_user):
     """
     End the current active typing session
@@ -123,8 +415,11 @@ def end_typing_session(current_user):
     Request body:
     {
         "typing_id": 123,           # optional, specific session to end
-        "device_id": "uuid"   # optional, for safe retries
+        "device_id": "uuid"         # optional, end this device's open session
     }
+    
+    Send an Idempotency-Key header to make retries safe: a retry returns the
+    original response instead of "Session already ended".
     """
     try:
         # Handle empty POST body gracefully
@@ -133,42 +428,36 @@ def end_typing_session(current_user):
         except:
             data = {}
         
-        # Get the user from database by GitHub ID
-        user = User.query.filter_by(github_id=current_user['id']).first()
+        # Internal user id comes straight from the token (see token_required)
+        uid = current_user.get('uid')
         
-        if not user:
+        if not uid:
             return jsonify({
                 'error': 'User not found',
                 'message': 'Please authenticate first'
             }), 404
         
-        # Check for idempotency - if session with this key is already ended
-        device_id = data.get('device_id')
-        if device_id:
-            existing_session = TypingSession.query.filter_by(
-                device_id=device_id
-            ).first()
-            
-            if existing_session and existing_session.ended_at is not None:
-                return jsonify({
-                    'success': True,
-                    'message': 'Session already ended',
-                    'session': existing_session.to_dict()
-                }), 200
-        
         # Find the session to end
         typing_id = data.get('typing_id')
+        device_id = data.get('device_id')
         
         if typing_id:
             # End specific session
             session = TypingSession.query.filter_by(
                 typing_id=typing_id,
-                uid=user.uid
+                uid=uid
+            ).first()
+        elif device_id:
+            # End this device's open session (uq_typing_sessions_active_device)
+            session = TypingSession.query.filter(
+                TypingSession.uid == uid,
+                func.coalesce(TypingSession.device_id, '') == device_id,
+                TypingSession.ended_at.is_(None)
             ).first()
         else:
             # End the most recent active session
             session = TypingSession.query.filter_by(
-                uid=user.uid,
+                uid=uid,
                 ended_at=None
             ).order_by(TypingSession.started_at.desc()).first()
         
@@ -185,11 +474,18 @@ def end_typing_session(current_user):
                 'session': session.to_dict()
             }), 400
         
+        # Write out buffered heartbeats and stop absorbing them for this session
+        heartbeat_buffer.release_session(session.typing_id)
+        
         # End the session
         session.ended_at = datetime.utcnow()
         session.updated_at = datetime.utcnow()
+        record_closed_sessions([session])
+        bump_activity_version([uid])
         
         db.session.commit()
+        stats_cache.invalidate(uid)
+        publish_session_changes(uid, [session])
         
         return jsonify({
             'success': True,
@@ -199,71 +495,467 @@ def end_typing_session(current_user):
         
     except Exception as e:
         db.session.rollback()
+        return _internal_error('Failed to end session', e)
+
+
+def _read_batch_payload():
+    """
+    Parse the JSON body of a batch request, gunzipping it if needed
+    
+    Raises:
+        ValueError: If the body is missing, too large or not valid JSON
+    """
+    max_bytes = current_app.config['ACTIVITY_BATCH_MAX_BYTES']
+    body = request.get_data(cache=False)
+    
+    if request.headers.get('Content-Encoding', '').lower() == 'gzip':
+        # Bound the decompressed size so a small gzip body can't expand unchecked
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        try:
+            body = decompressor.decompress(body, max_bytes + 1)
+        except zlib.error:
+            raise ValueError('Request body is not valid gzip')
+    
+    if len(body) > max_bytes:
+        raise ValueError(f'Request body exceeds {max_bytes} bytes')
+    
+    try:
+        payload = json.loads(body or b'null')
+    except ValueError:
+        raise ValueError('Request body is not valid JSON')
+    
+    if not isinstance(payload, dict):
+        raise ValueError('Request body must be a JSON object')
+    
+    return payload
+
+
+def _parse_event_timestamp(value):
+    """Parse an ISO 8601 timestamp, treating naive values as UTC"""
+    if not isinstance(value, str):
+        raise ValueError('timestamp is required')
+    
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+@activity_bp.route('/api/activity/batch', methods=['POST'])
+@token_required
+@idempotent
+def ingest_activity_batch(current_user):
+    """
+    Apply an ordered batch of activity events for one device in a single transaction
+    
+    Lets clients that were offline replay their activity in one round-trip.
+    The body may be gzip-compressed (Content-Encoding: gzip).
+    
+    Request body:
+    {
+        "device_id": "uuid",       # optional
+        "source": "vscode",        # optional, defaults to 'web'
+        "events": [
+            {"type": "start", "timestamp": "2025-10-05T10:00:00Z", "language_tag": "python"},
+            {"type": "heartbeat", "timestamp": "2025-10-05T10:00:30Z"},
+            {"type": "end", "timestamp": "2025-10-05T10:05:00Z"}
+        ]
+    }
+    
+    "start" and "heartbeat" follow the same rules as /api/activity/start
+    (touch, language switch, stale auto-close). Events must be in
+    chronological order; invalid events are reported and skipped. Send an
+    Idempotency-Key header so a retried batch is not applied twice.
+    """
+    try:
+        try:
+            data = _read_batch_payload()
+        except ValueError as e:
+            return jsonify({
+                'error': 'Invalid batch',
+                'message': str(e)
+            }), 400
+        
+        events = data.get('events')
+        max_events = current_app.config['ACTIVITY_BATCH_MAX_EVENTS']
+        if not isinstance(events, list) or not events:
+            return jsonify({
+                'error': 'Invalid batch',
+                'message': 'events must be a non-empty list'
+            }), 400
+        if len(events) > max_events:
+            return jsonify({
+                'error': 'Invalid batch',
+                'message': f'At most {max_events} events per batch'
+            }), 400
+        
+        # Internal user id comes straight from the token (see token_required)
+        uid = current_user.get('uid')
+        
+        if not uid:
+            return jsonify({
+                'error': 'User not found',
+                'message': 'Please authenticate first'
+            }), 404
+        
+        device_id = data.get('device_id') or None
+        source = data.get('source', 'web')
+        now = datetime.now(timezone.utc)
+        max_skew = timedelta(seconds=current_app.config['ACTIVITY_BATCH_MAX_CLOCK_SKEW_SECONDS'])
+        
+        # Make sure the replay starts from the latest persisted heartbeat
+        heartbeat_buffer.release(uid, device_id)
+        
+        _lock_device(uid, device_id)
+        active_session = TypingSession.query.filter_by(
+            uid=uid,
+            ended_at=None,
+            device_id=device_id
+        ).order_by(TypingSession.started_at.desc()).first()
+        
+        # Replay events in memory; session objects are resolved to ids after the flush
+        outcomes = []
+        closed_sessions = []
+        started_session = None
+        last_timestamp = None
+        
+        for index, event in enumerate(events):
+            if not isinstance(event, dict):
+                outcomes.append((index, 'error', None, None, 'event must be an object'))
+                continue
+            
+            event_type = event.get('type')
+            if event_type not in ('start', 'heartbeat', 'end'):
+                outcomes.append((index, 'error', None, None, f'unknown event type: {event_type}'))
+                continue
+            
+            try:
+                timestamp = _parse_event_timestamp(event.get('timestamp'))
+            except ValueError as e:
+                outcomes.append((index, 'error', None, None, str(e)))
+                continue
+            
+            if timestamp > now + max_skew:
+                outcomes.append((index, 'error', None, None, 'timestamp is in the future'))
+                continue
+            if last_timestamp and timestamp < last_timestamp:
+                outcomes.append((index, 'error', None, None, 'events must be in chronological order'))
+                continue
+            last_timestamp = timestamp
+            
+            if event_type == 'end':
+                if not active_session:
+                    outcomes.append((index, 'ignored', None, None, 'no active session'))
+                    continue
+                active_session.ended_at = max(timestamp, as_utc(active_session.started_at))
+                active_session.updated_at = active_session.ended_at
+                outcomes.append((index, 'ended', active_session, None, None))
+                closed_sessions.append(active_session)
+                active_session = None
+                continue
+            
+            language_tag = event.get('language_tag')
+            closed_session = None
+            status = 'started'
+            
+            if active_session:
+                action = _classify_heartbeat(active_session, language_tag, timestamp)
+                
+                if action == 'touch':
+                    active_session.updated_at = max(timestamp, as_utc(active_session.updated_at))
+                    outcomes.append((index, 'touched', active_session, None, None))
+                    continue
+                
+                if action == 'language_switch':
+                    active_session.ended_at = max(timestamp, as_utc(active_session.started_at))
+                    status = 'language_switched'
+                else:
+                    active_session.ended_at = active_session.updated_at
+                    status = 'stale_closed'
+                closed_session = active_session
+                closed_sessions.append(closed_session)
+            
+            active_session = TypingSession(
+                uid=uid,
+                started_at=timestamp,
+                updated_at=timestamp,
+                language_tag=language_tag,
+                source=event.get('source', source),
+                device_id=device_id
+            )
+            db.session.add(active_session)
+            started_session = active_session
+            outcomes.append((index, status, active_session, closed_session, None))
+        
+        record_closed_sessions(closed_sessions)
+        
+        # One flush: new sessions go out as a batched multi-row INSERT,
+        # touched/closed sessions as UPDATEs, all in this transaction
+        db.session.flush()
+        
+        results = []
+        for index, status, session, closed_session, error in outcomes:
+            result = {'index': index, 'status': status}
+            if session is not None:
+                result['typing_id'] = session.typing_id
+            if closed_session is not None:
+                result['closed_typing_id'] = closed_session.typing_id
+            if error:
+                result['error'] = error
+            results.append(result)
+        
+        if closed_sessions or started_session is not None:
+            bump_activity_version([uid])
+        db.session.commit()
+        if closed_sessions or started_session is not None:
+            stats_cache.invalidate(uid)
+        
+        # Sessions started and closed within the batch only show up as ended
+        publish_session_changes(
+            uid, closed_sessions,
+            active_session if active_session is started_session else None
+        )
+        
         return jsonify({
-            'error': 'Failed to end session',
-            'message': str(e)
-        }), 500
+            'success': True,
+            'message': f'Processed {len(events)} events',
+            'active_typing_id': active_session.typing_id if active_session else None,
+            'results': results
+        }), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        return _internal_error('Failed to process batch', e)
+
+
+def _encode_cursor(started_at, typing_id):
+    """Opaque pagination cursor for the position just after a session"""
+    raw = json.dumps([as_utc(started_at).isoformat(), typing_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def _decode_cursor(cursor):
+    """
+    Decode a cursor produced by _encode_cursor
+    
+    Returns:
+        tuple: (started_at, typing_id), or None if no cursor was given
+    
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    if not cursor:
+        return None
+    
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        started_at, typing_id = json.loads(raw)
+        return datetime.fromisoformat(started_at), int(typing_id)
+    except (TypeError, ValueError, binascii.Error):
+        raise ValueError('Invalid cursor')
+
+
+def _estimate_session_count(uid, active_only):
+    """
+    Cheap session count: closed sessions from the daily rollup plus open
+    sessions from the partial index, instead of counting the whole history
+    """
+    open_count = TypingSession.query.filter_by(uid=uid, ended_at=None).count()
+    if active_only:
+        return open_count
+    
+    closed_count = db.session.query(
+        func.coalesce(func.sum(TypingDailyRollup.session_count), 0)
+    ).filter(TypingDailyRollup.uid == uid).scalar()
+    return int(closed_count) + open_count
 
 
 @activity_bp.route('/api/activity/sessions', methods=['GET'])
 @token_required
+@read_only
 def get_typing_sessions(current_user):
     """
-    Get typing sessions for the authenticated user
+    Get typing sessions for the authenticated user, newest first
+    
+    Pages are addressed with an opaque cursor on (started_at, typing_id), so
+    each page is an index range scan no matter how deep it is.
     
     Query parameters:
-    - limit: number of sessions to return (default: 50)
-    - offset: pagination offset (default: 0)
+    - limit: number of sessions to return (default: 50, max: 100)
+    - cursor: next_cursor from the previous page (omit for the first page)
+    - include_total: 'exact' or 'estimate' to also return a total (default: none)
+    - offset: legacy offset pagination; implies include_total=exact
     - active_only: only return active sessions (default: false)
+    - format: 'columnar' to return sessions as parallel arrays per field
     """
     try:
-        # Get the user from database by GitHub ID
-        user = User.query.filter_by(github_id=current_user['id']).first()
+        # Internal user id comes straight from the token (see token_required)
+        uid = current_user.get('uid')
         
-        if not user:
+        if not uid:
             return jsonify({
                 'error': 'User not found',
                 'message': 'Please authenticate first'
             }), 404
         
+        # Repeat polls are answered from the version counter alone; the tag
+        # also rolls over once per cache TTL to pick up heartbeat touches
+        version = activity_version(uid)
+        etag = activity_etag(
+            uid, 'sessions', version, request.args,
+            window_seconds=current_app.config['STATS_CACHE_TTL_SECONDS']
+        )
+        if is_fresh(etag):
+            return not_modified(etag)
+        
+        cached = stats_cache.get(uid, f'sessions@{version}', request.args)
+        if cached is not None:
+            return with_etag(json_response(cached), etag)
+        
         # Get query parameters
         limit = min(int(request.args.get('limit', 50)), 100)
-        offset = int(request.args.get('offset', 0))
+        offset = request.args.get('offset', type=int)
         active_only = request.args.get('active_only', 'false').lower() == 'true'
+        include_total = request.args.get('include_total', 'exact' if offset is not None else 'none').lower()
+        
+        if include_total not in ('none', 'exact', 'estimate'):
+            return jsonify({
+                'error': 'Invalid include_total',
+                'message': "include_total must be 'none', 'exact' or 'estimate'"
+            }), 400
         
-        # Build query
-        query = TypingSession.query.filter_by(uid=user.uid)
+        try:
+            cursor = _decode_cursor(request.args.get('cursor'))
+        except ValueError:
+            return jsonify({
+                'error': 'Invalid cursor',
+                'message': 'Use the next_cursor value from a previous response'
+            }), 400
+        
+        # Build query over plain columns; rows are serialized without ORM objects
+        query = db.session.query(*SESSION_COLUMNS).filter(TypingSession.uid == uid)
         
         if active_only:
-            query = query.filter_by(ended_at=None)
+            query = query.filter(TypingSession.ended_at.is_(None))
+        
+        total = None
+        if include_total == 'exact':
+            total = query.count()
+        elif include_total == 'estimate':
+            total = _estimate_session_count(uid, active_only)
         
-        # Get total count
-        total = query.count()
+        query = query.order_by(
+            TypingSession.started_at.desc(),
+            TypingSession.typing_id.desc()
+        )
         
-        # Get sessions with pagination
-        sessions = query.order_by(
-            TypingSession.started_at.desc()
-        ).limit(limit).offset(offset).all()
+        if cursor:
+            # started_at <= x is the index condition on idx_typing_sessions_uid_started;
+            # typing_id only breaks ties between sessions started at the same instant
+            cursor_started_at, cursor_typing_id = cursor
+            query = query.filter(
+                TypingSession.started_at <= cursor_started_at,
+                or_(
+                    TypingSession.started_at < cursor_started_at,
+                    TypingSession.typing_id < cursor_typing_id
+                )
+            )
+        elif offset:
+            query = query.offset(offset)
         
-        return jsonify({
+        # Fetch one extra row to know whether there is another page
+        sessions = query.limit(limit + 1).all()
+        has_more = len(sessions) > limit
+        sessions = sessions[:limit]
+        
+        next_cursor = None
+        if has_more:
+            next_cursor = _encode_cursor(sessions[-1].started_at, sessions[-1].typing_id)
+        
+        pagination = {
+            'limit': limit,
+            'has_more': has_more,
+            'next_cursor': next_cursor
+        }
+        if total is not None:
+            pagination['total'] = total
+            pagination['total_is_estimate'] = include_total == 'estimate'
+        if offset is not None:
+            pagination['offset'] = offset
+        
+        columnar = wants_columnar(request.args)
+        payload = {
             'success': True,
-            'sessions': [session.to_dict() for session in sessions],
-            'pagination': {
-                'total': total,
-                'limit': limit,
-                'offset': offset
-            }
-        }), 200
+            'sessions': serialize_rows(sessions, SESSION_FIELDS, columnar=columnar),
+            'pagination': pagination
+        }
+        if columnar:
+            payload['format'] = 'columnar'
+        stats_cache.set(uid, f'sessions@{version}', request.args, payload)
+        
+        return with_etag(json_response(payload), etag)
         
     except Exception as e:
-        return jsonify({
-            'error': 'Failed to fetch sessions',
-            'message': str(e)
-        }), 500
+        return _internal_error('Failed to fetch sessions', e)
+
+
+def _stats_by_date(grouped_stats):
+    """
+    Shape (date, language_tag, source, total_seconds, session_count) rows
+    into per-date totals with language and source breakdowns, in minutes
+    """
+    stats_by_date = {}
+    for date, language_tag, source, total_seconds, session_count in grouped_stats:
+        date_str = date.isoformat()
+        minutes = round(total_seconds / 60, 2) if total_seconds else 0
+        
+        # Initialize date entry if it doesn't exist
+        if date_str not in stats_by_date:
+            stats_by_date[date_str] = {
+                'total_time_minutes': 0,
+                'by_language': {},
+                'by_source': {},
+                'session_count': 0
+            }
+        
+        # Add to total time for the date
+        stats_by_date[date_str]['total_time_minutes'] += minutes
+        stats_by_date[date_str]['session_count'] += session_count
+        
+        # Add to language breakdown
+        lang = language_tag or 'unknown'
+        if lang not in stats_by_date[date_str]['by_language']:
+            stats_by_date[date_str]['by_language'][lang] = 0
+        stats_by_date[date_str]['by_language'][lang] += minutes
+        
+        # Add to source breakdown
+        source = source or 'unknown'
+        if source not in stats_by_date[date_str]['by_source']:
+            stats_by_date[date_str]['by_source'][source] = 0
+        stats_by_date[date_str]['by_source'][source] += minutes
+    
+    # Round totals to 2 decimal places
+    for date_str in stats_by_date:
+        stats_by_date[date_str]['total_time_minutes'] = round(
+            stats_by_date[date_str]['total_time_minutes'], 2
+        )
+        # Round language times
+        for lang in stats_by_date[date_str]['by_language']:
+            stats_by_date[date_str]['by_language'][lang] = round(
+                stats_by_date[date_str]['by_language'][lang], 2
+            )
+        # Round source times
+        for source in stats_by_date[date_str]['by_source']:
+            stats_by_date[date_str]['by_source'][source] = round(
+                stats_by_date[date_str]['by_source'][source], 2
+            )
+    
+    return stats_by_date
 
 
 @activity_bp.route('/api/activity/stats', methods=['GET'])
 @token_required
+@read_only
 def get_activity_stats(current_user):
     """
     Get activity statistics for the authenticated user
@@ -274,131 +966,334 @@ def get_activity_stats(current_user):
     - Total time spent for each source
     """
     try:
-        # Get the user from database by GitHub ID
-        user = User.query.filter_by(github_id=current_user['id']).first()
+        # Internal user id comes straight from the token (see token_required)
+        uid = current_user.get('uid')
         
-        if not user:
+        if not uid:
             return jsonify({
                 'error': 'User not found',
                 'message': 'Please authenticate first'
             }), 404
         
-        # Get all sessions in the past month, group by date, language, and source
+        # Live totals of open sessions grow with time, so the tag also rolls
+        # over once per cache TTL
+        version = activity_version(uid)
+        etag = activity_etag(
+            uid, 'stats', version, request.args,
+            window_seconds=current_app.config['STATS_CACHE_TTL_SECONDS']
+        )
+        if is_fresh(etag):
+            return not_modified(etag)
+        
+        cached = stats_cache.get(uid, f'stats@{version}', request.args)
+        if cached is not None:
+            return with_etag(jsonify(cached), etag), 200
+        
+        # Closed sessions come pre-aggregated from the daily rollup
         now = datetime.now(timezone.utc)
         month_ago = now - timedelta(days=30)
 
-        # Query sessions in the past month for this user
-        sessions_query = (
+        rollup_rows = (
             db.session.query(
-                cast(TypingSession.started_at, Date).label('date'),
-                TypingSession.language_tag,
-                TypingSession.source,
-                func.sum(
-                    case(
-                        (TypingSession.ended_at != None, func.extract('epoch', TypingSession.ended_at) - func.extract('epoch', TypingSession.started_at)),
-                        else_=func.extract('epoch', func.now()) - func.extract('epoch', TypingSession.started_at)
-                    )
-                ).label('total_seconds'),
-                func.count().label('session_count')
+                TypingDailyRollup.date,
+                TypingDailyRollup.language_tag,
+                TypingDailyRollup.source,
+                TypingDailyRollup.total_seconds,
+                TypingDailyRollup.session_count
             )
             .filter(
-                TypingSession.uid == user.uid,
-                TypingSession.started_at >= month_ago
+                TypingDailyRollup.uid == uid,
+                TypingDailyRollup.date >= month_ago.date()
             )
-            .group_by(
-                cast(TypingSession.started_at, Date),
+            .order_by(TypingDailyRollup.date.desc())
+            .all()
+        )
+
+        # Only still-open sessions are computed live (uses idx_typing_sessions_active)
+        open_sessions = (
+            db.session.query(
+                TypingSession.typing_id,
+                TypingSession.started_at,
+                TypingSession.ended_at,
                 TypingSession.language_tag,
                 TypingSession.source
             )
-            .order_by(
-                cast(TypingSession.started_at, Date).desc()
+            .filter(
+                TypingSession.uid == uid,
+                TypingSession.ended_at.is_(None),
+                TypingSession.started_at >= month_ago
             )
+            .all()
         )
 
-        # Fetch grouped stats
-        grouped_stats = sessions_query.all()
+        grouped_stats = [
+            (row.date, row.language_tag, row.source, row.total_seconds, row.session_count)
+            for row in rollup_rows
+        ]
+        # Overlap with closed sessions (other devices) is counted once
+        for (_, date, language_tag, source), seconds in overlap_adjusted_seconds(uid, open_sessions, now).items():
+            if date >= month_ago.date():
+                grouped_stats.append((date, language_tag, source, seconds, 0))
+        for session in open_sessions:
+            grouped_stats.append((as_utc(session.started_at).date(), session.language_tag, session.source, 0, 1))
 
-        # Prepare stats for output - structure by date with totals and breakdowns
-        stats_by_date = {}
-        for row in grouped_stats:
-            date_str = row.date.isoformat()
-            minutes = round(row.total_seconds / 60, 2) if row.total_seconds else 0
-            
-            # Initialize date entry if it doesn't exist
-            if date_str not in stats_by_date:
-                stats_by_date[date_str] = {
-                    'total_time_minutes': 0,
-                    'by_language': {},
-                    'by_source': {},
-                    'session_count': 0
-                }
-            
-            # Add to total time for the date
-            stats_by_date[date_str]['total_time_minutes'] += minutes
-            stats_by_date[date_str]['session_count'] += row.session_count
-            
-            # Add to language breakdown
-            lang = row.language_tag or 'unknown'
-            if lang not in stats_by_date[date_str]['by_language']:
-                stats_by_date[date_str]['by_language'][lang] = 0
-            stats_by_date[date_str]['by_language'][lang] += minutes
-            
-            # Add to source breakdown
-            source = row.source or 'unknown'
-            if source not in stats_by_date[date_str]['by_source']:
-                stats_by_date[date_str]['by_source'][source] = 0
-            stats_by_date[date_str]['by_source'][source] += minutes
-        
-        # Round totals to 2 decimal places
-        for date_str in stats_by_date:
-            stats_by_date[date_str]['total_time_minutes'] = round(
-                stats_by_date[date_str]['total_time_minutes'], 2
-            )
-            # Round language times
-            for lang in stats_by_date[date_str]['by_language']:
-                stats_by_date[date_str]['by_language'][lang] = round(
-                    stats_by_date[date_str]['by_language'][lang], 2
-                )
-            # Round source times
-            for source in stats_by_date[date_str]['by_source']:
-                stats_by_date[date_str]['by_source'][source] = round(
-                    stats_by_date[date_str]['by_source'][source], 2
-                )
+        stats_by_date = _stats_by_date(grouped_stats)
         
-        return jsonify({
+        payload = {
             'success': True,
             'stats': {
                 'by_date': stats_by_date    
             }
-        }), 200
+        }
+        stats_cache.set(uid, f'stats@{version}', request.args, payload)
+        
+        return with_etag(jsonify(payload), etag), 200
         
     except Exception as e:
+        return _internal_error('Failed to calculate statistics', e)
+
+
+@activity_bp.route('/api/activity/export', methods=['GET'])
+@token_required
+@read_only
+def export_typing_sessions(current_user):
+    """
+    Stream all of the authenticated user's typing sessions, oldest first
+    
+    Rows are read through a server-side cursor ACTIVITY_EXPORT_CHUNK_SIZE at a
+    time and written out as they arrive, so memory use does not grow with the
+    length of the history.
+    
+    Query parameters:
+    - format: 'ndjson' (default) or 'csv'
+    - since: only sessions started at or after this ISO 8601 timestamp
+    - until: only sessions started before this ISO 8601 timestamp
+    
+    The response is gzip-compressed when the client accepts it.
+    """
+    # Internal user id comes straight from the token (see token_required)
+    uid = current_user.get('uid')
+    
+    if not uid:
+        return jsonify({
+            'error': 'User not found',
+            'message': 'Please authenticate first'
+        }), 404
+    
+    export_format = request.args.get('format', 'ndjson').lower()
+    if export_format not in ('ndjson', 'csv'):
         return jsonify({
-            'error': 'Failed to calculate statistics',
-            'message': str(e)
-        }), 500
+            'error': 'Invalid format',
+            'message': "format must be 'ndjson' or 'csv'"
+        }), 400
+    
+    try:
+        since = request.args.get('since')
+        until = request.args.get('until')
+        since = _parse_event_timestamp(since) if since else None
+        until = _parse_event_timestamp(until) if until else None
+    except ValueError:
+        return jsonify({
+            'error': 'Invalid timestamp',
+            'message': 'since and until must be ISO 8601 timestamps'
+        }), 400
+    
+    chunk_size = current_app.config['ACTIVITY_EXPORT_CHUNK_SIZE']
+    
+    query = db.session.query(*SESSION_COLUMNS).filter(TypingSession.uid == uid)
+    if since:
+        query = query.filter(TypingSession.started_at >= since)
+    if until:
+        query = query.filter(TypingSession.started_at < until)
+    rows = query.order_by(
+        TypingSession.started_at,
+        TypingSession.typing_id
+    ).yield_per(chunk_size)
+    
+    if export_format == 'csv':
+        body = iter_csv(rows, SESSION_FIELDS, chunk_size)
+        mimetype, filename = 'text/csv', 'typing-sessions.csv'
+    else:
+        body = iter_ndjson(rows, SESSION_FIELDS, chunk_size)
+        mimetype, filename = 'application/x-ndjson', 'typing-sessions.ndjson'
+    
+    headers = {
+        'Content-Disposition': f'attachment; filename="{filename}"',
+        'Vary': 'Accept-Encoding'
+    }
+    if request.accept_encodings['gzip']:
+        body = gzip_stream(body)
+        headers['Content-Encoding'] = 'gzip'
+    
+    return Response(stream_with_context(body), mimetype=mimetype, headers=headers)
+
+
+@activity_bp.route('/api/activity/stream', methods=['GET'])
+@token_required
+def stream_activity(current_user):
+    """
+    Server-Sent Events feed of the authenticated user's session changes
+    
+    Events:
+    - session_started: the new session
+    - session_ended: the closed session
+    - language_switched: {closed_session, session}
+    - daily_totals: {days: [{date, total_seconds, session_count}]} for days
+      whose totals changed
+    - resync: the client fell too far behind; refetch and reconnect
+    
+    A comment line is sent every ACTIVITY_STREAM_HEARTBEAT_SECONDS so proxies
+    keep idle connections open and dead clients are noticed.
+    """
+    # Internal user id comes straight from the token (see token_required)
+    uid = current_user.get('uid')
+    
+    if not uid:
+        return jsonify({
+            'error': 'User not found',
+            'message': 'Please authenticate first'
+        }), 404
+    
+    subscription = activity_events.subscribe(uid)
+    if subscription is None:
+        return jsonify({
+            'error': 'Too many streams',
+            'message': f'At most {activity_events.max_per_user} live streams per user'
+        }), 429
+    
+    heartbeat_seconds = activity_events.heartbeat_seconds
+    
+    def generate():
+        # Runs after the request context is gone; must not touch the database
+        try:
+            yield 'retry: 5000\n\n'
+            while True:
+                if subscription.overflowed:
+                    yield 'event: resync\ndata: {}\n\n'
+                    return
+                
+                message = subscription.get(heartbeat_seconds)
+                if message is None:
+                    yield ': heartbeat\n\n'
+                    continue
+                
+                event_id, event, data = message
+                yield f'id: {event_id}\nevent: {event}\ndata: {dumps(data).decode()}\n\n'
+        finally:
+            activity_events.unsubscribe(subscription)
+    
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+
+@activity_bp.route('/api/activity/heatmap', methods=['GET'])
+@token_required
+@read_only
+def get_activity_heatmap(current_user):
+    """
+    Get a GitHub-style contribution heatmap for the past year
+    
+    Returns flat arrays covering the 365/366 days ending today (UTC), oldest first:
+    - minutes: minutes typed per day
+    - levels: 0 (no activity) to 4, by quartile of the active days
+    - quartiles: the minute thresholds for levels 1-3
+    - current_streak / longest_streak: consecutive active days
+    """
+    try:
+        # Internal user id comes straight from the token (see token_required)
+        uid = current_user.get('uid')
+        
+        if not uid:
+            return jsonify({
+                'error': 'User not found',
+                'message': 'Please authenticate first'
+            }), 404
+        
+        # Keyed by version like the other stats entries, so a heatmap cached
+        # before a session change is never served after it
+        cache_name = f'heatmap@{activity_version(uid)}'
+        cached = stats_cache.get(uid, cache_name)
+        if cached is not None:
+            return jsonify(cached), 200
+        
+        payload = {
+            'success': True,
+            'heatmap': build_heatmap(uid)
+        }
+        stats_cache.set(uid, cache_name, None, payload)
+        
+        return jsonify(payload), 200
+        
+    except Exception as e:
+        return _internal_error('Failed to build heatmap', e)
+
+
+@activity_bp.route('/api/activity/cache', methods=['GET'])
+@admin_required
+def get_cache_counters(current_user):
+    """
+    Hit/miss/eviction counters of the stats response cache (this process only, admin only)
+    """
+    return jsonify({
+        'success': True,
+        'cache': stats_cache.counters()
+    }), 200
+
+
+@activity_bp.route('/api/activity/rate-limit', methods=['GET'])
+@admin_required
+def get_rate_limit_counters(current_user):
+    """
+    Allowed/shed/rejected request counters of the rate limiter (this process only, admin only)
+    """
+    return jsonify({
+        'success': True,
+        'rate_limit': rate_limiter.counters()
+    }), 200
+
+
+@activity_bp.route('/api/activity/reaper', methods=['GET'])
+@admin_required
+def get_reaper_counters(current_user):
+    """
+    Counters of the background stale-session reaper (this process only, admin only)
+    """
+    return jsonify({
+        'success': True,
+        'reaper': current_app.extensions['stale_session_reaper'].counters()
+    }), 200
 
 
 @activity_bp.route('/api/activity/session/<int:typing_id>', methods=['GET'])
 @token_required
+@read_only
 def get_typing_session(current_user, typing_id):
     """
     Get a specific typing session by ID
     """
     try:
-        # Get the user from database by GitHub ID
-        user = User.query.filter_by(github_id=current_user['id']).first()
+        # Internal user id comes straight from the token (see token_required)
+        uid = current_user.get('uid')
         
-        if not user:
+        if not uid:
             return jsonify({
                 'error': 'User not found',
                 'message': 'Please authenticate first'
             }), 404
         
+        etag = activity_etag(
+            uid, f'session/{typing_id}', activity_version(uid),
+            window_seconds=current_app.config['STATS_CACHE_TTL_SECONDS']
+        )
+        if is_fresh(etag):
+            return not_modified(etag)
+        
         # Get the session
         session = TypingSession.query.filter_by(
             typing_id=typing_id,
-            uid=user.uid
+            uid=uid
         ).first()
         
         if not session:
@@ -407,14 +1302,11 @@ def get_typing_session(current_user, typing_id):
                 'message': 'No session found with this ID'
             }), 404
         
-        return jsonify({
+        return with_etag(jsonify({
             'success': True,
             'session': session.to_dict()
-        }), 200
+        }), etag), 200
         
     except Exception as e:
-        return jsonify({
-            'error': 'Failed to fetch session',
-            'message': str(e)
-        }), 500
+        return _internal_error('Failed to fetch session', e)
 
@@ -1,10 +1,21 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request
 from flask_cors import CORS
-from config import config
-from models import db, User, Post, TypingSession
+from config import config, engine_options
+from models import db, TypingSession
 from auth import auth_bp
 from auth_utils import get_command_explanation
 from activity import activity_bp
+from heartbeat_buffer import heartbeat_buffer
+from stats_cache import stats_cache
+from reaper import stale_session_reaper
+from events import activity_events
+from rate_limit import rate_limiter
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, metrics
+from slow_query import slow_query_log
+from profiling import profiling_bp, request_profiler
+from replicas import read_only, replica_router
+from engine_profile import engine_profile
+from serializers import USER_COLUMNS, USER_FIELDS, POST_COLUMNS, POST_FIELDS, json_response, serialize_rows, wants_columnar
 from terminal import terminal_bp
 import os
 from dotenv import load_dotenv
@@ -16,15 +27,42 @@ app.config['SECRET_KEY'] = os.getenv('SECRET_KEY')
 api_key = os.getenv("GEMINI_API_KEY")
 client = genai.Client(api_key=api_key)
 
-def create_app(config_name='default'):
-    """Application factory"""
+def create_app(config_name='default', background_jobs=True):
+    """
+    Application factory
+    
+    Args:
+        config_name (str): Key in config.config
+        background_jobs (bool): Run the reaper thread (stale session closing,
+            idempotency key purging). Command-line scripts pass False so
+            nothing writes sessions or rollup rows while they run.
+    """
     app = Flask(__name__)
     
     # Load configuration from config.py (single source of truth)
     app.config.from_object(config[config_name])
+    if not background_jobs:
+        app.config['REAPER_ENABLED'] = False
+        app.config['IDEMPOTENCY_PURGE_ENABLED'] = False
+    
+    # Pool sizing, pre-ping, timeouts and application_name (DB_* settings)
+    app.config.setdefault(
+        'SQLALCHEMY_ENGINE_OPTIONS',
+        engine_options(app.config, app.config['SQLALCHEMY_DATABASE_URI'])
+    )
     
     # Initialize extensions
     db.init_app(app)
+    replica_router.init_app(app)
+    engine_profile.init_app(app)
+    heartbeat_buffer.init_app(app)
+    stats_cache.init_app(app)
+    stale_session_reaper.init_app(app)
+    activity_events.init_app(app)
+    rate_limiter.init_app(app)
+    metrics.init_app(app)
+    slow_query_log.init_app(app)
+    request_profiler.init_app(app)
     CORS(app)
     
     # Register routes
@@ -36,23 +74,34 @@ def create_app(config_name='default'):
         })
     
     @app.route('/api/users', methods=['GET'])
+    @read_only
     def get_users():
-        users = User.query.all()
-        return jsonify([user.to_dict() for user in users])
+        # Plain column tuples; ?format=columnar returns parallel arrays per field
+        rows = db.session.query(*USER_COLUMNS).all()
+        return json_response(serialize_rows(rows, USER_FIELDS, columnar=wants_columnar(request.args)))
     
     @app.route('/api/posts', methods=['GET'])
+    @read_only
     def get_posts():
-        posts = Post.query.all()
-        return jsonify([post.to_dict() for post in posts])
+        rows = db.session.query(*POST_COLUMNS).all()
+        return json_response(serialize_rows(rows, POST_FIELDS, columnar=wants_columnar(request.args)))
     
     @app.route('/health')
     def health():
         return jsonify({'status': 'healthy'}), 200
 
+    @app.route('/metrics')
+    def prometheus_metrics():
+        # Prometheus text format, per worker process (no auth; keep it off the public network)
+        if not metrics.enabled:
+            return jsonify({'error': 'Not found', 'message': 'Metrics are disabled'}), 404
+        return Response(metrics.render(), content_type=METRICS_CONTENT_TYPE)
+
     # Register blueprints
     app.register_blueprint(auth_bp)
     app.register_blueprint(activity_bp)
     app.register_blueprint(terminal_bp)
+    app.register_blueprint(profiling_bp)
     
     # Create database tables
     with app.app_context():
@@ -71,10 +120,11 @@ def create_app(config_name='default'):
 
         try:
             # Call Gemini API
-            response = client.models.generate_content(
-                model="gemini-2.5-flash",
-                contents=user_message
-            )
+            with metrics.http_client_timer('gemini'):
+                response = client.models.generate_content(
+                    model="gemini-2.5-flash",
+                    contents=user_message
+                )
 
             # Get the text reply
             reply_text = response.text
@@ -1,6 +1,7 @@
 from flask import jsonify, redirect, request, Blueprint, current_app
 from auth_utils import generate_jwt_token, token_required, token_optional
 from models import db, User
+from metrics import metrics
 import requests
 import secrets
 
@@ -94,7 +95,8 @@ def auth_github_callback():
     }
     
     try:
-        token_response = requests.post(token_url, data=token_data, headers=token_headers)
+        with metrics.http_client_timer('github'):
+            token_response = requests.post(token_url, data=token_data, headers=token_headers)
         token_response.raise_for_status()
         token_json = token_response.json()
         
@@ -119,7 +121,8 @@ def auth_github_callback():
             'Accept': 'application/json'
         }
         
-        user_response = requests.get(user_url, headers=user_headers)
+        with metrics.http_client_timer('github'):
+            user_response = requests.get(user_url, headers=user_headers)
         user_response.raise_for_status()
         github_user = user_response.json()
         
@@ -127,7 +130,8 @@ def auth_github_callback():
         if not github_user.get('email'):
             try:
                 email_url = 'https://api.github.com/user/emails'
-                email_response = requests.get(email_url, headers=user_headers)
+                with metrics.http_client_timer('github'):
+                    email_response = requests.get(email_url, headers=user_headers)
                 email_response.raise_for_status()
                 emails = email_response.json()
                 # Get primary email
@@ -172,6 +176,7 @@ def auth_github_callback():
         # Prepare user data for JWT
         user_data = {
             'id': github_user['id'],
+            'uid': user.uid,  # None if the user could not be saved; resolved on use
             'login': github_user['login'],
             'name': github_user.get('name'),
             'email': github_user.get('email'),
@@ -195,7 +200,7 @@ def auth_github_callback():
             'token': jwt_token,
             'user': {
                 'id': user_data['id'],
-                'uid': user.uid if user else None,
+                'uid': user_data['uid'],
                 'login': user_data['login'],
                 'name': user_data['name'],
                 'email': user_data['email'],
@@ -229,6 +234,7 @@ def get_current_user(current_user):
         'authenticated': True,
         'user': {
             'id': current_user['id'],
+            'uid': current_user['uid'],
             'login': current_user['login'],
             'name': current_user['name'],
             'email': current_user['email'],
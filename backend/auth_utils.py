@@ -2,9 +2,13 @@
 JWT authentication utilities
 """
 import jwt
+import threading
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from functools import wraps
-from flask import request, jsonify, current_app
+from flask import request, jsonify, current_app, g
+from models import User
+from metrics import metrics
 
 import platform
 import subprocess
@@ -27,12 +31,13 @@ def get_command_explanation(command: str) -> str:
 
     # Linux/macOS: attempt man page
     try:
-        result = subprocess.run(
-            ["man", command],
-            capture_output=True,
-            text=True,
-            check=True
-        )
+        with metrics.subprocess_timer("man"):
+            result = subprocess.run(
+                ["man", command],
+                capture_output=True,
+                text=True,
+                check=True
+            )
         return result.stdout
     except FileNotFoundError:
         return f"No 'man' command found on this system."
@@ -42,17 +47,28 @@ def get_command_explanation(command: str) -> str:
 
 
 
+# Version 2 tokens carry the internal users.uid in user['uid']
+JWT_SCHEMA_VERSION = 2
+
+# github_id -> uid for version 1 tokens, so they also skip the users lookup after the first request
+_legacy_uid_cache = OrderedDict()
+_legacy_uid_cache_lock = threading.Lock()
+LEGACY_UID_CACHE_SIZE = 10000
+
+
 def generate_jwt_token(user_data):
     """
     Generate a JWT token for a user
     
     Args:
-        user_data (dict): User information to encode in the token
+        user_data (dict): User information to encode in the token, including
+            'id' (GitHub id) and 'uid' (internal user id)
         
     Returns:
         str: JWT token
     """
     payload = {
+        'ver': JWT_SCHEMA_VERSION,
         'user': user_data,
         'iat': datetime.utcnow(),
         'exp': datetime.utcnow() + timedelta(hours=current_app.config['JWT_EXPIRATION_HOURS'])
@@ -90,6 +106,43 @@ def decode_jwt_token(token):
         return None  # Invalid token
 
 
+def resolve_token_user(payload):
+    """
+    Return the user claims of a decoded token, making sure 'uid' is set
+    
+    Tokens issued before uid was embedded (no 'ver' claim) only carry the
+    GitHub id; their uid is looked up once and then cached in-process.
+    
+    Args:
+        payload (dict): Decoded JWT payload
+        
+    Returns:
+        dict: User claims with 'uid' (None if the user no longer exists)
+    """
+    user = dict(payload.get('user') or {})
+    
+    if payload.get('ver', 1) >= JWT_SCHEMA_VERSION and user.get('uid'):
+        return user
+    
+    github_id = user.get('id')
+    with _legacy_uid_cache_lock:
+        uid = _legacy_uid_cache.get(github_id)
+        if uid is not None:
+            _legacy_uid_cache.move_to_end(github_id)
+    
+    if uid is None and github_id is not None:
+        db_user = User.query.filter_by(github_id=github_id).first()
+        uid = db_user.uid if db_user else None
+        if uid is not None:
+            with _legacy_uid_cache_lock:
+                _legacy_uid_cache[github_id] = uid
+                if len(_legacy_uid_cache) > LEGACY_UID_CACHE_SIZE:
+                    _legacy_uid_cache.popitem(last=False)
+    
+    user['uid'] = uid
+    return user
+
+
 def get_token_from_header():
     """
     Extract JWT token from Authorization header
@@ -111,10 +164,26 @@ def get_token_from_header():
     return parts[1]
 
 
+def get_token_payload():
+    """
+    Decoded JWT payload of the current request, decoded at most once
+    
+    Returns:
+        dict: Decoded token payload or None if missing or invalid
+    """
+    if '_jwt_payload' not in g:
+        token = get_token_from_header()
+        g._jwt_payload = decode_jwt_token(token) if token else None
+    return g._jwt_payload
+
+
 def token_required(f):
     """
     Decorator to require valid JWT token for a route
     
+    current_user carries the token's user claims, including the internal
+    'uid', so routes don't need to look the user up.
+    
     Usage:
         @app.route('/protected')
         @token_required
@@ -131,7 +200,7 @@ def token_required(f):
                 'message': 'No token provided'
             }), 401
         
-        payload = decode_jwt_token(token)
+        payload = get_token_payload()
         
         if not payload:
             return jsonify({
@@ -140,7 +209,7 @@ def token_required(f):
             }), 401
         
         # Pass the user data to the route
-        return f(current_user=payload.get('user'), *args, **kwargs)
+        return f(current_user=resolve_token_user(payload), *args, **kwargs)
     
     return decorated
 
@@ -164,11 +233,49 @@ def token_optional(f):
         current_user = None
         
         if token:
-            payload = decode_jwt_token(token)
+            payload = get_token_payload()
             if payload:
-                current_user = payload.get('user')
+                current_user = resolve_token_user(payload)
         
         return f(current_user=current_user, *args, **kwargs)
     
     return decorated
 
+
+
+def is_admin(user):
+    """
+    Whether token user claims belong to an admin (ADMIN_GITHUB_LOGINS)
+    
+    Args:
+        user (dict): User claims from a decoded token, or None
+        
+    Returns:
+        bool: True if the user's GitHub login is configured as admin
+    """
+    if not user or not user.get('login'):
+        return False
+    return user['login'].lower() in current_app.config['ADMIN_GITHUB_LOGINS']
+
+
+def admin_required(f):
+    """
+    Decorator to require a valid JWT token of an admin for a route
+    
+    Usage:
+        @app.route('/admin-only')
+        @admin_required
+        def admin_route(current_user):
+            return jsonify({'user': current_user})
+    """
+    @token_required
+    @wraps(f)
+    def decorated(current_user, *args, **kwargs):
+        if not is_admin(current_user):
+            return jsonify({
+                'error': 'Forbidden',
+                'message': 'Admin access required'
+            }), 403
+        return f(current_user=current_user, *args, **kwargs)
+    
+    return decorated
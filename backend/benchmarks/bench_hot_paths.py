@@ -0,0 +1,141 @@
+"""
+Microbenchmarks for per-request hot paths (no database needed)
+
+- decode_jwt_token:        verify and decode one token
+- token_required:          decorator overhead for one request (token decoded once)
+- metrics_request_hooks:   per-request cost of the /metrics before/after_request
+                           hooks, with five SQL statements counted
+- typing_session_to_dict:  TypingSession.to_dict() on a closed session
+- stats_by_date:           the post-processing loop of /api/activity/stats on a
+                           month of rollup rows
+- sanitize_command_name:   _sanitize_command_name on typical /chat input
+- extract_man_text:        BeautifulSoup extraction of a man7.org page
+                           (fixtures/man7_ls.1.html)
+
+Usage:
+    python benchmarks/bench_hot_paths.py
+    python benchmarks/bench_hot_paths.py --json before.json
+    python benchmarks/bench_hot_paths.py --compare before.json -k jwt
+"""
+import os
+import sys
+from datetime import date, datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask, Response, g
+
+from activity import _stats_by_date
+from auth_utils import decode_jwt_token, generate_jwt_token, token_required
+from config import config
+from metrics import Metrics
+from models import TypingSession
+from scraper_service import _extract_man_text, _sanitize_command_name
+from runner import Suite, main
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+USER_CLAIMS = {
+    'id': 12345678,
+    'uid': 42,
+    'login': 'octocat',
+    'name': 'The Octocat',
+    'email': 'octocat@example.com',
+    'avatar_url': 'https://avatars.githubusercontent.com/u/12345678?v=4'
+}
+
+suite = Suite('hot_paths')
+
+
+def make_app():
+    """Bare app with the real configuration (app.create_app also needs API keys and a database)"""
+    app = Flask(__name__)
+    app.config.from_object(config['default'])
+    return app
+
+
+@suite.bench(group='auth')
+def decode_jwt():
+    app = make_app()
+    with app.app_context():
+        token = generate_jwt_token(USER_CLAIMS)
+        yield lambda: decode_jwt_token(token)
+
+
+@suite.bench(group='auth')
+def token_required_overhead():
+    app = make_app()
+    view = token_required(lambda current_user: current_user)
+    with app.app_context():
+        token = generate_jwt_token(USER_CLAIMS)
+    with app.test_request_context(headers={'Authorization': f'Bearer {token}'}):
+        def request():
+            # A new request has not decoded its token yet
+            g.pop('_jwt_payload', None)
+            return view()
+        yield request
+
+
+@suite.bench(group='metrics')
+def metrics_request_hooks():
+    app = make_app()
+    metrics = Metrics()
+    metrics.enabled = True
+    response = Response()
+    with app.test_request_context('/api/activity/start', method='POST'):
+        def request():
+            metrics._before_request()
+            for _ in range(5):
+                metrics._before_cursor_execute(None, None, None, None, None, False)
+                metrics._after_cursor_execute(None, None, None, None, None, False)
+            metrics._after_request(response)
+            metrics._teardown_request(None)
+        yield request
+
+
+@suite.bench(group='serialization')
+def typing_session_to_dict():
+    started_at = datetime(2025, 10, 5, 10, 0, tzinfo=timezone.utc)
+    ended_at = started_at + timedelta(minutes=25)
+    session = TypingSession(
+        typing_id=1, uid=42, started_at=started_at, ended_at=ended_at,
+        language_tag='python', source='vscode', device_id='device-1',
+        created_at=started_at, updated_at=ended_at
+    )
+    return session.to_dict
+
+
+@suite.bench(group='stats')
+def stats_by_date():
+    # 30 days x 5 languages x 2 sources, plus one open session per day
+    languages = ['python', 'typescript', 'rust', 'go', None]
+    today = date(2025, 10, 31)
+    rows = []
+    for day in range(30):
+        on = today - timedelta(days=day)
+        for i, language in enumerate(languages):
+            for source in ('vscode', 'web'):
+                rows.append((on, language, source, 600.0 * (i + 1) + day, 3))
+        rows.append((on, 'python', 'vscode', 0, 1))
+    return lambda: _stats_by_date(rows)
+
+
+@suite.bench(group='terminal')
+def sanitize_command_name():
+    commands = ['ls', 'git commit -m "initial commit"', "grep -rn 'TODO' src/", 'tar -xzf archive.tar.gz']
+
+    def sanitize_all():
+        for command in commands:
+            _sanitize_command_name(command)
+    return sanitize_all
+
+
+@suite.bench(group='terminal')
+def extract_man_text():
+    with open(os.path.join(FIXTURES, 'man7_ls.1.html'), encoding='utf-8') as f:
+        html = f.read()
+    return lambda: _extract_man_text(html, 'ls')
+
+
+if __name__ == '__main__':
+    main(suite)
@@ -0,0 +1,70 @@
+"""
+Benchmark: interval union engine on large per-user histories
+
+Times the sweeps used for wall-clock accounting on synthetic multi-device
+histories (sessions on several devices, overlapping heavily):
+- union:     union_length() over unsorted intervals (includes the sort)
+- owned:     owned_lengths() over rank-sorted intervals (what rebuild_rollup runs per user)
+- close:     ownership_changes() for one closing session against the
+             already-counted sessions overlapping it (what every close runs)
+
+Usage:
+    python benchmarks/bench_intervals.py
+    python benchmarks/bench_intervals.py --sizes 10000 50000 100000 --devices 3
+"""
+import argparse
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from intervals import owned_lengths, ownership_changes, union_length
+
+
+def make_intervals(count, devices, seed=0):
+    """Sessions of 1-90 minutes with short gaps, interleaved across devices"""
+    rng = random.Random(seed)
+    intervals = []
+    per_device = count // devices
+    for _ in range(devices):
+        t = 1_700_000_000.0
+        for _ in range(per_device):
+            t += rng.uniform(60, 3600)
+            length = rng.uniform(60, 90 * 60)
+            intervals.append((t, t + length))
+            t += length
+    rng.shuffle(intervals)
+    return intervals
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 50000], help='intervals per user')
+    parser.add_argument('--devices', type=int, default=2, help='devices per user (default: 2)')
+    parser.add_argument('--repeat', type=int, default=5, help='timing runs, best is reported (default: 5)')
+    args = parser.parse_args()
+
+    print(f"{args.devices} devices, best of {args.repeat}")
+    print(f"  {'intervals':>10} {'union ms':>10} {'owned ms':>10} {'close us':>10} {'overlap':>8}")
+    for size in args.sizes:
+        intervals = make_intervals(size, args.devices)
+        ranked = sorted(intervals)
+
+        union_s = min(timeit.repeat(lambda: union_length(intervals), number=1, repeat=args.repeat))
+        owned_s = min(timeit.repeat(lambda: owned_lengths(ranked), number=1, repeat=args.repeat))
+
+        # A session closing at the end of the history, against what it overlaps
+        start, end = ranked[-1]
+        existing = [((s, i), s, e) for i, (s, e) in enumerate(ranked[:-1]) if e > start - 86400]
+        added = [((start, size), start, end)]
+        close_s = min(timeit.repeat(lambda: ownership_changes(existing, added), number=100, repeat=args.repeat)) / 100
+
+        raw = sum(e - s for s, e in intervals)
+        overlap = 1 - union_length(intervals) / raw
+        print(f"  {size:>10} {union_s * 1000:>10.2f} {owned_s * 1000:>10.2f} {close_s * 1e6:>10.1f} {overlap:>7.1%}")
+
+
+if __name__ == '__main__':
+    main()
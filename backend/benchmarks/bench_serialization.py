@@ -0,0 +1,78 @@
+"""
+Benchmark: ORM to_dict() + jsonify vs column tuples + serializers.dumps
+
+Serializes the same synthetic page of typing sessions three ways:
+- orm:      TypingSession objects -> to_dict() -> json.dumps (what jsonify does)
+- tuples:   column tuples -> dicts -> serializers.dumps
+- columnar: column tuples -> parallel arrays -> serializers.dumps
+
+Row hydration is included for the ORM path (objects are built from tuples
+each round), so the numbers reflect everything after the database returns rows.
+
+Usage:
+    python benchmarks/bench_serialization.py
+    python benchmarks/bench_serialization.py --rows 500 --repeat 7
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import TypingSession
+import serializers
+from serializers import SESSION_FIELDS, dumps, serialize_rows
+
+
+def make_rows(count):
+    """Column tuples shaped like a SESSION_COLUMNS query result"""
+    start = datetime(2025, 10, 1, tzinfo=timezone.utc)
+    rows = []
+    for i in range(count):
+        started_at = start + timedelta(minutes=7 * i)
+        ended_at = started_at + timedelta(seconds=60 + i % 900)
+        rows.append((
+            i + 1, 1, started_at, ended_at, ('python', 'rust', None)[i % 3], 'web',
+            f'device-{i % 4}', started_at, ended_at, (ended_at - started_at).total_seconds()
+        ))
+    return rows
+
+
+def orm_path(rows):
+    sessions = [TypingSession(**dict(zip(SESSION_FIELDS[:-1], row[:-1]))) for row in rows]
+    return json.dumps({'sessions': [session.to_dict() for session in sessions]}).encode()
+
+
+def tuples_path(rows):
+    return dumps({'sessions': serialize_rows(rows, SESSION_FIELDS)})
+
+
+def columnar_path(rows):
+    return dumps({'sessions': serialize_rows(rows, SESSION_FIELDS, columnar=True)})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rows', type=int, default=100, help='sessions per page (default: 100)')
+    parser.add_argument('--number', type=int, default=200, help='calls per timing run (default: 200)')
+    parser.add_argument('--repeat', type=int, default=5, help='timing runs, best is reported (default: 5)')
+    args = parser.parse_args()
+
+    rows = make_rows(args.rows)
+    encoder = 'orjson' if serializers.orjson is not None else 'json (orjson not installed)'
+    print(f"{args.rows} rows, best of {args.repeat} x {args.number} calls, encoder: {encoder}")
+
+    baseline = None
+    for name, func in (('orm', orm_path), ('tuples', tuples_path), ('columnar', columnar_path)):
+        best = min(timeit.repeat(lambda: func(rows), number=args.number, repeat=args.repeat))
+        per_call_us = best / args.number * 1e6
+        baseline = baseline or per_call_us
+        size = len(func(rows))
+        print(f"  {name:<9} {per_call_us:10.1f} us/page  {baseline / per_call_us:5.1f}x  {size:8d} bytes")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+"""
+Concurrency check: simultaneous heartbeats for one device
+
+Runs --threads threads that each send --heartbeats POST /api/activity/start
+for the same user and device, alternating the language so that requests take
+the database path (touch, language switch, insert) instead of being absorbed
+by the heartbeat buffer. Exits with status 1 when any request fails with a
+5xx or the stored sessions break an invariant:
+
+- at most one open session for the device
+- every closed session has ended_at >= started_at
+- every closed session was counted exactly once in the daily rollup
+
+The single-statement heartbeat path only runs on PostgreSQL; --embedded DIR
+starts a throwaway server (pip install pgserver).
+
+Usage:
+    python benchmarks/heartbeat_race.py --embedded /tmp/race-pg
+    python benchmarks/heartbeat_race.py --threads 12 --heartbeats 30
+"""
+import argparse
+import os
+import sys
+import threading
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import func, insert
+
+import config
+
+try:
+    import pgserver
+except ImportError:  # optional dependency
+    pgserver = None
+
+RACE_GITHUB_ID = 7_999_999_999
+DEVICE_ID = 'heartbeat-race-device'
+LANGUAGES = ['python', 'typescript']
+
+
+def prepare_user():
+    """Get or create the race user and clear its sessions and rollup rows"""
+    from models import db, User, TypingSession, TypingDailyRollup, UserActivityHeatmap
+
+    uid = db.session.query(User.uid).filter(User.github_id == RACE_GITHUB_ID).scalar()
+    if uid is None:
+        db.session.execute(insert(User), [{'github_id': RACE_GITHUB_ID, 'username': 'heartbeat-race'}])
+        db.session.commit()
+        return prepare_user()
+    for model in (TypingSession, TypingDailyRollup, UserActivityHeatmap):
+        model.query.filter(model.uid == uid).delete(synchronize_session=False)
+    db.session.commit()
+    return uid
+
+
+def check_invariants(uid):
+    """
+    Returns:
+        list: Descriptions of the invariants that do not hold
+    """
+    from models import db, TypingSession, TypingDailyRollup
+
+    failures = []
+    sessions = TypingSession.query.filter_by(uid=uid, device_id=DEVICE_ID).all()
+    open_sessions = [session for session in sessions if session.ended_at is None]
+    closed_sessions = [session for session in sessions if session.ended_at is not None]
+
+    if len(open_sessions) > 1:
+        failures.append(f'{len(open_sessions)} open sessions for one device')
+    backwards = [session.typing_id for session in closed_sessions if session.ended_at < session.started_at]
+    if backwards:
+        failures.append(f'sessions ending before they start: {backwards}')
+
+    rolled_up = db.session.query(
+        func.coalesce(func.sum(TypingDailyRollup.session_count), 0)
+    ).filter(TypingDailyRollup.uid == uid).scalar()
+    if rolled_up != len(closed_sessions):
+        failures.append(f'rollup counts {rolled_up} sessions, {len(closed_sessions)} are closed')
+
+    print(f"{len(sessions)} sessions stored: {len(open_sessions)} open, {len(closed_sessions)} closed")
+    return failures
+
+
+def run_thread(app, token, index, heartbeats, statuses, lock):
+    client = app.test_client()
+    for n in range(heartbeats):
+        response = client.post('/api/activity/start', headers={'Authorization': f'Bearer {token}'}, json={
+            'language_tag': LANGUAGES[(index + n) % len(LANGUAGES)],
+            'source': 'vscode',
+            'device_id': DEVICE_ID
+        })
+        with lock:
+            statuses[response.status_code] += 1
+            if response.status_code >= 500:
+                print(f"  {response.status_code}: {response.get_json(silent=True)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Send simultaneous heartbeats for one device')
+    parser.add_argument('--threads', type=int, default=12, help='Concurrent clients (default: 12)')
+    parser.add_argument('--heartbeats', type=int, default=30, help='Heartbeats per client (default: 30)')
+    parser.add_argument('--database-url', help='PostgreSQL database to run against')
+    parser.add_argument('--embedded', metavar='DIR', help='Run a throwaway PostgreSQL in DIR (requires pgserver)')
+    args = parser.parse_args()
+
+    if args.embedded:
+        if pgserver is None:
+            parser.error('--embedded requires pgserver: pip install pgserver')
+        uri = pgserver.get_server(args.embedded, cleanup_mode=None).get_uri()
+        # Use the psycopg2 driver from requirements.txt
+        args.database_url = uri.replace('postgresql://', 'postgresql+psycopg2://', 1)
+    if args.database_url:
+        config.Config.SQLALCHEMY_DATABASE_URI = args.database_url
+    # Every request has to reach the heartbeat code
+    config.Config.RATE_LIMIT_ENABLED = False
+    config.Config.DB_POOL_SIZE = max(config.Config.DB_POOL_SIZE, args.threads)
+
+    from app import create_app
+    from auth_utils import generate_jwt_token
+    from models import db
+
+    # No reaper: nothing else may close the device's sessions
+    app = create_app(background_jobs=False)
+    with app.app_context():
+        if db.engine.dialect.name != 'postgresql':
+            parser.error('needs a PostgreSQL database (--database-url or --embedded)')
+        uid = prepare_user()
+        token = generate_jwt_token({'id': RACE_GITHUB_ID, 'uid': uid, 'login': 'heartbeat-race',
+                                    'name': None, 'email': None, 'avatar_url': None})
+
+    statuses = Counter()
+    lock = threading.Lock()
+    print(f"Sending {args.threads} x {args.heartbeats} heartbeats for one device...")
+    threads = [
+        threading.Thread(target=run_thread, args=(app, token, i, args.heartbeats, statuses, lock))
+        for i in range(args.threads)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    print('Statuses: ' + ' '.join(f'{status}:{count}' for status, count in sorted(statuses.items())))
+
+    with app.app_context():
+        failures = check_invariants(uid)
+    failures += [f'{count} requests returned {status}' for status, count in statuses.items() if status >= 500]
+
+    if failures:
+        for failure in failures:
+            print(f"✗ {failure}")
+        sys.exit(1)
+    print("✓ No errors, all invariants hold")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,429 @@
+"""
+Load test: thousands of simulated VS Code clients against the activity API
+
+Each client behaves like the extension's ActivityTracker
+(extension/src/activity-tracker.ts): while the user types it sends
+POST /api/activity/start at most every 30 seconds (sometimes with a new
+language, as when switching files), and after 60 seconds without typing it
+sends POST /api/activity/end. Typing bursts and the breaks between them have
+random lengths; now and then a client also opens the dashboard
+(GET /api/activity/stats and /api/activity/sessions).
+
+Reports throughput, p50/p95/p99 latency and status codes per endpoint, and -
+when the app runs in-process - SQL statements per request. Background work
+(heartbeat buffer flushes, the reaper) is counted separately.
+
+Targets:
+- in-process (default): create_app() with the database from config.py or
+  --database-url, driven through the Flask test client
+- --embedded DIR: same, on a throwaway PostgreSQL in DIR (pip install pgserver)
+- --target URL: a running server, e.g. gunicorn; users and tokens are still
+  created through config.py's database, so it must be the same one
+
+Load test users have github_id >= 9000000000 and are reused between runs;
+--cleanup deletes them and their sessions afterwards.
+
+Usage:
+    python benchmarks/load_test.py --clients 1000 --duration 60 --speedup 10
+    python benchmarks/load_test.py --embedded /tmp/loadtest-pg --clients 200
+    python benchmarks/load_test.py --target http://localhost:5000 --clients 2000 --workers 64
+"""
+import argparse
+import heapq
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests
+from sqlalchemy import event, insert, select
+
+import config
+
+try:
+    import pgserver
+except ImportError:  # optional dependency
+    pgserver = None
+
+# Client cadence, from extension/src/activity-tracker.ts
+THROTTLE_SECONDS = 30
+IDLE_TIMEOUT_SECONDS = 60
+
+# Typing bursts of 1-40 heartbeats (30 s - 20 min), breaks averaging 10 minutes
+MAX_BURST_HEARTBEATS = 40
+MEAN_BREAK_SECONDS = 600
+LANGUAGE_SWITCH_PROBABILITY = 0.08
+DASHBOARD_PROBABILITY = 0.05
+
+LANGUAGES = ['python', 'typescript', 'javascript', 'java', 'go', 'rust', 'cpp', 'markdown']
+LANGUAGE_WEIGHTS = [30, 25, 15, 10, 7, 5, 5, 3]
+
+LOADTEST_GITHUB_ID_BASE = 9_000_000_000
+
+
+class SimulatedClient:
+    """One editor window on one device"""
+
+    def __init__(self, index, token, rng):
+        self.token = token
+        self.device_id = f'loadtest-device-{index}'
+        self.language = self._pick_language(rng)
+        self.typing_id = None
+        self.heartbeats_left = 0
+
+    @staticmethod
+    def _pick_language(rng):
+        return rng.choices(LANGUAGES, LANGUAGE_WEIGHTS)[0]
+
+    def step(self, send, rng):
+        """
+        Perform the next action
+
+        Returns:
+            float: Simulated seconds until the next action
+        """
+        if self.heartbeats_left == 0 and self.typing_id is not None:
+            # Idle timer fired
+            send('POST', '/api/activity/end', self.token,
+                 {'typing_id': self.typing_id, 'device_id': self.device_id})
+            self.typing_id = None
+            return rng.expovariate(1 / MEAN_BREAK_SECONDS)
+
+        if self.heartbeats_left == 0:
+            self.heartbeats_left = rng.randint(1, MAX_BURST_HEARTBEATS)
+            if rng.random() < DASHBOARD_PROBABILITY:
+                send('GET', '/api/activity/stats', self.token)
+                send('GET', '/api/activity/sessions?limit=20', self.token)
+        elif rng.random() < LANGUAGE_SWITCH_PROBABILITY:
+            self.language = self._pick_language(rng)
+
+        status, body = send('POST', '/api/activity/start', self.token, {
+            'language_tag': self.language,
+            'source': 'vscode',
+            'device_id': self.device_id
+        })
+        if status in (200, 201) and body and body.get('session'):
+            self.typing_id = body['session']['typing_id']
+        self.heartbeats_left -= 1
+
+        if self.heartbeats_left == 0:
+            return IDLE_TIMEOUT_SECONDS
+        # Heartbeats go out on the first keystroke after the throttle window
+        return THROTTLE_SECONDS + rng.expovariate(1 / 5)
+
+
+class Recorder:
+    """Per-worker results; merged once the run is over so workers never share a lock"""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)   # endpoint -> seconds
+        self.queries = defaultdict(list)     # endpoint -> statements per request
+        self.statuses = defaultdict(Counter)
+        self.max_lag = 0.0
+
+    def add(self, endpoint, status, elapsed, queries):
+        self.latencies[endpoint].append(elapsed)
+        self.statuses[endpoint][status] += 1
+        if queries is not None:
+            self.queries[endpoint].append(queries)
+
+    def merge(self, other):
+        for endpoint, values in other.latencies.items():
+            self.latencies[endpoint].extend(values)
+        for endpoint, values in other.queries.items():
+            self.queries[endpoint].extend(values)
+        for endpoint, counts in other.statuses.items():
+            self.statuses[endpoint].update(counts)
+        self.max_lag = max(self.max_lag, other.max_lag)
+
+
+class StatementCounter:
+    """Counts SQL statements per thread, so each request's queries can be attributed to it"""
+
+    def __init__(self, engine):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.total = 0
+        event.listen(engine, 'before_cursor_execute', self._on_execute)
+
+    def _on_execute(self, *args):
+        self._local.count = getattr(self._local, 'count', 0) + 1
+        with self._lock:
+            self.total += 1
+
+    def current(self):
+        return getattr(self._local, 'count', 0)
+
+
+class InProcessTransport:
+    """Requests through the Flask test client, with per-request SQL statement counts"""
+
+    def __init__(self, app, statements):
+        self.app = app
+        self.statements = statements
+        self._local = threading.local()
+
+    def send(self, method, path, token, body=None):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        before = self.statements.current()
+        started = time.perf_counter()
+        response = client.open(path, method=method, json=body,
+                               headers={'Authorization': f'Bearer {token}'})
+        elapsed = time.perf_counter() - started
+        return response.status_code, response.get_json(silent=True), elapsed, self.statements.current() - before
+
+
+class HttpTransport:
+    """Requests over HTTP to a running server, one connection pool per worker"""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self._local = threading.local()
+
+    def send(self, method, path, token, body=None):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        started = time.perf_counter()
+        try:
+            response = session.request(method, self.base_url + path, json=body, timeout=30,
+                                       headers={'Authorization': f'Bearer {token}'})
+            status = response.status_code
+            payload = response.json() if response.content else None
+        except (requests.RequestException, ValueError):
+            status, payload = 'error', None
+        return status, payload, time.perf_counter() - started, None
+
+
+def ensure_users(count):
+    """
+    Get or create the load test users
+
+    Returns:
+        list: (uid, github_id, username) tuples
+    """
+    from models import db, User
+
+    existing = {
+        github_id: (uid, github_id, username)
+        for uid, github_id, username in db.session.query(User.uid, User.github_id, User.username)
+        .filter(User.github_id >= LOADTEST_GITHUB_ID_BASE,
+                User.github_id < LOADTEST_GITHUB_ID_BASE + count)
+    }
+    missing = [
+        {'github_id': LOADTEST_GITHUB_ID_BASE + i, 'username': f'loadtest-{i}'}
+        for i in range(count) if LOADTEST_GITHUB_ID_BASE + i not in existing
+    ]
+    if missing:
+        db.session.execute(insert(User), missing)
+        db.session.commit()
+        return ensure_users(count)
+    return [existing[LOADTEST_GITHUB_ID_BASE + i] for i in range(count)]
+
+
+def delete_users():
+    """Delete every load test user and their sessions"""
+    from models import db, User, TypingSession
+
+    uids = select(User.uid).where(User.github_id >= LOADTEST_GITHUB_ID_BASE)
+    sessions = TypingSession.query.filter(TypingSession.uid.in_(uids)).delete(synchronize_session=False)
+    users = User.query.filter(User.github_id >= LOADTEST_GITHUB_ID_BASE).delete(synchronize_session=False)
+    db.session.commit()
+    return users, sessions
+
+
+def run_worker(clients, send, recorder, speedup, deadline, seed):
+    """Drive a share of the clients until the deadline"""
+    rng = random.Random(seed)
+    start = time.monotonic()
+
+    def timed_send(method, path, token, body=None):
+        status, payload, elapsed, queries = send(method, path, token, body)
+        recorder.add(f'{method} {path.split("?")[0]}', status, elapsed, queries)
+        return status, payload
+
+    # Spread the first heartbeats over one throttle window
+    heap = [(start + rng.uniform(0, THROTTLE_SECONDS / speedup), i) for i in range(len(clients))]
+    heapq.heapify(heap)
+    while heap:
+        due, i = heap[0]
+        if due >= deadline:
+            break
+        now = time.monotonic()
+        if due > now:
+            time.sleep(due - now)
+            now = time.monotonic()
+        recorder.max_lag = max(recorder.max_lag, now - due)
+        delay = clients[i].step(timed_send, rng)
+        heapq.heapreplace(heap, (time.monotonic() + delay / speedup, i))
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(recorder, elapsed, background_queries):
+    endpoints = {}
+    for endpoint in sorted(recorder.latencies):
+        latencies = sorted(recorder.latencies[endpoint])
+        queries = recorder.queries.get(endpoint)
+        statuses = recorder.statuses[endpoint]
+        endpoints[endpoint] = {
+            'requests': len(latencies),
+            'rps': round(len(latencies) / elapsed, 2),
+            'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+            'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+            'max_ms': round(latencies[-1] * 1000, 2),
+            'queries_per_request': round(sum(queries) / len(queries), 2) if queries else None,
+            'statuses': {str(status): count for status, count in sorted(statuses.items(), key=str)}
+        }
+    total = sum(result['requests'] for result in endpoints.values())
+    return {
+        'elapsed_seconds': round(elapsed, 2),
+        'requests': total,
+        'rps': round(total / elapsed, 2),
+        'max_schedule_lag_ms': round(recorder.max_lag * 1000, 2),
+        'background_queries': background_queries,
+        'endpoints': endpoints
+    }
+
+
+def print_summary(summary):
+    print(f"\n{summary['requests']} requests in {summary['elapsed_seconds']}s "
+          f"({summary['rps']} req/s), max schedule lag {summary['max_schedule_lag_ms']} ms")
+    if summary['background_queries'] is not None:
+        print(f"Background SQL statements (buffer flushes, reaper): {summary['background_queries']}")
+    print(f"\n{'endpoint':<32}{'requests':>9}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}"
+          f"{'p99 ms':>9}{'max ms':>9}{'sql/req':>9}  statuses")
+    for endpoint, result in summary['endpoints'].items():
+        queries = result['queries_per_request']
+        statuses = ' '.join(f'{status}:{count}' for status, count in result['statuses'].items())
+        print(f"{endpoint:<32}{result['requests']:>9}{result['rps']:>9}{result['p50_ms']:>9}"
+              f"{result['p95_ms']:>9}{result['p99_ms']:>9}{result['max_ms']:>9}"
+              f"{'-' if queries is None else queries:>9}  {statuses}")
+    if summary['max_schedule_lag_ms'] > 1000:
+        print("\nWarning: clients ran more than 1 s late; add --workers or lower --speedup "
+              "to keep the offered load as configured")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulate VS Code clients against the activity API')
+    parser.add_argument('--clients', type=int, default=500, help='Simulated editor windows (default: 500)')
+    parser.add_argument('--devices-per-user', type=int, default=1,
+                        help='Clients sharing one account (default: 1)')
+    parser.add_argument('--duration', type=float, default=60, help='Wall-clock seconds to run (default: 60)')
+    parser.add_argument('--speedup', type=float, default=1,
+                        help='Compress client timing by this factor, e.g. 10 = heartbeats every 3 s (default: 1)')
+    parser.add_argument('--workers', type=int, default=32, help='Threads issuing requests (default: 32)')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed (default: 0)')
+    parser.add_argument('--target', help='Base URL of a running server instead of the in-process app')
+    parser.add_argument('--database-url', help='Database for the in-process app and user setup')
+    parser.add_argument('--embedded', metavar='DIR', help='Run a throwaway PostgreSQL in DIR (requires pgserver)')
+    parser.add_argument('--json', metavar='PATH', help='Also write the results as JSON')
+    parser.add_argument('--cleanup', action='store_true', help='Delete load test users and sessions afterwards')
+    args = parser.parse_args()
+
+    if args.embedded:
+        if pgserver is None:
+            parser.error('--embedded requires pgserver: pip install pgserver')
+        uri = pgserver.get_server(args.embedded, cleanup_mode=None).get_uri()
+        # Use the psycopg2 driver from requirements.txt
+        args.database_url = uri.replace('postgresql://', 'postgresql+psycopg2://', 1)
+    if args.database_url:
+        config.Config.SQLALCHEMY_DATABASE_URI = args.database_url
+
+    from app import create_app
+    from auth_utils import generate_jwt_token
+    from models import db
+
+    app = create_app()
+    statements = None
+
+    with app.app_context():
+        if args.embedded:
+            db.create_all()
+        user_count = math.ceil(args.clients / args.devices_per_user)
+        print(f"Preparing {user_count} users...")
+        users = ensure_users(user_count)
+        tokens = [
+            generate_jwt_token({'id': github_id, 'uid': uid, 'login': username,
+                                'name': None, 'email': None, 'avatar_url': None})
+            for uid, github_id, username in users
+        ]
+        if not args.target:
+            statements = StatementCounter(db.engine)
+
+    transport = HttpTransport(args.target) if args.target else InProcessTransport(app, statements)
+    rng = random.Random(args.seed)
+    clients = [
+        SimulatedClient(i, tokens[i // args.devices_per_user], rng)
+        for i in range(args.clients)
+    ]
+
+    workers = min(args.workers, len(clients))
+    recorders = [Recorder() for _ in range(workers)]
+    print(f"Running {len(clients)} clients on {workers} workers for {args.duration}s "
+          f"(speedup {args.speedup}) against {args.target or 'the in-process app'}...")
+
+    started = time.monotonic()
+    deadline = started + args.duration
+    threads = [
+        threading.Thread(
+            target=run_worker,
+            args=(clients[w::workers], transport.send, recorders[w], args.speedup, deadline, args.seed + w),
+            daemon=True
+        )
+        for w in range(workers)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    recorder = Recorder()
+    for worker_recorder in recorders:
+        recorder.merge(worker_recorder)
+
+    background_queries = None
+    if statements is not None:
+        request_queries = sum(sum(values) for values in recorder.queries.values())
+        background_queries = statements.total - request_queries
+
+    summary = summarize(recorder, elapsed, background_queries)
+    summary['config'] = {
+        'clients': args.clients,
+        'devices_per_user': args.devices_per_user,
+        'duration': args.duration,
+        'speedup': args.speedup,
+        'workers': workers,
+        'target': args.target or 'in-process'
+    }
+    print_summary(summary)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(summary, f, indent=2)
+        print(f"\n✓ Results written to {args.json}")
+
+    if args.cleanup:
+        with app.app_context():
+            users_deleted, sessions_deleted = delete_users()
+        print(f"✓ Deleted {users_deleted} load test users and {sessions_deleted} sessions")
+
+
+if __name__ == '__main__':
+    main()
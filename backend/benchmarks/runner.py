@@ -0,0 +1,191 @@
+"""
+Minimal microbenchmark runner with JSON results
+
+Suites register cases in the style of pytest-benchmark fixtures: a setup
+function returns the zero-argument callable to time, or yields it when it
+needs to clean up afterwards (e.g. leave an app context):
+
+    suite = Suite('hot_paths')
+
+    @suite.bench(group='auth')
+    def decode_jwt():
+        with app.app_context():
+            token = generate_jwt_token(claims)
+            yield lambda: decode_jwt_token(token)
+
+    if __name__ == '__main__':
+        main(suite)
+
+Each case is calibrated with timeit's autorange (at least 0.2 s per round),
+then timed for a number of rounds. --json saves the results together with the
+machine and git commit; --compare loads an earlier file and reports the
+change in median time per case, exiting with status 1 if any case got slower
+than --threshold percent.
+"""
+import argparse
+import inspect
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import timeit
+from datetime import datetime, timezone
+
+RESULTS_VERSION = 1
+
+
+class Suite:
+    """Named collection of benchmark cases"""
+
+    def __init__(self, name):
+        self.name = name
+        self.cases = []   # (name, group, setup)
+
+    def bench(self, name=None, group=None):
+        """Register a setup function returning (or yielding) the callable to time"""
+        def register(setup):
+            self.cases.append((name or setup.__name__, group, setup))
+            return setup
+        return register
+
+
+def measure(func, rounds):
+    """
+    Time func
+
+    Returns:
+        dict: Per-call statistics in seconds, plus rounds, iterations per
+            round and operations per second
+    """
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    times = [total / number for total in timer.repeat(repeat=rounds, number=number)]
+    median = statistics.median(times)
+    return {
+        'min': min(times),
+        'max': max(times),
+        'mean': statistics.fmean(times),
+        'median': median,
+        'stddev': statistics.stdev(times) if len(times) > 1 else 0.0,
+        'rounds': rounds,
+        'iterations': number,
+        'ops': 1 / median if median else None
+    }
+
+
+def run_case(setup, rounds):
+    if inspect.isgeneratorfunction(setup):
+        fixture = setup()
+        try:
+            return measure(next(fixture), rounds)
+        finally:
+            fixture.close()
+    return measure(setup(), rounds)
+
+
+def machine_info():
+    return {
+        'python_implementation': platform.python_implementation(),
+        'python_version': platform.python_version(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count()
+    }
+
+
+def commit_info():
+    """Current git commit of the working tree, if available"""
+    def git(*args):
+        return subprocess.run(
+            ['git', *args], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+
+    try:
+        return {
+            'id': git('rev-parse', 'HEAD'),
+            'branch': git('rev-parse', '--abbrev-ref', 'HEAD'),
+            'dirty': bool(git('status', '--porcelain', '--untracked-files=no'))
+        }
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def format_time(seconds):
+    for unit, scale in (('s', 1), ('ms', 1e-3), ('us', 1e-6)):
+        if seconds >= scale:
+            return f'{seconds / scale:.2f} {unit}'
+    return f'{seconds / 1e-9:.0f} ns'
+
+
+def compare(results, baseline, threshold):
+    """
+    Print the change in median time per case against a baseline
+
+    Returns:
+        list: Names of cases that got slower by more than threshold percent
+    """
+    previous = {bench['name']: bench for bench in baseline['benchmarks']}
+    regressions = []
+    commit = (baseline.get('commit_info') or {}).get('id', 'unknown commit')[:12]
+    print(f"\nCompared with {commit} ({baseline.get('datetime', 'unknown date')}):")
+    for bench in results['benchmarks']:
+        old = previous.get(bench['name'])
+        if old is None:
+            print(f"  {bench['name']:<36} new")
+            continue
+        change = (bench['stats']['median'] / old['stats']['median'] - 1) * 100
+        flag = ''
+        if change > threshold:
+            flag = '  REGRESSION'
+            regressions.append(bench['name'])
+        elif change < -threshold:
+            flag = '  faster'
+        print(f"  {bench['name']:<36} {format_time(old['stats']['median']):>10} -> "
+              f"{format_time(bench['stats']['median']):>10}  {change:+6.1f}%{flag}")
+    return regressions
+
+
+def main(suite, argv=None):
+    """Command line entry point for a suite"""
+    parser = argparse.ArgumentParser(description=f'Run the {suite.name} benchmarks')
+    parser.add_argument('-k', dest='pattern', help='Only run cases whose name contains this')
+    parser.add_argument('--rounds', type=int, default=7, help='Timing rounds per case (default: 7)')
+    parser.add_argument('--json', metavar='PATH', help='Save the results as JSON')
+    parser.add_argument('--compare', metavar='PATH', help='Compare with results saved by an earlier --json run')
+    parser.add_argument('--threshold', type=float, default=10,
+                        help='Median slowdown in percent reported as a regression (default: 10)')
+    args = parser.parse_args(argv)
+
+    cases = [case for case in suite.cases if not args.pattern or args.pattern in case[0]]
+    results = {
+        'version': RESULTS_VERSION,
+        'suite': suite.name,
+        'datetime': datetime.now(timezone.utc).isoformat(),
+        'machine_info': machine_info(),
+        'commit_info': commit_info(),
+        'benchmarks': []
+    }
+
+    print(f"{suite.name}: {len(cases)} cases, {args.rounds} rounds each")
+    print(f"  {'name':<36} {'min':>10} {'median':>10} {'stddev':>10} {'ops/s':>12}")
+    for name, group, setup in cases:
+        stats = run_case(setup, args.rounds)
+        results['benchmarks'].append({'name': name, 'group': group, 'stats': stats})
+        print(f"  {name:<36} {format_time(stats['min']):>10} {format_time(stats['median']):>10} "
+              f"{format_time(stats['stddev']):>10} {stats['ops']:>12,.0f}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\n✓ Results written to {args.json}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} case(s) slower than the {args.threshold:g}% threshold")
+            sys.exit(1)
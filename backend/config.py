@@ -6,6 +6,7 @@ All settings are loaded from environment variables (.env file).
 """
 import os
 from dotenv import load_dotenv
+from sqlalchemy.engine import make_url
 
 # Load environment variables from .env file
 load_dotenv()
@@ -33,6 +34,23 @@ class Config:
         f"@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}"
     )
     
+    # Engine and Connection Pool Configuration (see engine_options below)
+    DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))
+    DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 10))
+    DB_POOL_TIMEOUT_SECONDS = float(os.getenv('DB_POOL_TIMEOUT_SECONDS', 30))
+    DB_POOL_RECYCLE_SECONDS = int(os.getenv('DB_POOL_RECYCLE_SECONDS', 1800))
+    DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', 'true').lower() == 'true'
+    DB_STATEMENT_TIMEOUT_MS = int(os.getenv('DB_STATEMENT_TIMEOUT_MS', 0))  # 0 = no limit
+    DB_APPLICATION_NAME = os.getenv('DB_APPLICATION_NAME', 'stormhacks-backend')
+    DB_PGBOUNCER_TRANSACTION_MODE = os.getenv('DB_PGBOUNCER_TRANSACTION_MODE', 'false').lower() == 'true'
+    
+    # Read replicas for read-only routes (comma-separated URIs; empty = primary only)
+    SQLALCHEMY_REPLICA_URIS = [
+        uri.strip() for uri in os.getenv('DATABASE_REPLICA_URLS', '').split(',') if uri.strip()
+    ]
+    REPLICA_MAX_LAG_SECONDS = float(os.getenv('REPLICA_MAX_LAG_SECONDS', 5))
+    REPLICA_HEALTH_CHECK_SECONDS = float(os.getenv('REPLICA_HEALTH_CHECK_SECONDS', 5))
+    
     # GitHub OAuth Configuration
     GITHUB_CLIENT_ID = os.getenv('GITHUB_CLIENT_ID')
     GITHUB_CLIENT_SECRET = os.getenv('GITHUB_CLIENT_SECRET')
@@ -42,6 +60,62 @@ class Config:
     JWT_SECRET_KEY = os.getenv('JWT_SECRET_KEY', SECRET_KEY)
     JWT_ALGORITHM = 'HS256'
     JWT_EXPIRATION_HOURS = int(os.getenv('JWT_EXPIRATION_HOURS', 24))
+    
+    # GitHub logins allowed to use admin endpoints (comma-separated)
+    ADMIN_GITHUB_LOGINS = [
+        login.strip().lower() for login in os.getenv('ADMIN_GITHUB_LOGINS', '').split(',') if login.strip()
+    ]
+    
+    # Activity Tracking Configuration
+    STALE_SESSION_SECONDS = int(os.getenv('STALE_SESSION_SECONDS', 300))
+    REAPER_ENABLED = os.getenv('REAPER_ENABLED', 'true').lower() == 'true'
+    REAPER_INTERVAL_SECONDS = float(os.getenv('REAPER_INTERVAL_SECONDS', 60))
+    REAPER_THRESHOLD_SECONDS = int(os.getenv('REAPER_THRESHOLD_SECONDS', STALE_SESSION_SECONDS))
+    HEARTBEAT_BUFFER_ENABLED = os.getenv('HEARTBEAT_BUFFER_ENABLED', 'true').lower() == 'true'
+    HEARTBEAT_FLUSH_INTERVAL_SECONDS = float(os.getenv('HEARTBEAT_FLUSH_INTERVAL_SECONDS', 5))
+    ACTIVITY_BATCH_MAX_EVENTS = int(os.getenv('ACTIVITY_BATCH_MAX_EVENTS', 5000))
+    ACTIVITY_BATCH_MAX_BYTES = int(os.getenv('ACTIVITY_BATCH_MAX_BYTES', 2 * 1024 * 1024))
+    ACTIVITY_BATCH_MAX_CLOCK_SKEW_SECONDS = int(os.getenv('ACTIVITY_BATCH_MAX_CLOCK_SKEW_SECONDS', 300))
+    ACTIVITY_EXPORT_CHUNK_SIZE = int(os.getenv('ACTIVITY_EXPORT_CHUNK_SIZE', 1000))
+    IDEMPOTENCY_TTL_SECONDS = int(os.getenv('IDEMPOTENCY_TTL_SECONDS', 86400))
+    IDEMPOTENCY_PURGE_ENABLED = os.getenv('IDEMPOTENCY_PURGE_ENABLED', 'true').lower() == 'true'
+    IDEMPOTENCY_LOCK_SECONDS = int(os.getenv('IDEMPOTENCY_LOCK_SECONDS', 60))
+    
+    # Stats Response Cache Configuration
+    STATS_CACHE_ENABLED = os.getenv('STATS_CACHE_ENABLED', 'true').lower() == 'true'
+    STATS_CACHE_BACKEND = os.getenv('STATS_CACHE_BACKEND', 'memory')  # 'memory' or 'sqlite'
+    STATS_CACHE_PATH = os.getenv('STATS_CACHE_PATH', 'instance/stats_cache.sqlite3')
+    STATS_CACHE_MAX_ENTRIES = int(os.getenv('STATS_CACHE_MAX_ENTRIES', 10000))
+    STATS_CACHE_TTL_SECONDS = float(os.getenv('STATS_CACHE_TTL_SECONDS', 30))
+    
+    # Live Activity Stream Configuration
+    ACTIVITY_STREAM_QUEUE_SIZE = int(os.getenv('ACTIVITY_STREAM_QUEUE_SIZE', 100))
+    ACTIVITY_STREAM_HEARTBEAT_SECONDS = float(os.getenv('ACTIVITY_STREAM_HEARTBEAT_SECONDS', 15))
+    ACTIVITY_STREAM_MAX_PER_USER = int(os.getenv('ACTIVITY_STREAM_MAX_PER_USER', 5))
+    
+    # Rate Limiting Configuration
+    RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+    RATE_LIMIT_HEARTBEAT_PER_SECOND = float(os.getenv('RATE_LIMIT_HEARTBEAT_PER_SECOND', 2))
+    RATE_LIMIT_HEARTBEAT_BURST = int(os.getenv('RATE_LIMIT_HEARTBEAT_BURST', 10))
+    RATE_LIMIT_DEFAULT_PER_SECOND = float(os.getenv('RATE_LIMIT_DEFAULT_PER_SECOND', 5))
+    RATE_LIMIT_DEFAULT_BURST = int(os.getenv('RATE_LIMIT_DEFAULT_BURST', 30))
+    RATE_LIMIT_MAX_BUCKETS = int(os.getenv('RATE_LIMIT_MAX_BUCKETS', 100000))
+    
+    # Metrics Configuration
+    METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+    
+    # Slow Query Log Configuration
+    SLOW_QUERY_LOG_ENABLED = os.getenv('SLOW_QUERY_LOG_ENABLED', 'true').lower() == 'true'
+    SLOW_QUERY_THRESHOLD_MS = float(os.getenv('SLOW_QUERY_THRESHOLD_MS', 200))
+    SLOW_QUERY_EXPLAIN_SAMPLE_RATE = float(os.getenv('SLOW_QUERY_EXPLAIN_SAMPLE_RATE', 0.1))
+    SLOW_QUERY_LOG_PATH = os.getenv('SLOW_QUERY_LOG_PATH', 'instance/slow_queries.log')
+    SLOW_QUERY_LOG_MAX_BYTES = int(os.getenv('SLOW_QUERY_LOG_MAX_BYTES', 10 * 1024 * 1024))
+    SLOW_QUERY_LOG_BACKUP_COUNT = int(os.getenv('SLOW_QUERY_LOG_BACKUP_COUNT', 5))
+    
+    # Request Profiling Configuration
+    PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', 'false').lower() == 'true'
+    PROFILING_DIR = os.getenv('PROFILING_DIR', 'instance/profiles')
+    PROFILING_MAX_PROFILES = int(os.getenv('PROFILING_MAX_PROFILES', 100))
 
 
 class DevelopmentConfig(Config):
@@ -54,6 +128,45 @@ class ProductionConfig(Config):
     DEBUG = False
 
 
+def engine_options(settings, uri):
+    """
+    SQLAlchemy create_engine() options for a database URI
+    
+    Builds the pool and connection settings from the DB_* configuration. On
+    PostgreSQL the statement timeout is sent as a startup parameter, except
+    behind PgBouncer in transaction pooling mode, which rejects it; there
+    engine_profile.py applies it with SET LOCAL in every transaction instead.
+    
+    Args:
+        settings (Mapping): App config (or a Config class as a dict)
+        uri (str): Database URI the engine is created for
+        
+    Returns:
+        dict: Keyword arguments for create_engine()
+    """
+    url = make_url(uri)
+    if url.get_backend_name() != 'postgresql':
+        return {'pool_pre_ping': settings['DB_POOL_PRE_PING']}
+    
+    connect_args = {'application_name': settings['DB_APPLICATION_NAME']}
+    if settings['DB_PGBOUNCER_TRANSACTION_MODE']:
+        # The driver a bare postgresql:// resolves to depends on the SQLAlchemy version
+        if url.get_dialect().driver == 'psycopg':
+            # psycopg 3 prepares repeated statements server-side; the next
+            # transaction may run on another server connection
+            connect_args['prepare_threshold'] = None
+    elif settings['DB_STATEMENT_TIMEOUT_MS'] > 0:
+        connect_args['options'] = f"-c statement_timeout={settings['DB_STATEMENT_TIMEOUT_MS']}"
+    
+    return {
+        'pool_size': settings['DB_POOL_SIZE'],
+        'max_overflow': settings['DB_MAX_OVERFLOW'],
+        'pool_timeout': settings['DB_POOL_TIMEOUT_SECONDS'],
+        'pool_recycle': settings['DB_POOL_RECYCLE_SECONDS'],
+        'pool_pre_ping': settings['DB_POOL_PRE_PING'],
+        'connect_args': connect_args
+    }
+
 config = {
     'development': DevelopmentConfig,
     'production': ProductionConfig,
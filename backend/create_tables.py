@@ -8,7 +8,7 @@ from models import db
 
 def create_tables():
     """Create all tables in the database"""
-    app = create_app()
+    app = create_app(background_jobs=False)
     
     with app.app_context():
         print("Creating all tables...")
@@ -10,7 +10,7 @@ from models import db
 
 def drop_tables():
     """Drop all tables from the database"""
-    app = create_app()
+    app = create_app(background_jobs=False)
     
     with app.app_context():
         # Get table names before dropping
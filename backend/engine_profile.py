@@ -0,0 +1,103 @@
+"""
+Runtime side of the database engine profile
+
+config.engine_options() builds the pool settings create_app passes to the
+engines. This extension adds what cannot be expressed as engine options:
+
+- Behind PgBouncer in transaction pooling mode (DB_PGBOUNCER_TRANSACTION_MODE),
+  server connections are shared between clients after every transaction, so
+  session settings would leak or be lost. DB_STATEMENT_TIMEOUT_MS is applied
+  with ``SET LOCAL`` at the start of every transaction instead (one extra
+  round trip per transaction; a timeout set on the database role with
+  ``ALTER ROLE ... SET statement_timeout`` avoids it).
+- Pool counters (connections opened, invalidated) for every engine, exported
+  with the current pool utilization through /metrics.
+"""
+import threading
+
+from sqlalchemy import event
+
+from replicas import all_engines
+
+
+class EngineProfile:
+    """
+    Statement timeouts for PgBouncer transaction mode and connection pool counters
+
+    Usage:
+        engine_profile = EngineProfile()
+        engine_profile.init_app(app)
+    """
+
+    def __init__(self, app=None):
+        self.pgbouncer_transaction_mode = False
+        self.statement_timeout_ms = 0
+        self._engines = {}   # engine -> {'name', 'connects', 'invalidations'}
+        self._lock = threading.Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Attach the listeners to the primary and replica engines"""
+        self.pgbouncer_transaction_mode = app.config['DB_PGBOUNCER_TRANSACTION_MODE']
+        self.statement_timeout_ms = app.config['DB_STATEMENT_TIMEOUT_MS']
+        app.extensions['engine_profile'] = self
+
+        router = app.extensions.get('replica_router')
+        names = ['primary'] + ([replica.name for replica in router.replicas] if router and router.enabled else [])
+        for name, engine in zip(names, all_engines(app)):
+            if engine in self._engines:
+                continue
+            self._engines[engine] = {'name': name, 'connects': 0, 'invalidations': 0}
+            event.listen(engine.pool, 'connect', self._on_connect(engine))
+            event.listen(engine.pool, 'invalidate', self._on_invalidate(engine))
+            if (self.pgbouncer_transaction_mode and self.statement_timeout_ms > 0
+                    and engine.dialect.name == 'postgresql'):
+                event.listen(engine, 'begin', self._set_local_timeout)
+
+    def counters(self):
+        """Pool state and counters per engine"""
+        pools = []
+        with self._lock:
+            for engine, stats in self._engines.items():
+                pool = engine.pool
+                pools.append({
+                    'engine': stats['name'],
+                    'size': _pool_stat(pool, 'size'),
+                    'checked_out': _pool_stat(pool, 'checkedout'),
+                    'checked_in': _pool_stat(pool, 'checkedin'),
+                    'overflow': max(_pool_stat(pool, 'overflow') or 0, 0),
+                    'max_overflow': getattr(pool, '_max_overflow', 0),
+                    'connects': stats['connects'],
+                    'invalidations': stats['invalidations']
+                })
+        return {
+            'pgbouncer_transaction_mode': self.pgbouncer_transaction_mode,
+            'statement_timeout_ms': self.statement_timeout_ms,
+            'pools': pools
+        }
+
+    def _set_local_timeout(self, conn):
+        conn.exec_driver_sql(f'SET LOCAL statement_timeout = {self.statement_timeout_ms}')
+
+    def _on_connect(self, engine):
+        def on_connect(dbapi_connection, connection_record):
+            with self._lock:
+                self._engines[engine]['connects'] += 1
+        return on_connect
+
+    def _on_invalidate(self, engine):
+        def on_invalidate(dbapi_connection, connection_record, exception):
+            with self._lock:
+                self._engines[engine]['invalidations'] += 1
+        return on_invalidate
+
+
+def _pool_stat(pool, name):
+    """QueuePool statistics; None for pools without them (e.g. NullPool)"""
+    method = getattr(pool, name, None)
+    return method() if callable(method) else None
+
+
+engine_profile = EngineProfile()
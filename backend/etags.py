@@ -0,0 +1,106 @@
+"""
+Conditional GET support for the activity read endpoints
+
+Every change to the set of a user's typing sessions (a session started or
+closed) bumps ``users.activity_version`` in the same transaction. Read
+endpoints derive a strong ETag from that counter (plus the endpoint and its
+query parameters), so a poll from a client whose copy is still current is
+answered with 304 after a single primary-key lookup, before the sessions table
+or the response cache is touched.
+
+Heartbeats that only move ``updated_at`` of an open session don't bump the
+version, so they stay a single-row write. Endpoints whose responses show
+``updated_at`` or live totals also roll their tag over every
+STATS_CACHE_TTL_SECONDS (the window_seconds argument of activity_etag), which
+bounds how long a touch-only change goes unseen.
+"""
+import hashlib
+import time
+from urllib.parse import urlencode
+
+from flask import Response, request
+from sqlalchemy import select, update
+
+from models import db, User
+from replicas import reading_from_replica, use_primary
+
+
+def activity_version(uid):
+    """
+    Current activity version of a user, or None if the user doesn't exist
+
+    Always read from the primary, so a client that has just written never
+    gets a 304 or a cached payload for the version before its write. On a
+    request routed to a replica, the replica's version is compared as well;
+    if it hasn't replayed the latest change, the rest of the request reads
+    from the primary.
+    """
+    stmt = select(User.activity_version).where(User.uid == uid)
+    version = db.session.execute(stmt, bind_arguments={'bind': db.engine}).scalar()
+    if reading_from_replica() and db.session.execute(stmt).scalar() != version:
+        use_primary()
+    return version
+
+
+def bump_activity_version(uids):
+    """
+    Increment the activity version of one or more users
+
+    Runs in the caller's transaction. Rows are updated in uid order so
+    concurrent bumps lock them in the same order.
+    """
+    uids = sorted(set(uids))
+    if not uids:
+        return
+    db.session.execute(
+        update(User)
+        .where(User.uid.in_(uids))
+        .values(
+            activity_version=User.activity_version + 1,
+            # Not a profile change; keep updated_at as it is
+            updated_at=User.updated_at
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+
+def activity_etag(uid, name, version, params=None, window_seconds=None):
+    """
+    Strong ETag for one representation of a user's activity
+
+    Args:
+        uid (int): Internal user id
+        name (str): Endpoint name, e.g. 'sessions'
+        version (int): The user's activity_version
+        params (MultiDict|dict): Query parameters the response depends on
+        window_seconds (float): For responses that also depend on the current
+            time, start a new tag every window_seconds
+
+    Returns:
+        str: Unquoted entity tag
+    """
+    parts = [str(uid), name, str(version)]
+    if params:
+        items = params.items(multi=True) if hasattr(params, 'getlist') else params.items()
+        parts.append(urlencode(sorted(items)))
+    if window_seconds:
+        parts.append(str(int(time.time() // window_seconds)))
+    return hashlib.sha1('\0'.join(parts).encode()).hexdigest()[:32]
+
+
+def is_fresh(etag):
+    """True when the request's If-None-Match already names this ETag"""
+    return request.if_none_match.contains(etag)
+
+
+def not_modified(etag):
+    """Empty 304 response carrying the ETag"""
+    response = Response(status=304)
+    response.set_etag(etag)
+    return response
+
+
+def with_etag(response, etag):
+    """Attach an ETag to a response object"""
+    response.set_etag(etag)
+    return response
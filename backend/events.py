@@ -0,0 +1,180 @@
+"""
+In-process pub/sub for live activity events
+
+activity.py and the reaper publish session changes here after they commit;
+/api/activity/stream subscribes on behalf of each connected client and
+relays them as Server-Sent Events.
+
+Each subscription has a bounded queue. A client that falls behind by more
+than ACTIVITY_STREAM_QUEUE_SIZE events is not buffered further: its stream is
+told to resync (refetch over the REST endpoints) and closed.
+
+Events only reach subscribers in the same process. With several workers, a
+client sees the changes handled by the worker it is connected to, plus the
+daily totals, which are re-read from the database on every change.
+"""
+import itertools
+import queue
+import threading
+
+from rollup import daily_totals, rollup_key
+from serializers import SESSION_FIELDS
+from time_utils import as_utc
+
+
+class Subscription:
+    """One connected client"""
+
+    def __init__(self, uid, max_size):
+        self.uid = uid
+        self.queue = queue.Queue(max_size)
+        self.overflowed = False
+
+    def get(self, timeout):
+        """Next (id, event, data), or None if nothing arrived within timeout"""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class ActivityEvents:
+    """
+    Per-user event fan-out
+
+    Usage:
+        activity_events = ActivityEvents()
+        activity_events.init_app(app)
+
+        subscription = activity_events.subscribe(uid)
+        activity_events.publish(uid, 'session_started', {...})
+        activity_events.unsubscribe(subscription)
+    """
+
+    def __init__(self, app=None):
+        self.queue_size = 100
+        self.heartbeat_seconds = 15.0
+        self.max_per_user = 5
+        self._subscribers = {}   # uid -> set of Subscription
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._counters = {
+            'published': 0,
+            'delivered': 0,
+            'overflows': 0
+        }
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.queue_size = app.config['ACTIVITY_STREAM_QUEUE_SIZE']
+        self.heartbeat_seconds = app.config['ACTIVITY_STREAM_HEARTBEAT_SECONDS']
+        self.max_per_user = app.config['ACTIVITY_STREAM_MAX_PER_USER']
+        app.extensions['activity_events'] = self
+
+    def subscribe(self, uid):
+        """
+        Register a new subscriber
+
+        Returns:
+            Subscription: or None if the user already has max_per_user streams
+        """
+        with self._lock:
+            subscriptions = self._subscribers.setdefault(uid, set())
+            if len(subscriptions) >= self.max_per_user:
+                return None
+            subscription = Subscription(uid, self.queue_size)
+            subscriptions.add(subscription)
+            return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscribers.get(subscription.uid)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscribers[subscription.uid]
+
+    def has_subscribers(self, uid):
+        """Cheap check so publishers can skip building payloads nobody reads"""
+        return uid in self._subscribers
+
+    def publish(self, uid, event, data):
+        """
+        Queue an event for every stream of a user
+
+        Never blocks: a subscriber whose queue is full is marked as overflowed
+        and gets no further events.
+        """
+        with self._lock:
+            subscriptions = list(self._subscribers.get(uid, ()))
+            self._counters['published'] += 1
+
+        message = (next(self._ids), event, data)
+        for subscription in subscriptions:
+            if subscription.overflowed:
+                continue
+            try:
+                subscription.queue.put_nowait(message)
+                delivered = True
+            except queue.Full:
+                subscription.overflowed = True
+                delivered = False
+            with self._lock:
+                self._counters['delivered' if delivered else 'overflows'] += 1
+
+    def counters(self):
+        """Counters for this process, plus the current number of streams"""
+        with self._lock:
+            counters = dict(self._counters)
+            counters['subscribers'] = sum(len(subs) for subs in self._subscribers.values())
+            counters['users'] = len(self._subscribers)
+        return counters
+
+
+def session_event_data(session):
+    """
+    Event payload for a TypingSession or a row with the same fields
+
+    Fields the row does not carry are sent as null.
+    """
+    data = {field: getattr(session, field, None) for field in SESSION_FIELDS}
+    if session.ended_at is not None and session.started_at is not None:
+        data['duration_seconds'] = (as_utc(session.ended_at) - as_utc(session.started_at)).total_seconds()
+    return data
+
+
+def publish_session_changes(uid, closed_sessions=(), new_session=None, language_switch=False):
+    """
+    Publish the events for one committed state change of a user's sessions
+
+    Args:
+        uid (int): Internal user id
+        closed_sessions (iterable): Sessions that were closed
+        new_session (TypingSession): Session that was started, if any
+        language_switch (bool): The close was caused by a language change
+    """
+    if not activity_events.has_subscribers(uid):
+        return
+
+    closed_sessions = list(closed_sessions)
+    for session in closed_sessions:
+        event = 'language_switched' if language_switch else 'session_ended'
+        data = session_event_data(session)
+        if language_switch and new_session is not None:
+            data = {'closed_session': data, 'session': session_event_data(new_session)}
+        activity_events.publish(uid, event, data)
+
+    if new_session is not None and not (language_switch and closed_sessions):
+        activity_events.publish(uid, 'session_started', session_event_data(new_session))
+
+    days = sorted({
+        rollup_key(uid, session.started_at, None, None)[1]
+        for session in closed_sessions
+    })
+    if days:
+        activity_events.publish(uid, 'daily_totals', {'days': daily_totals(uid, days)})
+
+
+activity_events = ActivityEvents()
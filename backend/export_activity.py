@@ -0,0 +1,303 @@
+"""
+Script to export typing sessions and users to Parquet for offline analytics
+Usage: python export_activity.py [--output DIR] [--full] [--chunk-size N]
+
+Requires pyarrow (listed in requirements.txt).
+
+Output layout (Hive-style partitions, readable by pyarrow.dataset, DuckDB,
+pandas, Spark):
+
+    DIR/typing_sessions/year=2025/month=10/part-<run>.parquet
+    DIR/users/users.parquet
+    DIR/_watermark.json
+
+Only closed sessions are exported; a session never changes after it closes,
+so every session is written exactly once. Runs are incremental: the watermark
+records the highest typing_id already considered and the ids that were still
+open at the time, and the next run picks up new sessions plus those that have
+closed since. --full writes every closed session into a new directory and
+swaps it in for DIR/typing_sessions, replacing the earlier files. The users
+table is small and rewritten in full on every run.
+"""
+import argparse
+import json
+import os
+import shutil
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import and_, or_, select
+
+from app import create_app
+from models import db, TypingSession
+from serializers import SESSION_COLUMNS, SESSION_FIELDS, USER_COLUMNS, USER_FIELDS
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # optional dependency
+    pa = None
+
+# Sessions created more recently than this are left for the next run, so rows
+# from transactions still in flight (lower typing_id, not yet committed) are
+# not skipped by the watermark
+SETTLE_SECONDS = 60
+
+WATERMARK_FILE = '_watermark.json'
+
+
+def session_schema():
+    timestamp = pa.timestamp('us', tz='UTC')
+    return pa.schema([
+        ('typing_id', pa.int64()),
+        ('uid', pa.int64()),
+        ('started_at', timestamp),
+        ('ended_at', timestamp),
+        ('language_tag', pa.string()),
+        ('source', pa.string()),
+        ('device_id', pa.string()),
+        ('created_at', timestamp),
+        ('updated_at', timestamp),
+        ('duration_seconds', pa.float64())
+    ])
+
+
+def user_schema():
+    timestamp = pa.timestamp('us', tz='UTC')
+    return pa.schema([
+        ('uid', pa.int64()),
+        ('github_id', pa.int64()),
+        ('username', pa.string()),
+        ('email', pa.string()),
+        ('avatar_url', pa.string()),
+        ('name', pa.string()),
+        ('created_at', timestamp),
+        ('updated_at', timestamp)
+    ])
+
+
+def load_watermark(output):
+    path = os.path.join(output, WATERMARK_FILE)
+    if not os.path.exists(path):
+        return {'last_typing_id': 0, 'open_ids': []}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_watermark(output, watermark):
+    """Write the watermark atomically"""
+    path = os.path.join(output, WATERMARK_FILE)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(watermark, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def swap_directory(new_path, path):
+    """
+    Move a freshly written directory into place and delete the one it replaces
+
+    Two renames on the same filesystem: between them the directory is briefly
+    missing, but readers never see old and new files mixed.
+    """
+    old_path = None
+    if os.path.exists(path):
+        old_path = new_path + '.old'
+        os.replace(path, old_path)
+    os.replace(new_path, path)
+    if old_path:
+        shutil.rmtree(old_path)
+
+
+def to_batch(rows, fields, schema):
+    """Build a record batch from row tuples"""
+    columns = list(zip(*rows))
+    return pa.record_batch(
+        [pa.array(column, type=schema.field(name).type) for name, column in zip(fields, columns)],
+        schema=schema
+    )
+
+
+class PartitionWriter:
+    """
+    Writes rows ordered by started_at into one Parquet file per month
+
+    Files are written under a hidden temporary name and only renamed into
+    place by commit(), so readers never see a partial export.
+    """
+
+    def __init__(self, root, run_id, schema):
+        self.root = root
+        self.run_id = run_id
+        self.schema = schema
+        self.partition = None
+        self.writer = None
+        self.pending = []   # (tmp_path, final_path)
+        self.rows_written = 0
+
+    def write(self, rows):
+        by_partition = {}
+        for row in rows:
+            started_at = row[SESSION_FIELDS.index('started_at')]
+            by_partition.setdefault((started_at.year, started_at.month), []).append(row)
+
+        for partition in sorted(by_partition):
+            if partition != self.partition:
+                self._open(partition)
+            self.writer.write_batch(to_batch(by_partition[partition], SESSION_FIELDS, self.schema))
+            self.rows_written += len(by_partition[partition])
+
+    def commit(self):
+        self._close()
+        for tmp_path, final_path in self.pending:
+            os.replace(tmp_path, final_path)
+        return len(self.pending)
+
+    def abort(self):
+        self._close()
+        for tmp_path, _ in self.pending:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _open(self, partition):
+        self._close()
+        year, month = partition
+        directory = os.path.join(self.root, f'year={year}', f'month={month:02d}')
+        os.makedirs(directory, exist_ok=True)
+        final_path = os.path.join(directory, f'part-{self.run_id}.parquet')
+        tmp_path = os.path.join(directory, f'.part-{self.run_id}.parquet.tmp')
+        self.writer = pq.ParquetWriter(tmp_path, self.schema, compression='zstd')
+        self.pending.append((tmp_path, final_path))
+        self.partition = partition
+
+    def _close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+            self.partition = None
+
+
+def export_sessions(root, watermark, chunk_size, run_id):
+    """
+    Export sessions closed since the last run into the partitions under root
+
+    Returns:
+        tuple: (rows written, files written, new watermark)
+    """
+    settled_before = datetime.now(timezone.utc) - timedelta(seconds=SETTLE_SECONDS)
+    upper_id = (
+        db.session.query(db.func.max(TypingSession.typing_id))
+        .filter(TypingSession.created_at < settled_before)
+        .scalar()
+    ) or 0
+    last_id = watermark['last_typing_id']
+    upper_id = max(upper_id, last_id)
+
+    # New sessions up to the settled id, plus previously open ones
+    candidates = and_(TypingSession.typing_id > last_id, TypingSession.typing_id <= upper_id)
+    if watermark['open_ids']:
+        candidates = or_(candidates, TypingSession.typing_id.in_(watermark['open_ids']))
+
+    still_open = [
+        typing_id for (typing_id,) in
+        db.session.query(TypingSession.typing_id)
+        .filter(candidates, TypingSession.ended_at.is_(None))
+        .order_by(TypingSession.typing_id)
+    ]
+
+    rows = db.session.execute(
+        select(*SESSION_COLUMNS)
+        .where(candidates, TypingSession.ended_at.isnot(None))
+        .order_by(TypingSession.started_at, TypingSession.typing_id)
+        .execution_options(yield_per=chunk_size)
+    )
+
+    writer = PartitionWriter(root, run_id, session_schema())
+    try:
+        for chunk in rows.partitions():
+            writer.write(chunk)
+        file_count = writer.commit()
+    except Exception:
+        writer.abort()
+        raise
+
+    new_watermark = {
+        'last_typing_id': upper_id,
+        'open_ids': still_open,
+        'exported_at': datetime.now(timezone.utc).isoformat()
+    }
+    return writer.rows_written, file_count, new_watermark
+
+
+def export_users(output, chunk_size):
+    """Rewrite the users snapshot; returns the number of rows written"""
+    directory = os.path.join(output, 'users')
+    os.makedirs(directory, exist_ok=True)
+    final_path = os.path.join(directory, 'users.parquet')
+    tmp_path = os.path.join(directory, '.users.parquet.tmp')
+
+    schema = user_schema()
+    count = 0
+    rows = db.session.execute(select(*USER_COLUMNS).execution_options(yield_per=chunk_size))
+    with pq.ParquetWriter(tmp_path, schema, compression='zstd') as writer:
+        for chunk in rows.partitions():
+            writer.write_batch(to_batch(chunk, USER_FIELDS, schema))
+            count += len(chunk)
+    os.replace(tmp_path, final_path)
+    return count
+
+
+def main():
+    """Export closed typing sessions and users to partitioned Parquet"""
+    parser = argparse.ArgumentParser(description='Export typing sessions and users to Parquet')
+    parser.add_argument('--output', default='exports', help='Output directory (default: exports)')
+    parser.add_argument('--full', action='store_true', help='Ignore the watermark and export everything again')
+    parser.add_argument('--chunk-size', type=int, default=50000, help='Rows fetched and written per batch (default: 50000)')
+    args = parser.parse_args()
+
+    if pa is None:
+        parser.error('pyarrow is required: pip install pyarrow')
+
+    os.makedirs(args.output, exist_ok=True)
+    watermark = {'last_typing_id': 0, 'open_ids': []} if args.full else load_watermark(args.output)
+    run_id = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ') + '-' + uuid.uuid4().hex[:8]
+
+    app = create_app(background_jobs=False)
+
+    with app.app_context():
+        if db.engine.dialect.name == 'postgresql':
+            # One snapshot for the whole run, so a session closing mid-export
+            # is neither written twice nor left out of open_ids
+            db.session.connection(execution_options={'isolation_level': 'REPEATABLE READ'})
+        
+        print(f"Exporting sessions after typing_id {watermark['last_typing_id']} "
+              f"({len(watermark['open_ids'])} previously open) to {args.output}...")
+
+        sessions_root = os.path.join(args.output, 'typing_sessions')
+        if not args.full:
+            session_rows, file_count, new_watermark = export_sessions(
+                sessions_root, watermark, args.chunk_size, run_id
+            )
+        else:
+            # Start from an empty tree so sessions from earlier runs aren't kept twice
+            staging_root = os.path.join(args.output, f'.typing_sessions-{run_id}')
+            try:
+                session_rows, file_count, new_watermark = export_sessions(
+                    staging_root, watermark, args.chunk_size, run_id
+                )
+                os.makedirs(staging_root, exist_ok=True)
+                swap_directory(staging_root, sessions_root)
+            except Exception:
+                shutil.rmtree(staging_root, ignore_errors=True)
+                raise
+        save_watermark(args.output, new_watermark)
+        user_rows = export_users(args.output, args.chunk_size)
+
+        print(f"✓ Exported {session_rows} sessions into {file_count} files")
+        print(f"✓ Exported {user_rows} users")
+        print(f"✓ Watermark at typing_id {new_watermark['last_typing_id']} "
+              f"({len(new_watermark['open_ids'])} sessions still open)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,309 @@
+"""
+Write-behind buffer for typing session heartbeats
+
+The VS Code extension calls /api/activity/start on every typing burst. When the
+device already has a recent session in the same language, the only effect is an
+``updated_at`` bump. This buffer absorbs those heartbeats in memory, coalesces
+them per (uid, device_id) and writes the latest values back in one batched
+UPDATE every few seconds.
+
+The buffer is per process, so another worker, /end or the reaper may close a
+cached session. Before absorbing a heartbeat the buffer checks by primary key
+that the session is still open, which trades the row UPDATE for a single
+indexed read; a closed session is forgotten and the heartbeat takes the
+database path.
+"""
+import atexit
+import threading
+from datetime import datetime, timezone
+
+from flask import has_app_context
+from sqlalchemy import case, select, update
+
+from models import db, TypingSession
+from time_utils import as_utc
+
+_SESSION_COLUMNS = [column.name for column in TypingSession.__table__.columns]
+
+
+def _as_stored(value, stored):
+    """value (aware, UTC) in the form the database returned stored in: naive, or in its time zone"""
+    if stored.tzinfo is None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value.astimezone(stored.tzinfo)
+
+
+class HeartbeatBuffer:
+    """
+    In-process write-behind buffer for active session heartbeats
+
+    Usage:
+        heartbeat_buffer = HeartbeatBuffer()
+        heartbeat_buffer.init_app(app)
+    """
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self.flush_interval = 5.0
+        self.stale_after_seconds = 300
+        self._app = None
+        self._entries = {}        # (uid, device_id) -> cached active session
+        self._by_typing_id = {}   # typing_id -> (uid, device_id)
+        self._dirty = set()       # keys with heartbeats not yet written
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Read settings from the app config and start the flush thread"""
+        self.enabled = app.config['HEARTBEAT_BUFFER_ENABLED']
+        self.flush_interval = app.config['HEARTBEAT_FLUSH_INTERVAL_SECONDS']
+        self.stale_after_seconds = app.config['STALE_SESSION_SECONDS']
+        self._app = app
+        app.extensions['heartbeat_buffer'] = self
+
+        if self.enabled and self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name='heartbeat-buffer-flush', daemon=True
+            )
+            self._thread.start()
+            atexit.register(self.shutdown)
+
+    def remember(self, uid, device_id, session):
+        """
+        Cache the active session for a device so later heartbeats can be absorbed
+
+        Args:
+            uid (int): Internal user id
+            device_id (str): Device id sent by the client (may be None)
+            session (TypingSession): The active session, freshly committed
+        """
+        if not self.enabled:
+            return
+
+        key = (uid, device_id)
+        # Detached copy, serialized with to_dict() like the database path
+        snapshot = TypingSession(**{name: getattr(session, name) for name in _SESSION_COLUMNS})
+        updated_at = as_utc(session.updated_at)
+
+        with self._lock:
+            previous = self._entries.get(key)
+            if previous and previous['typing_id'] != session.typing_id:
+                self._by_typing_id.pop(previous['typing_id'], None)
+            self._entries[key] = {
+                'typing_id': session.typing_id,
+                'language_tag': session.language_tag,
+                'updated_at': updated_at,
+                'session': snapshot
+            }
+            self._by_typing_id[session.typing_id] = key
+            self._dirty.discard(key)
+
+    def touch(self, uid, device_id, language_tag, now):
+        """
+        Absorb a heartbeat for a cached, recent, same-language session
+
+        Returns:
+            dict: Serialized session if the heartbeat was absorbed, otherwise None
+                  (the caller must fall back to the database path)
+        """
+        if not self.enabled:
+            return None
+
+        key = (uid, device_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if not entry:
+                return None
+            if language_tag and entry['language_tag'] != language_tag:
+                return None
+            if (now - entry['updated_at']).total_seconds() > self.stale_after_seconds:
+                return None
+            typing_id = entry['typing_id']
+
+        if not self._is_open(typing_id):
+            self._forget(key, typing_id)
+            return None
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if not entry or entry['typing_id'] != typing_id:
+                return None
+            entry['updated_at'] = max(entry['updated_at'], now)
+            session = entry['session']
+            session.updated_at = _as_stored(entry['updated_at'], session.updated_at)
+            self._dirty.add(key)
+            return session.to_dict()
+
+    def peek(self, uid, device_id, now):
+        """
+        Cached state of a device's active session, without recording a heartbeat
+
+        Returns:
+            dict: Serialized session, or None if nothing recent is cached
+        """
+        if not self.enabled:
+            return None
+
+        with self._lock:
+            entry = self._entries.get((uid, device_id))
+            if not entry:
+                return None
+            if (now - entry['updated_at']).total_seconds() > self.stale_after_seconds:
+                return None
+            return entry['session'].to_dict()
+
+    def release(self, uid, device_id):
+        """
+        Write any pending heartbeat for a device and forget its cached session
+
+        Called before the database path closes or replaces the session
+        (stale auto-close, language switch) so it sees the latest updated_at.
+        """
+        if not self.enabled:
+            return
+        self._release_keys([(uid, device_id)])
+
+    def release_session(self, typing_id):
+        """Same as release(), looked up by typing_id (used when ending a session)"""
+        if not self.enabled:
+            return
+        with self._lock:
+            key = self._by_typing_id.get(typing_id)
+        if key is not None:
+            self._release_keys([key])
+
+    def flush(self):
+        """
+        Write the latest updated_at of every dirty entry in one batched UPDATE
+
+        Returns:
+            int: Number of sessions written
+        """
+        with self._flush_lock:
+            with self._lock:
+                pending = {
+                    self._entries[key]['typing_id']: self._entries[key]['updated_at']
+                    for key in self._dirty if key in self._entries
+                }
+                dirty_keys = set(self._dirty)
+                self._dirty.clear()
+
+            try:
+                alive = self._write(pending)
+            except Exception:
+                with self._lock:
+                    self._dirty.update(dirty_keys)
+                raise
+            self._prune(pending, alive)
+            return len(alive)
+
+    def counters(self):
+        """Cached active sessions and heartbeats not yet written, for this process"""
+        with self._lock:
+            return {'enabled': self.enabled, 'entries': len(self._entries), 'dirty': len(self._dirty)}
+
+    def shutdown(self):
+        """Stop the flush thread and write everything still pending"""
+        self._stop_event.set()
+        if self._app is None:
+            return
+        try:
+            self.flush()
+        except Exception as e:
+            print(f"Heartbeat buffer: final flush failed: {e}")
+
+    @staticmethod
+    def _is_open(typing_id):
+        """Whether the session is still open in the database (primary-key read)"""
+        row = db.session.execute(
+            select(TypingSession.ended_at).where(TypingSession.typing_id == typing_id)
+        ).first()
+        return row is not None and row.ended_at is None
+
+    def _forget(self, key, typing_id):
+        """Drop the cached entry of a session that was closed elsewhere"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry['typing_id'] == typing_id:
+                del self._entries[key]
+                self._by_typing_id.pop(typing_id, None)
+                # The pending updated_at would be rejected anyway (ended_at IS NULL)
+                self._dirty.discard(key)
+
+    def _release_keys(self, keys):
+        with self._flush_lock:
+            with self._lock:
+                pending = {}
+                for key in keys:
+                    entry = self._entries.pop(key, None)
+                    if not entry:
+                        continue
+                    self._by_typing_id.pop(entry['typing_id'], None)
+                    if key in self._dirty:
+                        self._dirty.discard(key)
+                        pending[entry['typing_id']] = entry['updated_at']
+            self._write(pending)
+
+    def _write(self, pending):
+        """Run the batched UPDATE and return the typing_ids that are still open"""
+        if not pending:
+            return set()
+
+        if has_app_context():
+            return self._execute_update(pending)
+        with self._app.app_context():
+            try:
+                return self._execute_update(pending)
+            finally:
+                db.session.remove()
+
+    def _execute_update(self, pending):
+        stmt = (
+            update(TypingSession)
+            .where(
+                TypingSession.typing_id.in_(list(pending.keys())),
+                TypingSession.ended_at.is_(None)
+            )
+            .values(updated_at=case(pending, value=TypingSession.typing_id))
+            .returning(TypingSession.typing_id)
+            .execution_options(synchronize_session=False)
+        )
+        try:
+            # Touches don't change the session set, so activity_version stays (see etags.py)
+            rows = db.session.execute(stmt).all()
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return {row.typing_id for row in rows}
+
+    def _prune(self, written, alive):
+        """Forget sessions closed elsewhere and entries that have gone stale"""
+        closed = set(written) - alive
+        horizon = (
+            datetime.now(timezone.utc).timestamp()
+            - self.stale_after_seconds - 2 * self.flush_interval
+        )
+
+        with self._lock:
+            for key, entry in list(self._entries.items()):
+                if entry['typing_id'] in closed or entry['updated_at'].timestamp() < horizon:
+                    if key in self._dirty:
+                        continue
+                    del self._entries[key]
+                    self._by_typing_id.pop(entry['typing_id'], None)
+
+    def _run(self):
+        while not self._stop_event.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Heartbeat buffer: flush failed: {e}")
+
+
+heartbeat_buffer = HeartbeatBuffer()
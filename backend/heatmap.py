@@ -0,0 +1,245 @@
+"""
+Year-long contribution heatmap
+
+Each user has one ``user_activity_heatmaps`` row per calendar year holding a
+fixed-length array of 366 uint32 values: seconds typed on each (UTC) day of
+the year. Rows are updated incrementally as sessions close (see
+rollup.record_closed_sessions), so building a 365/366-day heatmap reads at
+most two small rows.
+"""
+import math
+import sys
+from array import array
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import db, TypingSession, TypingDailyRollup, UserActivityHeatmap
+
+DAYS_PER_ROW = 366
+MAX_SECONDS_PER_DAY = 2 ** 32 - 1
+
+
+def empty_days():
+    """A zeroed per-day array"""
+    return array('I', bytes(4 * DAYS_PER_ROW))
+
+
+def unpack_days(blob):
+    """Decode a stored row into an array of per-day seconds"""
+    days = array('I')
+    days.frombytes(blob)
+    if sys.byteorder == 'big':
+        days.byteswap()
+    return days
+
+
+def pack_days(days):
+    """Encode an array of per-day seconds for storage"""
+    if sys.byteorder == 'big':
+        days = array('I', days)
+        days.byteswap()
+    return days.tobytes()
+
+
+def day_index(day):
+    """Position of a date inside its year's array"""
+    return day.timetuple().tm_yday - 1
+
+
+def add_seconds(totals):
+    """
+    Add seconds to users' heatmap rows, creating rows as needed
+
+    Runs in the caller's transaction. Rows are locked (SELECT ... FOR UPDATE)
+    in a fixed order so concurrent closes for the same user serialize.
+
+    Args:
+        totals (dict): {(uid, date): seconds}; negative values subtract
+            (overlap taken over by a newly closed session)
+    """
+    by_row = {}
+    for (uid, day), seconds in totals.items():
+        if seconds:
+            by_row.setdefault((uid, day.year), []).append((day, seconds))
+
+    if not by_row:
+        return
+
+    _ensure_rows(sorted(by_row))
+
+    for uid, year in sorted(by_row):
+        row = (
+            UserActivityHeatmap.query
+            .filter_by(uid=uid, year=year)
+            .with_for_update()
+            .one()
+        )
+        days = unpack_days(row.seconds)
+        for day, seconds in by_row[(uid, year)]:
+            index = day_index(day)
+            days[index] = min(max(days[index] + int(round(seconds)), 0), MAX_SECONDS_PER_DAY)
+        row.seconds = pack_days(days)
+
+    db.session.flush()
+
+
+def rebuild_heatmap(uid=None):
+    """
+    Recompute heatmap rows from the daily rollup (for one user or everyone)
+
+    The rollup must already be up to date. The caller commits.
+
+    Returns:
+        int: Number of heatmap rows written
+    """
+    delete_query = UserActivityHeatmap.query
+    rollup_query = db.session.query(
+        TypingDailyRollup.uid,
+        TypingDailyRollup.date,
+        db.func.sum(TypingDailyRollup.total_seconds)
+    ).group_by(TypingDailyRollup.uid, TypingDailyRollup.date)
+
+    if uid is not None:
+        delete_query = delete_query.filter_by(uid=uid)
+        rollup_query = rollup_query.filter(TypingDailyRollup.uid == uid)
+
+    delete_query.delete(synchronize_session=False)
+
+    rows = {}
+    for row_uid, day, seconds in rollup_query.yield_per(5000):
+        days = rows.setdefault((row_uid, day.year), empty_days())
+        days[day_index(day)] = min(int(round(seconds or 0)), MAX_SECONDS_PER_DAY)
+
+    db.session.add_all(
+        UserActivityHeatmap(uid=row_uid, year=year, seconds=pack_days(days))
+        for (row_uid, year), days in rows.items()
+    )
+    db.session.flush()
+    return len(rows)
+
+
+def year_window(end_day):
+    """
+    First day of the one-year window ending on end_day (365 or 366 days long)
+    """
+    try:
+        year_ago = end_day.replace(year=end_day.year - 1)
+    except ValueError:
+        # end_day is Feb 29
+        year_ago = end_day.replace(year=end_day.year - 1, day=28)
+    return year_ago + timedelta(days=1)
+
+
+def build_heatmap(uid, now=None):
+    """
+    Per-day minutes, streaks and quartile levels for the year ending today
+
+    Returns:
+        dict: Flat numeric arrays plus summary numbers, oldest day first
+    """
+    # rollup imports this module
+    from rollup import overlap_adjusted_seconds
+
+    now = now or datetime.now(timezone.utc)
+    end_day = now.date()
+    start_day = year_window(end_day)
+    day_count = (end_day - start_day).days + 1
+
+    rows = {
+        row.year: unpack_days(row.seconds)
+        for row in UserActivityHeatmap.query.filter(
+            UserActivityHeatmap.uid == uid,
+            UserActivityHeatmap.year.in_({start_day.year, end_day.year})
+        )
+    }
+
+    seconds = []
+    for offset in range(day_count):
+        day = start_day + timedelta(days=offset)
+        days = rows.get(day.year)
+        seconds.append(days[day_index(day)] if days else 0)
+
+    # Still-open sessions are not in the arrays yet; count them live, minus
+    # any time already covered by closed sessions on other devices
+    open_sessions = (
+        db.session.query(
+            TypingSession.typing_id,
+            TypingSession.started_at,
+            TypingSession.ended_at,
+            TypingSession.language_tag,
+            TypingSession.source
+        )
+        .filter(TypingSession.uid == uid, TypingSession.ended_at.is_(None))
+        .all()
+    )
+    for (_, day, _, _), value in overlap_adjusted_seconds(uid, open_sessions, now).items():
+        offset = (day - start_day).days
+        if 0 <= offset < day_count:
+            seconds[offset] = max(seconds[offset] + value, 0)
+
+    # Any activity on a day shows up as at least one minute
+    minutes = [math.ceil(value / 60) for value in seconds]
+    quartiles = _quartiles([value for value in minutes if value > 0])
+    current_streak, longest_streak = _streaks(minutes)
+
+    return {
+        'start_date': start_day.isoformat(),
+        'end_date': end_day.isoformat(),
+        'minutes': minutes,
+        'levels': [_level(value, quartiles) for value in minutes],
+        'quartiles': quartiles,
+        'current_streak': current_streak,
+        'longest_streak': longest_streak,
+        'active_days': sum(1 for value in minutes if value > 0),
+        'total_minutes': sum(minutes)
+    }
+
+
+def _ensure_rows(keys):
+    """Insert zeroed rows for (uid, year) keys that don't exist yet"""
+    insert = postgresql.insert if db.engine.dialect.name == 'postgresql' else sqlite.insert
+    stmt = insert(UserActivityHeatmap).values([
+        {'uid': uid, 'year': year, 'seconds': pack_days(empty_days())}
+        for uid, year in keys
+    ]).on_conflict_do_nothing(index_elements=['uid', 'year'])
+    db.session.execute(stmt)
+
+
+def _quartiles(values):
+    """Nearest-rank 25th/50th/75th percentiles of the active days"""
+    if not values:
+        return [0, 0, 0]
+    values = sorted(values)
+    return [values[max(math.ceil(p * len(values)) - 1, 0)] for p in (0.25, 0.5, 0.75)]
+
+
+def _level(value, quartiles):
+    """0 for no activity, otherwise 1-4 by quartile"""
+    if value <= 0:
+        return 0
+    for level, threshold in enumerate(quartiles, start=1):
+        if value <= threshold:
+            return level
+    return 4
+
+
+def _streaks(minutes):
+    """
+    Current and longest runs of active days
+
+    The current streak still counts if today has no activity yet.
+    """
+    longest = run = 0
+    for value in minutes:
+        run = run + 1 if value > 0 else 0
+        longest = max(longest, run)
+
+    current = 0
+    days = minutes[:-1] if minutes and minutes[-1] == 0 else minutes
+    for value in reversed(days):
+        if value <= 0:
+            break
+        current += 1
+
+    return current, longest
@@ -0,0 +1,219 @@
+"""
+Idempotency keys for the activity write endpoints
+
+Clients may send an ``Idempotency-Key`` header (any unique string, e.g. a
+UUID per logical request) with POST /api/activity/start, /end and /batch. The
+first request with a key reserves (uid, key) in ``idempotency_keys`` before
+the route runs and stores its response afterwards; a retry with the same key
+gets the stored response back without the route running again. Lookups are
+by primary key, so a retry never touches ``typing_sessions``.
+
+- A retry that arrives while the first request is still running gets
+  409 Conflict with Retry-After.
+- A key reused for a different endpoint or request body gets 422.
+- Responses with a 5xx status are not stored, so the client can retry them.
+- A reservation left behind by a crashed worker is taken over after
+  IDEMPOTENCY_LOCK_SECONDS.
+
+Keys expire after IDEMPOTENCY_TTL_SECONDS; the reaper thread purges them
+(IDEMPOTENCY_PURGE_ENABLED).
+"""
+import hashlib
+from datetime import datetime, timedelta, timezone
+from functools import wraps
+
+from flask import Response, current_app, jsonify, make_response, request
+from sqlalchemy import delete, select, tuple_, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import db, IdempotencyKey
+from time_utils import as_utc
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+# Rows deleted per purge statement, so one run never holds a long transaction
+PURGE_BATCH_SIZE = 10000
+
+
+def _fingerprint():
+    """Digest of the raw request body, to detect a key reused for another request"""
+    return hashlib.blake2b(request.get_data(cache=True), digest_size=16).digest()
+
+
+def _reserve(uid, key, fingerprint):
+    """
+    Claim a key for this request
+
+    Returns:
+        tuple: (outcome, record) - outcome is 'reserved', 'replay', 'in_progress'
+            or 'mismatch'; record is the stored IdempotencyKey for 'replay'
+    """
+    now = datetime.now(timezone.utc)
+    insert = postgresql.insert if db.engine.dialect.name == 'postgresql' else sqlite.insert
+    stmt = (
+        insert(IdempotencyKey)
+        .values(uid=uid, key=key, endpoint=request.endpoint, request_hash=fingerprint, created_at=now)
+        .on_conflict_do_nothing(index_elements=['uid', 'key'])
+        .returning(IdempotencyKey.uid)
+    )
+    inserted = db.session.execute(stmt).first()
+    db.session.commit()
+    if inserted:
+        return 'reserved', None
+
+    record = db.session.execute(
+        select(IdempotencyKey)
+        .where(IdempotencyKey.uid == uid, IdempotencyKey.key == key)
+        .execution_options(populate_existing=True)
+    ).scalar_one_or_none()
+    if record is None:
+        # Purged between the insert and the lookup
+        return _reserve(uid, key, fingerprint)
+
+    if record.endpoint != request.endpoint or record.request_hash != fingerprint:
+        return 'mismatch', None
+    if record.status_code is not None:
+        return 'replay', record
+
+    lock_seconds = current_app.config['IDEMPOTENCY_LOCK_SECONDS']
+    if now - as_utc(record.created_at) < timedelta(seconds=lock_seconds):
+        return 'in_progress', None
+
+    # The request that reserved the key never finished; take the reservation over
+    taken = db.session.execute(
+        update(IdempotencyKey)
+        .where(
+            IdempotencyKey.uid == uid,
+            IdempotencyKey.key == key,
+            IdempotencyKey.status_code.is_(None),
+            IdempotencyKey.created_at == record.created_at
+        )
+        .values(created_at=now)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.session.commit()
+    return ('reserved' if taken else 'in_progress'), None
+
+
+def _store(uid, key, response):
+    db.session.execute(
+        update(IdempotencyKey)
+        .where(IdempotencyKey.uid == uid, IdempotencyKey.key == key)
+        .values(status_code=response.status_code, response=response.get_data())
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+
+
+def _release(uid, key):
+    db.session.execute(
+        delete(IdempotencyKey)
+        .where(
+            IdempotencyKey.uid == uid,
+            IdempotencyKey.key == key,
+            IdempotencyKey.status_code.is_(None)
+        )
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+
+
+def idempotent(f):
+    """
+    Decorator that replays the stored response for a retried Idempotency-Key
+
+    Goes below @token_required; requests without the header run normally.
+
+    Usage:
+        @activity_bp.route('/api/activity/end', methods=['POST'])
+        @token_required
+        @idempotent
+        def end_typing_session(current_user):
+            ...
+    """
+    @wraps(f)
+    def decorated(current_user, *args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        uid = current_user.get('uid') if current_user else None
+        if not key or not uid:
+            return f(current_user=current_user, *args, **kwargs)
+
+        if len(key) > MAX_KEY_LENGTH:
+            return jsonify({
+                'error': 'Invalid idempotency key',
+                'message': f'{IDEMPOTENCY_HEADER} must be at most {MAX_KEY_LENGTH} characters'
+            }), 400
+
+        try:
+            outcome, record = _reserve(uid, key, _fingerprint())
+        except Exception as e:
+            db.session.rollback()
+            # The database error holds the SQL text; keep it in the server log
+            print(f"Failed to check idempotency key: {type(e).__name__}: {e}")
+            return jsonify({
+                'error': 'Failed to check idempotency key',
+                'message': 'An internal error occurred'
+            }), 500
+
+        if outcome == 'replay':
+            replay = Response(record.response, status=record.status_code, mimetype='application/json')
+            replay.headers['Idempotent-Replayed'] = 'true'
+            return replay
+        if outcome == 'mismatch':
+            return jsonify({
+                'error': 'Idempotency key reused',
+                'message': f'This {IDEMPOTENCY_HEADER} was already used for a different request'
+            }), 422
+        if outcome == 'in_progress':
+            response = jsonify({
+                'error': 'Request in progress',
+                'message': f'A request with this {IDEMPOTENCY_HEADER} is still being processed'
+            })
+            response.status_code = 409
+            response.headers['Retry-After'] = '1'
+            return response
+
+        try:
+            response = make_response(f(current_user=current_user, *args, **kwargs))
+        except Exception:
+            db.session.rollback()
+            _release(uid, key)
+            raise
+
+        try:
+            if response.status_code >= 500:
+                _release(uid, key)
+            else:
+                _store(uid, key, response)
+        except Exception as e:
+            # The route has already committed; the client just can't replay this response
+            db.session.rollback()
+            print(f"Idempotency: failed to store response for key {key!r}: {e}")
+        return response
+
+    return decorated
+
+
+def purge_expired_keys(ttl_seconds, now=None):
+    """
+    Delete keys older than ttl_seconds
+
+    Runs in the caller's transaction, at most PURGE_BATCH_SIZE rows at a
+    time (oldest first, via idx_idempotency_keys_created).
+
+    Returns:
+        int: Number of keys deleted
+    """
+    now = now or datetime.now(timezone.utc)
+    expired = (
+        select(IdempotencyKey.uid, IdempotencyKey.key)
+        .where(IdempotencyKey.created_at < now - timedelta(seconds=ttl_seconds))
+        .order_by(IdempotencyKey.created_at)
+        .limit(PURGE_BATCH_SIZE)
+    )
+    return db.session.execute(
+        delete(IdempotencyKey)
+        .where(tuple_(IdempotencyKey.uid, IdempotencyKey.key).in_(expired))
+        .execution_options(synchronize_session=False)
+    ).rowcount
@@ -0,0 +1,121 @@
+"""
+Interval union engine for wall-clock time accounting
+
+A user with the editor open on two devices produces overlapping sessions;
+summing their durations counts the shared time twice. The functions here work
+on (start, end) pairs of epoch seconds and count every instant once.
+
+Where intervals overlap, each instant is owned by the interval that comes
+first in rank order: earliest start, ties broken by typing_id. Summing the
+owned lengths gives the length of the union, and because every instant has
+exactly one owner, per-language and per-source breakdowns add up to the
+total. Ownership of the final set of intervals does not depend on the order
+they were added in, so an incrementally maintained rollup matches a rebuild.
+
+All functions are a sort plus a single sweep: O(n log n).
+"""
+import math
+from operator import itemgetter
+
+_start = itemgetter(0)
+
+
+def merge(intervals):
+    """
+    Union of intervals
+
+    Returns:
+        list: Sorted, disjoint (start, end) pairs
+    """
+    merged = []
+    for start, end in sorted(intervals, key=_start):
+        if end <= start:
+            continue
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    return [(start, end) for start, end in merged]
+
+
+def union_length(intervals):
+    """Length of the union of intervals"""
+    total = 0.0
+    cover_end = -math.inf
+    # Order of equal starts doesn't matter here; comparing floats beats tuples
+    for start, end in sorted(intervals, key=_start):
+        if end > cover_end and end > start:
+            total += end - (start if start > cover_end else cover_end)
+            cover_end = end
+    return total
+
+
+def owned_lengths(intervals, lo=-math.inf, hi=math.inf):
+    """
+    Length each interval owns inside the window [lo, hi]
+
+    Args:
+        intervals (list): (start, end) pairs already in rank order (sorted by
+            start, ties by id). Intervals that start before lo must be
+            included if they reach into the window, since they own part of it.
+        lo, hi (float): Window bounds
+
+    Returns:
+        list: Owned seconds, aligned with intervals
+    """
+    owned = []
+    append = owned.append
+    cover_end = lo
+    for start, end in intervals:
+        # Inlined min/max: this loop runs once per session
+        begin = start if start > cover_end else cover_end
+        stop = end if end < hi else hi
+        append(stop - begin if stop > begin else 0.0)
+        if end > cover_end:
+            cover_end = end
+    return owned
+
+
+def ownership_changes(existing, added):
+    """
+    How ownership shifts when intervals are added to an already-counted set
+
+    Only the window covered by the added intervals changes hands, so existing
+    only needs the intervals that overlap it.
+
+    Args:
+        existing (list): (rank, start, end) of already-counted intervals
+        added (list): (rank, start, end) of the new intervals; rank is any
+            sortable key whose first element is the start
+
+    Returns:
+        tuple: (deltas, owned) - change in owned seconds for each existing
+            interval (zero or negative) and owned seconds of each added one,
+            aligned with the inputs
+    """
+    if not added:
+        return [0.0] * len(existing), []
+
+    lo = min(start for _, start, _ in added)
+    hi = max(end for _, _, end in added)
+
+    before_order = sorted(range(len(existing)), key=lambda i: existing[i][0])
+    before = owned_lengths([existing[i][1:] for i in before_order], lo, hi)
+
+    # Existing intervals are tagged (0, index), added ones (1, index)
+    combined = [(rank, start, end, (0, i)) for i, (rank, start, end) in enumerate(existing)]
+    combined += [(rank, start, end, (1, i)) for i, (rank, start, end) in enumerate(added)]
+    combined.sort(key=lambda item: item[0])
+    after = owned_lengths([(start, end) for _, start, end, _ in combined], lo, hi)
+
+    deltas = [0.0] * len(existing)
+    owned = [0.0] * len(added)
+    for (_, _, _, (kind, index)), seconds in zip(combined, after):
+        if kind == 0:
+            deltas[index] = seconds
+        else:
+            owned[index] = seconds
+    for index, seconds in zip(before_order, before):
+        deltas[index] -= seconds
+    return deltas, owned
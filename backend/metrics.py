@@ -0,0 +1,416 @@
+"""
+Prometheus metrics for the API, served at /metrics
+
+Recorded per request (app-level before/after_request hooks):
+- http_requests_total{endpoint, method, status}
+- http_request_duration_seconds{endpoint, method} (histogram)
+- http_request_db_statements{endpoint} and http_request_db_duration_seconds{endpoint}
+  (histograms of the SQL statements a request ran and the time spent in them,
+  counted with SQLAlchemy cursor events)
+
+Recorded around slow external calls with the timers below:
+- subprocess_duration_seconds{call} (man page lookups)
+- http_client_request_duration_seconds{service} (GitHub, man7.org, Gemini)
+
+Collected when /metrics is scraped, from the counters the extensions already
+keep (heartbeat buffer, stats cache, reaper, rate limiter, activity stream,
+slow-query log, read replicas, connection pools).
+
+The text format is written directly, without prometheus_client. Each worker
+process keeps its own metrics, like the other in-process counters; scrape
+every worker or run a single one per target. Streaming responses
+(/api/activity/stream, /export) are timed until their first byte.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import current_app, request
+from sqlalchemy import event
+
+from replicas import all_engines
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter per label set"""
+
+    type = 'counter'
+
+    def __init__(self, name, description, label_names=()):
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self._values = {}
+
+    def inc(self, labels=(), amount=1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        return [(self.name, self.label_names, labels, value) for labels, value in self._values.items()]
+
+
+class Histogram:
+    """Bucketed distribution per label set"""
+
+    type = 'histogram'
+
+    def __init__(self, name, description, label_names=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self.buckets = tuple(buckets)
+        self._series = {}   # labels -> [count per bucket..., count above the last bucket, sum]
+
+    def observe(self, labels, value):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def samples(self):
+        samples = []
+        label_names = self.label_names + ('le',)
+        for labels, series in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), series):
+                cumulative += count
+                samples.append((f'{self.name}_bucket', label_names, labels + (_format_value(float(bound)),), cumulative))
+            samples.append((f'{self.name}_sum', self.label_names, labels, series[-1]))
+            samples.append((f'{self.name}_count', self.label_names, labels, cumulative))
+        return samples
+
+
+class Metrics:
+    """
+    Request, SQL and external call metrics with Prometheus text output
+
+    Usage:
+        metrics = Metrics()
+        metrics.init_app(app)
+
+        with metrics.http_client_timer('github'):
+            requests.get(...)
+    """
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._engines = set()
+        self._collectors = [
+            _heartbeat_buffer_metrics, _stats_cache_metrics, _reaper_metrics,
+            _rate_limiter_metrics, _activity_stream_metrics, _slow_query_metrics,
+            _replica_metrics, _pool_metrics
+        ]
+
+        self.requests = Counter(
+            'http_requests_total', 'Requests handled, by endpoint, method and status code',
+            ('endpoint', 'method', 'status')
+        )
+        self.request_duration = Histogram(
+            'http_request_duration_seconds', 'Request latency until the response is returned',
+            ('endpoint', 'method')
+        )
+        self.request_statements = Histogram(
+            'http_request_db_statements', 'SQL statements executed per request',
+            ('endpoint',), STATEMENT_BUCKETS
+        )
+        self.request_db_duration = Histogram(
+            'http_request_db_duration_seconds', 'Time spent executing SQL per request',
+            ('endpoint',)
+        )
+        self.background_statements = Counter(
+            'db_background_statements_total', 'SQL statements executed outside requests (heartbeat flushes, reaper)'
+        )
+        self.background_db_duration = Counter(
+            'db_background_duration_seconds_total', 'Time spent executing SQL outside requests'
+        )
+        self.subprocess_duration = Histogram(
+            'subprocess_duration_seconds', 'Duration of subprocess calls', ('call',)
+        )
+        self.http_client_duration = Histogram(
+            'http_client_request_duration_seconds', 'Duration of outbound HTTP requests', ('service',)
+        )
+        self._metrics = [
+            self.requests, self.request_duration, self.request_statements, self.request_db_duration,
+            self.background_statements, self.background_db_duration,
+            self.subprocess_duration, self.http_client_duration
+        ]
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config['METRICS_ENABLED']
+        app.extensions['metrics'] = self
+        if not self.enabled:
+            return
+
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+
+        for engine in all_engines(app):
+            if engine not in self._engines:
+                self._engines.add(engine)
+                event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+                event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+
+    def add_collector(self, collector):
+        """
+        Register a function called on every scrape
+
+        collector(app) returns (name, type, help, [(labels dict, value), ...]) tuples.
+        """
+        self._collectors.append(collector)
+
+    @contextmanager
+    def subprocess_timer(self, call):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._observe(self.subprocess_duration, (call,), time.perf_counter() - started)
+
+    @contextmanager
+    def http_client_timer(self, service):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._observe(self.http_client_duration, (service,), time.perf_counter() - started)
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            for metric in self._metrics:
+                self._render(lines, metric.name, metric.type, metric.description, metric.samples())
+
+        for collector in self._collectors:
+            for name, metric_type, description, values in collector(current_app):
+                samples = []
+                for labels, value in values:
+                    samples.append((name, tuple(labels), tuple(labels.values()), value))
+                self._render(lines, name, metric_type, description, samples)
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _render(lines, name, metric_type, description, samples):
+        lines.append(f'# HELP {name} {description}')
+        lines.append(f'# TYPE {name} {metric_type}')
+        for sample_name, label_names, labels, value in samples:
+            lines.append(f'{sample_name}{_format_labels(label_names, labels)} {_format_value(value)}')
+
+    def _observe(self, histogram, labels, value):
+        if self.enabled:
+            with self._lock:
+                histogram.observe(labels, value)
+
+    # Request hooks
+
+    def _before_request(self):
+        local = self._local
+        local.statements = 0
+        local.db_seconds = 0.0
+        local.started = time.perf_counter()
+
+    def _after_request(self, response):
+        self._record_request(response.status_code)
+        return response
+
+    def _teardown_request(self, exc):
+        # after_request does not run for unhandled exceptions
+        if getattr(self._local, 'started', None) is not None:
+            self._record_request(500)
+
+    def _record_request(self, status):
+        local = self._local
+        elapsed = time.perf_counter() - local.started
+        local.started = None
+        req = request._get_current_object()
+        endpoint = req.endpoint or 'unmatched'
+        with self._lock:
+            self.requests.inc((endpoint, req.method, str(status)))
+            self.request_duration.observe((endpoint, req.method), elapsed)
+            self.request_statements.observe((endpoint,), local.statements)
+            self.request_db_duration.observe((endpoint,), local.db_seconds)
+
+    # SQLAlchemy cursor events
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self._local.statement_started = time.perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        local = self._local
+        elapsed = time.perf_counter() - local.statement_started
+        if getattr(local, 'started', None) is not None:
+            local.statements += 1
+            local.db_seconds += elapsed
+        else:
+            with self._lock:
+                self.background_statements.inc()
+                self.background_db_duration.inc(amount=elapsed)
+
+
+# Scrape-time collectors for the counters kept by the extensions
+
+def _heartbeat_buffer_metrics(app):
+    buffer = app.extensions.get('heartbeat_buffer')
+    if buffer is None:
+        return []
+    counters = buffer.counters()
+    return [
+        ('heartbeat_buffer_entries', 'gauge', 'Active sessions cached by the heartbeat buffer',
+         [({}, counters['entries'])]),
+        ('heartbeat_buffer_dirty', 'gauge', 'Buffered heartbeats not yet written to the database',
+         [({}, counters['dirty'])])
+    ]
+
+
+def _stats_cache_metrics(app):
+    cache = app.extensions.get('stats_cache')
+    if cache is None:
+        return []
+    counters = cache.counters()
+    return [
+        ('stats_cache_events_total', 'counter', 'Stats cache lookups and removals, by kind',
+         [({'event': name}, counters[name])
+          for name in ('hits', 'misses', 'expirations', 'evictions', 'invalidations')]),
+        ('stats_cache_entries', 'gauge', 'Responses currently cached', [({}, counters['entries'])])
+    ]
+
+
+def _reaper_metrics(app):
+    reaper = app.extensions.get('stale_session_reaper')
+    if reaper is None:
+        return []
+    counters = reaper.counters()
+    metrics = [
+        ('reaper_runs_total', 'counter', 'Reaper runs, by outcome', [
+            ({'outcome': 'skipped'}, counters['skipped']),
+            ({'outcome': 'error'}, counters['errors']),
+            ({'outcome': 'completed'}, counters['runs'] - counters['skipped'] - counters['errors'])
+        ]),
+        ('reaper_closed_sessions_total', 'counter', 'Stale sessions closed by the reaper',
+         [({}, counters['closed_total'])]),
+        ('reaper_purged_idempotency_keys_total', 'counter', 'Expired idempotency keys deleted by the reaper',
+         [({}, counters['purged_keys_total'])])
+    ]
+    if counters['last_duration_ms'] is not None:
+        metrics.append(('reaper_last_duration_seconds', 'gauge', 'Duration of the last completed reaper run',
+                        [({}, counters['last_duration_ms'] / 1000)]))
+    return metrics
+
+
+def _rate_limiter_metrics(app):
+    limiter = app.extensions.get('rate_limiter')
+    if limiter is None:
+        return []
+    counters = limiter.counters()
+    return [
+        ('rate_limit_requests_total', 'counter', 'Rate limited endpoints, by scope and outcome', [
+            ({'scope': scope, 'outcome': outcome}, count)
+            for scope, outcomes in counters['scopes'].items()
+            for outcome, count in outcomes.items()
+        ]),
+        ('rate_limit_buckets', 'gauge', 'Token buckets held in memory', [({}, counters['buckets'])])
+    ]
+
+
+def _activity_stream_metrics(app):
+    events = app.extensions.get('activity_events')
+    if events is None:
+        return []
+    counters = events.counters()
+    return [
+        ('activity_stream_events_total', 'counter', 'Live activity events, by outcome', [
+            ({'outcome': name}, counters[name]) for name in ('published', 'delivered', 'overflows')
+        ]),
+        ('activity_stream_subscribers', 'gauge', 'Open /api/activity/stream connections',
+         [({}, counters['subscribers'])])
+    ]
+
+
+
+def _slow_query_metrics(app):
+    slow_query_log = app.extensions.get('slow_query_log')
+    if slow_query_log is None or not slow_query_log.enabled:
+        return []
+    counters = slow_query_log.counters()
+    return [
+        ('slow_queries_total', 'counter', 'Slow SQL statements, by outcome in the slow-query log', [
+            ({'outcome': name}, counters[name]) for name in ('recorded', 'explained', 'dropped', 'errors')
+        ])
+    ]
+
+
+
+def _replica_metrics(app):
+    router = app.extensions.get('replica_router')
+    if router is None or not router.enabled:
+        return []
+    counters = router.counters()
+    replicas = counters['replicas']
+    return [
+        ('replica_routed_requests_total', 'counter', 'Read-only requests, by the database they were sent to', [
+            ({'target': target}, counters[target]) for target in ('replica', 'primary')
+        ]),
+        ('replica_behind_requests_total', 'counter',
+         'Requests sent to a replica that moved to the primary because the replica had not replayed the user\'s latest change',
+         [({}, counters['behind'])]),
+        ('replica_healthy', 'gauge', 'Whether a replica passed its last health and lag check',
+         [({'replica': replica['name']}, int(replica['healthy'])) for replica in replicas]),
+        ('replica_lag_seconds', 'gauge', 'Replication lag at the last check',
+         [({'replica': replica['name']}, replica['lag_seconds'])
+          for replica in replicas if replica['lag_seconds'] is not None])
+    ]
+
+
+
+def _pool_metrics(app):
+    profile = app.extensions.get('engine_profile')
+    if profile is None:
+        return []
+    pools = profile.counters()['pools']
+
+    def per_engine(key):
+        return [({'engine': pool['engine']}, pool[key]) for pool in pools if pool[key] is not None]
+
+    return [
+        ('db_pool_size', 'gauge', 'Connections kept open by the pool (DB_POOL_SIZE)', per_engine('size')),
+        ('db_pool_max_overflow', 'gauge', 'Extra connections allowed above the pool size', per_engine('max_overflow')),
+        ('db_pool_checked_out', 'gauge', 'Connections currently in use', per_engine('checked_out')),
+        ('db_pool_checked_in', 'gauge', 'Idle connections in the pool', per_engine('checked_in')),
+        ('db_pool_overflow', 'gauge', 'Connections open above the pool size', per_engine('overflow')),
+        ('db_pool_connections_total', 'counter', 'Database connections opened', per_engine('connects')),
+        ('db_pool_invalidations_total', 'counter', 'Connections discarded after errors or failed pre-pings',
+         per_engine('invalidations'))
+    ]
+
+
+metrics = Metrics()
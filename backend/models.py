@@ -2,14 +2,19 @@ from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
 from sqlalchemy import Index
 
-db = SQLAlchemy()
+from replicas import RoutingSession
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+# BIGSERIAL on PostgreSQL; SQLite only auto-increments INTEGER PRIMARY KEY columns
+BigIntegerPK = db.BigInteger().with_variant(db.Integer(), 'sqlite')
 
 
 class User(db.Model):
     """User model for GitHub OAuth users"""
     __tablename__ = 'users'
     
-    uid = db.Column(db.BigInteger, primary_key=True, autoincrement=True)
+    uid = db.Column(BigIntegerPK, primary_key=True, autoincrement=True)
     github_id = db.Column(db.BigInteger, unique=True, nullable=False, index=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=True)
@@ -17,6 +22,8 @@ class User(db.Model):
     name = db.Column(db.String(200), nullable=True)
     created_at = db.Column(db.DateTime(timezone=True), nullable=False, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime(timezone=True), nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Bumped on every write to the user's typing sessions; drives activity ETags
+    activity_version = db.Column(db.BigInteger, nullable=False, default=0, server_default='0')
     
     # Relationships
     posts = db.relationship('Post', backref='author', lazy=True, cascade='all, delete-orphan')
@@ -65,7 +72,7 @@ class TypingSession(db.Model):
     """Typing session model for tracking user activity"""
     __tablename__ = 'typing_sessions'
     
-    typing_id = db.Column(db.BigInteger, primary_key=True, autoincrement=True)
+    typing_id = db.Column(BigIntegerPK, primary_key=True, autoincrement=True)
     uid = db.Column(db.BigInteger, db.ForeignKey('users.uid'), nullable=False, index=True)
     started_at = db.Column(db.DateTime(timezone=True), nullable=False, index=True)
     ended_at = db.Column(db.DateTime(timezone=True), nullable=True)
@@ -80,6 +87,17 @@ class TypingSession(db.Model):
         db.CheckConstraint('ended_at IS NULL OR ended_at >= started_at', name='check_valid_time_range'),
         Index('idx_typing_sessions_uid_started', 'uid', 'started_at'),
         Index('idx_typing_sessions_active', 'uid', postgresql_where=db.text('ended_at IS NULL')),
+        # Closed sessions overlapping a time window (wall-clock accounting in rollup.py)
+        Index('idx_typing_sessions_uid_ended', 'uid', 'ended_at', postgresql_where=db.text('ended_at IS NOT NULL')),
+        # At most one open session per device (device_id NULL counts as one device)
+        Index(
+            'uq_typing_sessions_active_device',
+            'uid',
+            db.text("coalesce(device_id, '')"),
+            unique=True,
+            postgresql_where=db.text('ended_at IS NULL'),
+            sqlite_where=db.text('ended_at IS NULL')
+        ),
     )
     
     def __repr__(self):
@@ -99,3 +117,62 @@ class TypingSession(db.Model):
             'duration_seconds': (self.ended_at - self.started_at).total_seconds() if self.ended_at else None
         }
 
+
+
+class TypingDailyRollup(db.Model):
+    """Per-day typing totals, maintained incrementally as sessions close"""
+    __tablename__ = 'typing_daily_rollup'
+    
+    uid = db.Column(db.BigInteger, db.ForeignKey('users.uid', ondelete='CASCADE'), primary_key=True)
+    date = db.Column(db.Date, primary_key=True)
+    language_tag = db.Column(db.Text, primary_key=True, default='')  # '' when the session had no language
+    source = db.Column(db.Text, primary_key=True, default='web')
+    total_seconds = db.Column(db.Float, nullable=False, default=0)
+    session_count = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<TypingDailyRollup {self.uid} {self.date} {self.language_tag}/{self.source}>'
+    
+    def to_dict(self):
+        return {
+            'uid': self.uid,
+            'date': self.date.isoformat(),
+            'language_tag': self.language_tag or None,
+            'source': self.source,
+            'total_seconds': self.total_seconds,
+            'session_count': self.session_count
+        }
+
+
+class UserActivityHeatmap(db.Model):
+    """Compact per-user, per-year activity array (seconds typed on each day of the year)"""
+    __tablename__ = 'user_activity_heatmaps'
+    
+    uid = db.Column(db.BigInteger, db.ForeignKey('users.uid', ondelete='CASCADE'), primary_key=True)
+    year = db.Column(db.SmallInteger, primary_key=True)
+    seconds = db.Column(db.LargeBinary, nullable=False)  # 366 packed little-endian uint32, index = day of year - 1
+    updated_at = db.Column(db.DateTime(timezone=True), nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<UserActivityHeatmap {self.uid} {self.year}>'
+
+
+class IdempotencyKey(db.Model):
+    """Stored response of a write request, replayed when the client retries with the same Idempotency-Key"""
+    __tablename__ = 'idempotency_keys'
+    
+    uid = db.Column(db.BigInteger, db.ForeignKey('users.uid', ondelete='CASCADE'), primary_key=True)
+    key = db.Column(db.String(255), primary_key=True)
+    endpoint = db.Column(db.Text, nullable=False)
+    request_hash = db.Column(db.LargeBinary(16), nullable=False)  # blake2b digest of the request body
+    status_code = db.Column(db.SmallInteger, nullable=True)  # NULL while the request is in progress
+    response = db.Column(db.LargeBinary, nullable=True)
+    created_at = db.Column(db.DateTime(timezone=True), nullable=False, default=datetime.utcnow)
+    
+    # Purged by age (idempotency.purge_expired_keys)
+    __table_args__ = (
+        Index('idx_idempotency_keys_created', 'created_at'),
+    )
+    
+    def __repr__(self):
+        return f'<IdempotencyKey {self.uid} {self.key}>'
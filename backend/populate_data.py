@@ -1,108 +1,456 @@
 """
-Script to populate database with sample data
-Usage: python populate_data.py
+Script to populate the database with synthetic users, typing sessions and posts
+Usage: python populate_data.py [--users N] [--sessions-per-user N] [--days N] [--seed N] [--jobs N] [--clear]
+
+Generates realistic activity for scale testing:
+- per-user activity levels (log-normal), so a few users produce most sessions
+- diurnal and weekly patterns in each user's own time zone
+- one to three devices per user (VS Code mostly, some web); sessions on
+  different devices may overlap, sessions on one device never do
+- a handful of favourite languages per user, switched between sessions
+- log-normal session lengths (median 20 minutes)
+
+Everything a user gets is derived from (--seed, user index) alone, so a
+dataset is reproducible regardless of --chunk-size or --jobs.
+
+Users are written in chunks of --chunk-size, each in one transaction together
+with their sessions, posts, daily rollup and heatmap rows (the rollup is
+computed here, so rebuild_rollup.py is not needed afterwards). On PostgreSQL
+rows are bulk loaded with COPY. An interrupted run resumes where it stopped
+when started again with the same options; --clear deletes all generated data
+first.
+
+Generated users have github_id >= 8000000000 and usernames user<index>.
 """
+import argparse
+import io
+import itertools
+import math
+import multiprocessing
+import random
+import time
+from datetime import date, datetime, timedelta, timezone
+
+from sqlalchemy import create_engine, delete, insert, select
+
 from app import create_app
-from models import db, User, Post
-from datetime import datetime, timedelta
+from models import db, User, Post, TypingSession, TypingDailyRollup, UserActivityHeatmap
+from rollup import rollup_key
+from intervals import owned_lengths
+from heatmap import MAX_SECONDS_PER_DAY, day_index, empty_days, pack_days
+
+GENERATED_GITHUB_ID_BASE = 8_000_000_000
+
+# Relative likelihood of starting a session in each local hour, 00:00-23:00
+DIURNAL_WEIGHTS = [1, 0.5, 0.3, 0.2, 0.2, 0.3, 0.8, 2, 4, 7, 9, 9, 6, 7, 9, 9, 8, 6, 4, 4, 5, 5, 4, 2]
+DIURNAL_CUM_WEIGHTS = list(itertools.accumulate(DIURNAL_WEIGHTS))
+HOURS = range(24)
+WEEKEND_FACTOR = 0.4
+
+LANGUAGES = [
+    'python', 'typescript', 'javascript', 'java', 'go', 'rust', 'cpp', 'c', 'csharp',
+    'ruby', 'php', 'kotlin', 'swift', 'html', 'css', 'sql', 'shellscript', 'markdown'
+]
+LANGUAGE_WEIGHTS = [20, 18, 15, 9, 6, 5, 5, 3, 4, 2, 3, 2, 2, 4, 3, 3, 3, 5]
+
+# (UTC offset in hours, weight)
+TIME_ZONES = [(-8, 15), (-7, 5), (-6, 6), (-5, 14), (-3, 5), (0, 8), (1, 14), (2, 6),
+              (3, 4), (5.5, 10), (8, 8), (9, 5), (10, 2)]
+
+MEDIAN_SESSION_SECONDS = 20 * 60
+MAX_SESSION_SECONDS = 6 * 3600
+MIN_SESSION_SECONDS = 30
+
+POST_TITLES = [
+    'Shipped the {language} rewrite', 'Notes on {language} tooling', 'Debugging a {language} heisenbug',
+    'My {language} setup', 'Weekend project in {language}', 'Lessons from a {language} code review'
+]
+
+
+def _poisson(rng, mean):
+    if mean <= 0:
+        return 0
+    if mean > 30:
+        return max(0, round(rng.normalvariate(mean, math.sqrt(mean))))
+    # Knuth
+    limit, count, product = math.exp(-mean), 0, rng.random()
+    while product > limit:
+        count += 1
+        product *= rng.random()
+    return count
+
+
+class UserProfile:
+    """Everything generated for one user, derived from (seed, index)"""
+
+    def __init__(self, seed, index, days, end_date, mean_sessions, mean_posts):
+        rng = random.Random(f'{seed}:{index}')
+        self.rng = rng
+        self.index = index
+        self.days = days
+        self.end_date = end_date
+
+        # Log-normal activity with mean 1
+        self.sessions_per_day = mean_sessions / days * rng.lognormvariate(0, 0.8) / math.exp(0.32)
+        self.posts = _poisson(rng, mean_posts)
+        self.utc_offset = rng.choices(*zip(*TIME_ZONES))[0]
+        favourite_count = rng.randint(1, 4)
+        favourites = set()
+        while len(favourites) < favourite_count:
+            favourites.add(rng.choices(LANGUAGES, LANGUAGE_WEIGHTS)[0])
+        self.languages = sorted(favourites)
+        self.language_weights = [rng.uniform(0.2, 1) ** 2 for _ in self.languages]
+
+        device_count = rng.choices([1, 2, 3], [60, 30, 10])[0]
+        self.devices = [
+            ('%032x' % rng.getrandbits(128), 'vscode' if rng.random() < 0.85 else 'web')
+            for _ in range(device_count)
+        ]
+        self.device_weights = [rng.uniform(0.3, 1) for _ in self.devices]
+
+    def user_row(self):
+        first_day = self.end_date - timedelta(days=self.days)
+        created_at = datetime.combine(first_day, datetime.min.time(), timezone.utc) - timedelta(
+            days=self.rng.randint(0, 365)
+        )
+        return {
+            'github_id': GENERATED_GITHUB_ID_BASE + self.index,
+            'username': f'user{self.index}',
+            'email': f'user{self.index}@example.com',
+            'avatar_url': None,
+            'name': f'User {self.index}',
+            'created_at': created_at,
+            'updated_at': created_at
+        }
+
+    def sessions(self, now):
+        """
+        Sessions as (start, end, language_tag, source, device_id), epoch
+        seconds, sorted by start
+        """
+        rng = self.rng
+        per_device = [[] for _ in self.devices]
+        offset = timedelta(hours=self.utc_offset)
+        first_day = self.end_date - timedelta(days=self.days - 1)
+
+        for day_number in range(self.days):
+            day = first_day + timedelta(days=day_number)
+            mean = self.sessions_per_day * (WEEKEND_FACTOR if day.weekday() >= 5 else 1)
+            local_midnight = datetime.combine(day, datetime.min.time(), timezone.utc) - offset
+            for _ in range(_poisson(rng, mean)):
+                hour = rng.choices(HOURS, cum_weights=DIURNAL_CUM_WEIGHTS)[0]
+                start = local_midnight.timestamp() + (hour + rng.random()) * 3600
+                length = min(max(rng.lognormvariate(math.log(MEDIAN_SESSION_SECONDS), 0.9),
+                                 MIN_SESSION_SECONDS), MAX_SESSION_SECONDS)
+                device = rng.choices(range(len(self.devices)), self.device_weights)[0]
+                per_device[device].append((start, length))
+
+        sessions = []
+        for (device_id, source), starts in zip(self.devices, per_device):
+            starts.sort()
+            language = rng.choices(self.languages, self.language_weights)[0]
+            device_free_at = -math.inf
+            for start, length in starts:
+                # One device runs one session at a time
+                # Millisecond precision, so the rollup computed here matches a
+                # rebuild from the stored (microsecond) timestamps exactly
+                start = round(max(start, device_free_at + rng.uniform(30, 300)), 3)
+                end = round(start + length, 3)
+                if end > now:
+                    break
+                if rng.random() < 0.3:
+                    language = rng.choices(self.languages, self.language_weights)[0]
+                sessions.append((start, end, language, source, device_id))
+                device_free_at = end
+
+        sessions.sort()
+        return sessions
+
+    def post_rows(self, uid, now):
+        rows = []
+        for _ in range(self.posts):
+            language = self.rng.choice(self.languages)
+            created_at = now - timedelta(seconds=self.rng.uniform(0, self.days * 86400))
+            rows.append({
+                'title': self.rng.choice(POST_TITLES).format(language=language.capitalize()),
+                'content': f'Some thoughts from user{self.index} about working in {language}.',
+                'created_at': created_at.replace(tzinfo=None),
+                'user_id': uid
+            })
+        return rows
+
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, str):
+        return '"' + value.replace('"', '""') + '"'
+    if isinstance(value, bytes):
+        return '"\\x' + value.hex() + '"'
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    return str(value)
+
+
+class _LineReader(io.TextIOBase):
+    """File-like object over an iterator of CSV text, for COPY FROM STDIN"""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = ''
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            try:
+                self._buffer += next(self._chunks)
+            except StopIteration:
+                break
+        if size < 0:
+            data, self._buffer = self._buffer, ''
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+def bulk_load(connection, table, columns, batches):
+    """
+    Load rows into table: COPY on PostgreSQL, executemany elsewhere
+
+    Args:
+        batches (iterable): Lists of row tuples in column order
+
+    Returns:
+        int: Number of rows loaded
+    """
+    count = 0
+
+    if connection.dialect.name == 'postgresql':
+        def lines():
+            nonlocal count
+            for batch in batches:
+                count += len(batch)
+                yield ''.join(','.join(map(_csv_value, row)) + '\n' for row in batch)
+
+        copy_sql = f"COPY {table.name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)"
+        cursor = connection.connection.driver_connection.cursor()
+        try:
+            if connection.dialect.driver == 'psycopg':
+                # psycopg 3 has no copy_expert; rows are written to a Copy object
+                with cursor.copy(copy_sql) as copy:
+                    for chunk in lines():
+                        copy.write(chunk)
+            else:
+                cursor.copy_expert(copy_sql, _LineReader(lines()), size=1 << 16)
+        finally:
+            cursor.close()
+        return count
+
+    for batch in batches:
+        if batch:
+            connection.execute(insert(table), [dict(zip(columns, row)) for row in batch])
+            count += len(batch)
+    return count
+
+
+SESSION_COPY_COLUMNS = ['uid', 'started_at', 'ended_at', 'language_tag', 'source', 'device_id',
+                        'created_at', 'updated_at']
+ROLLUP_COPY_COLUMNS = ['uid', 'date', 'language_tag', 'source', 'total_seconds', 'session_count']
+HEATMAP_COPY_COLUMNS = ['uid', 'year', 'seconds', 'updated_at']
+
+
+def load_chunk(connection, chunk_start, chunk_end, options, now):
+    """
+    Generate and load users [chunk_start, chunk_end) in the caller's transaction
+
+    Returns:
+        tuple: (users, sessions, posts)
+    """
+    profiles = [
+        UserProfile(options['seed'], index, options['days'], options['end_date'],
+                    options['sessions_per_user'], options['posts_per_user'])
+        for index in range(chunk_start, chunk_end)
+    ]
+
+    connection.execute(insert(User), [profile.user_row() for profile in profiles])
+    uids = dict(connection.execute(
+        select(User.github_id, User.uid).where(
+            User.github_id >= GENERATED_GITHUB_ID_BASE + chunk_start,
+            User.github_id < GENERATED_GITHUB_ID_BASE + chunk_end
+        )
+    ).all())
+
+    rollup = {}
+    with_rollup = options['rollup']
+
+    def session_batches():
+        for profile in profiles:
+            uid = uids[GENERATED_GITHUB_ID_BASE + profile.index]
+            sessions = profile.sessions(now.timestamp())
+            rows = []
+            for start, end, language_tag, source, device_id in sessions:
+                started_at = datetime.fromtimestamp(start, timezone.utc)
+                ended_at = datetime.fromtimestamp(end, timezone.utc)
+                rows.append((uid, started_at, ended_at, language_tag, source, device_id, started_at, ended_at))
+            if with_rollup:
+                # Rows are loaded in start order, so typing_id order matches rank order
+                owned = owned_lengths([(start, end) for start, end, _, _, _ in sessions])
+                for row, seconds in zip(rows, owned):
+                    key = rollup_key(uid, row[1], row[3], row[4])
+                    total, count = rollup.get(key, (0.0, 0))
+                    rollup[key] = (total + seconds, count + 1)
+            yield rows
+
+    session_count = bulk_load(connection, TypingSession.__table__, SESSION_COPY_COLUMNS, session_batches())
+
+    posts = [row for profile in profiles
+             for row in profile.post_rows(uids[GENERATED_GITHUB_ID_BASE + profile.index], now)]
+    if posts:
+        connection.execute(insert(Post), posts)
+
+    if with_rollup and rollup:
+        keys = sorted(rollup)
+        bulk_load(connection, TypingDailyRollup.__table__, ROLLUP_COPY_COLUMNS, [
+            [key + rollup[key] for key in keys]
+        ])
+
+        # Same rounding as heatmap.rebuild_heatmap: per-day sums over all languages and sources
+        daily = {}
+        for (uid, day, _, _), (seconds, _) in rollup.items():
+            daily[uid, day] = daily.get((uid, day), 0.0) + seconds
+        heatmaps = {}
+        for (uid, day), seconds in daily.items():
+            days = heatmaps.setdefault((uid, day.year), empty_days())
+            days[day_index(day)] = min(int(round(seconds)), MAX_SECONDS_PER_DAY)
+        bulk_load(connection, UserActivityHeatmap.__table__, HEATMAP_COPY_COLUMNS, [[
+            (uid, year, pack_days(days), now)
+            for (uid, year), days in sorted(heatmaps.items())
+        ]])
+
+    return len(profiles), session_count, len(posts)
+
+
+def completed_chunks(connection, users, chunk_size):
+    """Chunks whose users already exist (each chunk is loaded atomically)"""
+    existing = set(connection.execute(
+        select(User.github_id).where(
+            User.github_id >= GENERATED_GITHUB_ID_BASE,
+            User.github_id < GENERATED_GITHUB_ID_BASE + users
+        )
+    ).scalars())
+    return {
+        start for start in range(0, users, chunk_size)
+        if GENERATED_GITHUB_ID_BASE + start in existing
+    }
+
+
+def clear_generated(connection):
+    """Delete generated users and everything that belongs to them"""
+    generated = select(User.uid).where(User.github_id >= GENERATED_GITHUB_ID_BASE)
+    for model, column in ((TypingSession, TypingSession.uid), (Post, Post.user_id),
+                          (TypingDailyRollup, TypingDailyRollup.uid),
+                          (UserActivityHeatmap, UserActivityHeatmap.uid)):
+        connection.execute(delete(model).where(column.in_(generated)))
+    return connection.execute(delete(User).where(User.github_id >= GENERATED_GITHUB_ID_BASE)).rowcount
+
+
+_worker_engine = None
+
+
+def _init_worker(database_uri):
+    global _worker_engine
+    _worker_engine = create_engine(database_uri)
+
+
+def _load_chunk_in_worker(task):
+    chunk_start, chunk_end, options, now = task
+    with _worker_engine.begin() as connection:
+        return chunk_start, load_chunk(connection, chunk_start, chunk_end, options, now)
 
 
 def populate_data():
-    """Populate database with sample data"""
-    app = create_app()
-    
+    """Generate synthetic data in resumable chunks"""
+    parser = argparse.ArgumentParser(description='Populate the database with synthetic activity data')
+    parser.add_argument('--users', type=int, default=20, help='Users to generate (default: 20)')
+    parser.add_argument('--sessions-per-user', type=float, default=200,
+                        help='Average typing sessions per user over the whole period (default: 200)')
+    parser.add_argument('--posts-per-user', type=float, default=0.5, help='Average posts per user (default: 0.5)')
+    parser.add_argument('--days', type=int, default=90, help='Length of the activity history in days (default: 90)')
+    parser.add_argument('--end-date', type=date.fromisoformat, default=None,
+                        help='Last day of the history, YYYY-MM-DD (default: today, UTC)')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed (default: 0)')
+    parser.add_argument('--chunk-size', type=int, default=100, help='Users per transaction (default: 100)')
+    parser.add_argument('--jobs', type=int, default=1, help='Parallel loader processes, PostgreSQL only (default: 1)')
+    parser.add_argument('--no-rollup', dest='rollup', action='store_false',
+                        help='Skip the daily rollup and heatmap (run rebuild_rollup.py later)')
+    parser.add_argument('--clear', action='store_true', help='Delete previously generated data first')
+    args = parser.parse_args()
+
+    now = datetime.now(timezone.utc)
+    end_date = args.end_date or now.date()
+    options = {
+        'seed': args.seed,
+        'days': args.days,
+        'end_date': end_date,
+        'sessions_per_user': args.sessions_per_user,
+        'posts_per_user': args.posts_per_user,
+        'rollup': args.rollup
+    }
+
+    app = create_app(background_jobs=False)
+
     with app.app_context():
-        print("Populating database with sample data...")
-        
-        # Check if data already exists
-        if User.query.first():
-            print("⚠ Database already contains data.")
-            response = input("Do you want to clear existing data and repopulate? (yes/no): ")
-            if response.lower() != 'yes':
-                print("Operation cancelled.")
-                return
-            
-            print("Clearing existing data...")
-            db.session.query(Post).delete()
-            db.session.query(User).delete()
-            db.session.commit()
-        
-        # Create sample users
-        users = [
-            User(
-                username='alice',
-                email='alice@example.com',
-                created_at=datetime.utcnow() - timedelta(days=30)
-            ),
-            User(
-                username='bob',
-                email='bob@example.com',
-                created_at=datetime.utcnow() - timedelta(days=20)
-            ),
-            User(
-                username='charlie',
-                email='charlie@example.com',
-                created_at=datetime.utcnow() - timedelta(days=10)
-            )
-        ]
-        
-        db.session.add_all(users)
-        db.session.commit()
-        print(f"✓ Created {len(users)} users")
-        
-        # Create sample posts
-        posts = [
-            Post(
-                title='Welcome to StormHacks 2025!',
-                content='This is our first post. We are excited to build something amazing!',
-                user_id=users[0].id,
-                created_at=datetime.utcnow() - timedelta(days=29)
-            ),
-            Post(
-                title='Building with Flask and PostgreSQL',
-                content='Flask is a great framework for building web applications. PostgreSQL is a powerful database.',
-                user_id=users[0].id,
-                created_at=datetime.utcnow() - timedelta(days=25)
-            ),
-            Post(
-                title='Docker makes deployment easy',
-                content='Using Docker Compose to manage our PostgreSQL instance is very convenient.',
-                user_id=users[1].id,
-                created_at=datetime.utcnow() - timedelta(days=15)
-            ),
-            Post(
-                title='Team collaboration tips',
-                content='Make sure to communicate regularly with your team and commit often!',
-                user_id=users[1].id,
-                created_at=datetime.utcnow() - timedelta(days=10)
-            ),
-            Post(
-                title='Final preparations',
-                content='We are getting ready for the demo. Excited to present our project!',
-                user_id=users[2].id,
-                created_at=datetime.utcnow() - timedelta(days=2)
-            )
+        if args.jobs > 1 and db.engine.dialect.name != 'postgresql':
+            parser.error('--jobs needs PostgreSQL')
+
+        if args.clear:
+            with db.engine.begin() as connection:
+                print(f"✓ Deleted {clear_generated(connection)} generated users and their data")
+
+        with db.engine.connect() as connection:
+            done = completed_chunks(connection, args.users, args.chunk_size)
+        pending = [
+            (start, min(start + args.chunk_size, args.users), options, now)
+            for start in range(0, args.users, args.chunk_size) if start not in done
         ]
-        
-        db.session.add_all(posts)
-        db.session.commit()
-        print(f"✓ Created {len(posts)} posts")
-        
-        print("\n✓ Database populated successfully!")
-        print("\nSummary:")
-        print(f"  - Users: {User.query.count()}")
-        print(f"  - Posts: {Post.query.count()}")
-        
-        # Display sample data
-        print("\nSample users:")
-        for user in User.query.all():
-            print(f"  - {user.username} ({user.email})")
-        
-        print("\nSample posts:")
-        for post in Post.query.all():
-            print(f"  - '{post.title}' by {post.author.username}")
+
+        print(f"Generating {args.users} users x ~{args.sessions_per_user:g} sessions over {args.days} days "
+              f"ending {end_date} (seed {args.seed})")
+        if done:
+            print(f"Resuming: {len(done)} of {len(done) + len(pending)} chunks already loaded")
+
+        started = time.perf_counter()
+        totals = [0, 0, 0]
+
+        def report(chunk_start, counts):
+            for i, count in enumerate(counts):
+                totals[i] += count
+            elapsed = time.perf_counter() - started
+            print(f"  users {chunk_start}-{chunk_start + counts[0] - 1}: {counts[1]} sessions "
+                  f"({totals[1] / elapsed:,.0f} sessions/s overall)")
+
+        if args.jobs > 1:
+            database_uri = app.config['SQLALCHEMY_DATABASE_URI']
+            # Connections must not be shared with forked workers
+            db.engine.dispose()
+            with multiprocessing.Pool(args.jobs, initializer=_init_worker, initargs=(database_uri,)) as pool:
+                for chunk_start, counts in pool.imap_unordered(_load_chunk_in_worker, pending):
+                    report(chunk_start, counts)
+        else:
+            for chunk_start, chunk_end, chunk_options, chunk_now in pending:
+                with db.engine.begin() as connection:
+                    counts = load_chunk(connection, chunk_start, chunk_end, chunk_options, chunk_now)
+                report(chunk_start, counts)
+
+        print(f"\n✓ Created {totals[0]} users, {totals[1]} typing sessions and {totals[2]} posts "
+              f"in {time.perf_counter() - started:.1f}s")
+        if not args.rollup:
+            print("Run python rebuild_rollup.py to build the daily rollup and heatmaps")
 
 
 if __name__ == '__main__':
     populate_data()
-
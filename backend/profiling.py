@@ -0,0 +1,249 @@
+"""
+On-demand profiling of single requests
+
+With PROFILING_ENABLED, an admin adds ``X-Profile: 1`` (or ``?_profile=1``) to a
+request to run it under cProfile and tracemalloc. The CPU profile, the
+allocation snapshot and a JSON summary are saved in PROFILING_DIR under a
+profile id that is returned in the ``X-Profile-Id`` response header; admins
+list and download them from /api/profiles.
+
+When profiling is disabled no request hooks are installed, so ordinary
+requests don't pay for it.
+"""
+import cProfile
+import io
+import json
+import os
+import pstats
+import re
+import threading
+import time
+import tracemalloc
+import uuid
+from datetime import datetime, timezone
+
+from flask import Blueprint, g, jsonify, request, send_from_directory
+
+from auth_utils import admin_required, get_token_payload, is_admin
+
+PROFILE_HEADER = 'X-Profile'
+PROFILE_QUERY_ARG = '_profile'
+TRACEMALLOC_FRAMES = 5
+TOP_ENTRIES = 25
+PROFILE_ID_PATTERN = re.compile(r'^\d{8}T\d{12}-[0-9a-f]{8}$')
+DOWNLOAD_SUFFIXES = {'prof': '.prof', 'tracemalloc': '.tracemalloc'}
+
+profiling_bp = Blueprint("profiling", __name__)
+
+
+class RequestProfiler:
+    """
+    Profiles requests flagged by an admin and saves the results to disk
+
+    Usage:
+        request_profiler = RequestProfiler()
+        request_profiler.init_app(app)
+    """
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self.directory = 'instance/profiles'
+        self.max_profiles = 100
+        # cProfile and tracemalloc are process-wide: one profiled request at a time
+        self._busy = threading.Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Read settings from the app config and install the request hooks"""
+        self.enabled = app.config['PROFILING_ENABLED']
+        self.directory = app.config['PROFILING_DIR']
+        self.max_profiles = app.config['PROFILING_MAX_PROFILES']
+        app.extensions['request_profiler'] = self
+        if not self.enabled:
+            return
+
+        os.makedirs(self.directory, exist_ok=True)
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+
+    def list_profiles(self):
+        """Summaries of the saved profiles, newest first"""
+        profiles = []
+        for name in sorted(os.listdir(self.directory), reverse=True):
+            if not name.endswith('.json'):
+                continue
+            summary = self.load_summary(name[:-len('.json')])
+            if summary:
+                profiles.append({key: summary[key] for key in (
+                    'id', 'created_at', 'endpoint', 'method', 'path', 'status', 'duration_ms', 'user'
+                )})
+        return profiles
+
+    def load_summary(self, profile_id):
+        """Saved summary of a profile, or None if it doesn't exist"""
+        if not PROFILE_ID_PATTERN.match(profile_id):
+            return None
+        try:
+            with open(os.path.join(self.directory, f'{profile_id}.json'), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    # Request hooks
+
+    def _before_request(self):
+        if not (request.headers.get(PROFILE_HEADER) or request.args.get(PROFILE_QUERY_ARG)):
+            return
+        payload = get_token_payload()
+        user = payload.get('user') if payload else None
+        if not is_admin(user):
+            g._profile_status = 'forbidden'
+            return
+        if not self._busy.acquire(blocking=False):
+            g._profile_status = 'busy'
+            return
+
+        started_tracemalloc = not tracemalloc.is_tracing()
+        if started_tracemalloc:
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        elif hasattr(tracemalloc, 'reset_peak'):   # Python 3.9+
+            tracemalloc.reset_peak()
+        profiler = cProfile.Profile()
+        g._profile = {
+            'profiler': profiler,
+            'login': user['login'],
+            'started_tracemalloc': started_tracemalloc,
+            'started': time.perf_counter()
+        }
+        profiler.enable()
+
+    def _after_request(self, response):
+        status = g.pop('_profile_status', None)
+        if '_profile' in g:
+            profile_id = self._finish(g.pop('_profile'), response.status_code)
+            if profile_id:
+                response.headers['X-Profile-Id'] = profile_id
+            else:
+                status = 'error'
+        if status:
+            response.headers['X-Profile-Status'] = status
+        return response
+
+    def _teardown_request(self, exc):
+        # after_request does not run for unhandled exceptions
+        if '_profile' in g:
+            self._finish(g.pop('_profile'), 500)
+
+    def _finish(self, profile, status):
+        profiler = profile['profiler']
+        profiler.disable()
+        duration = time.perf_counter() - profile['started']
+        try:
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            if profile['started_tracemalloc']:
+                tracemalloc.stop()
+            self._busy.release()
+
+        now = datetime.now(timezone.utc)
+        profile_id = f"{now:%Y%m%dT%H%M%S%f}-{uuid.uuid4().hex[:8]}"
+        summary = {
+            'id': profile_id,
+            'created_at': now.isoformat(),
+            'endpoint': request.endpoint,
+            'method': request.method,
+            'path': request.full_path.rstrip('?'),
+            'status': status,
+            'duration_ms': round(duration * 1000, 3),
+            'user': profile['login'],
+            'peak_memory_bytes': peak,
+            'top_functions': _top_functions(profiler),
+            'top_allocations': _top_allocations(snapshot)
+        }
+        base = os.path.join(self.directory, profile_id)
+        try:
+            profiler.dump_stats(base + '.prof')
+            snapshot.dump(base + '.tracemalloc')
+            with open(base + '.json', 'w', encoding='utf-8') as f:
+                json.dump(summary, f, indent=2)
+            self._prune()
+        except OSError as e:
+            print(f"Request profiler: could not save profile {profile_id}: {e}")
+            return None
+        return profile_id
+
+    def _prune(self):
+        """Delete the oldest profiles beyond max_profiles"""
+        ids = sorted(name[:-len('.json')] for name in os.listdir(self.directory) if name.endswith('.json'))
+        for profile_id in ids[:-self.max_profiles] if self.max_profiles > 0 else ids:
+            for suffix in ('.json', *DOWNLOAD_SUFFIXES.values()):
+                try:
+                    os.remove(os.path.join(self.directory, profile_id + suffix))
+                except FileNotFoundError:
+                    pass
+
+
+def _top_functions(profiler):
+    """Functions with the most cumulative time"""
+    stats = pstats.Stats(profiler, stream=io.StringIO())
+    rows = []
+    for (filename, line, name), (_, ncalls, tottime, cumtime, _) in stats.stats.items():
+        rows.append({
+            'function': f'{filename}:{line}({name})',
+            'calls': ncalls,
+            'tottime_ms': round(tottime * 1000, 3),
+            'cumtime_ms': round(cumtime * 1000, 3)
+        })
+    rows.sort(key=lambda row: row['cumtime_ms'], reverse=True)
+    return rows[:TOP_ENTRIES]
+
+
+def _top_allocations(snapshot):
+    """Source lines holding the most memory allocated since tracing started"""
+    snapshot = snapshot.filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, cProfile.__file__)
+    ))
+    return [
+        {'location': str(stat.traceback[0]), 'size_bytes': stat.size, 'count': stat.count}
+        for stat in snapshot.statistics('lineno')[:TOP_ENTRIES]
+    ]
+
+
+request_profiler = RequestProfiler()
+
+
+@profiling_bp.route('/api/profiles', methods=['GET'])
+@admin_required
+def list_profiles(current_user):
+    """List saved request profiles, newest first (admin only)"""
+    if not request_profiler.enabled:
+        return jsonify({'error': 'Not found', 'message': 'Profiling is disabled'}), 404
+    return jsonify({'profiles': request_profiler.list_profiles()})
+
+
+@profiling_bp.route('/api/profiles/<profile_id>', methods=['GET'])
+@admin_required
+def get_profile(current_user, profile_id):
+    """Summary of a profile: top functions by cumulative time and top allocations (admin only)"""
+    summary = request_profiler.load_summary(profile_id) if request_profiler.enabled else None
+    if summary is None:
+        return jsonify({'error': 'Not found', 'message': 'Profile not found'}), 404
+    return jsonify(summary)
+
+
+@profiling_bp.route('/api/profiles/<profile_id>/<kind>', methods=['GET'])
+@admin_required
+def download_profile(current_user, profile_id, kind):
+    """Download the cProfile stats ('prof') or tracemalloc snapshot ('tracemalloc') (admin only)"""
+    if not request_profiler.enabled or kind not in DOWNLOAD_SUFFIXES or not PROFILE_ID_PATTERN.match(profile_id):
+        return jsonify({'error': 'Not found', 'message': 'Profile not found'}), 404
+    return send_from_directory(
+        os.path.abspath(request_profiler.directory),
+        profile_id + DOWNLOAD_SUFFIXES[kind],
+        as_attachment=True
+    )
@@ -0,0 +1,119 @@
+"""
+In-memory token-bucket rate limiting for the activity endpoints
+
+Each (scope, user, device) gets a bucket that refills at a steady rate up to a
+burst size; every request takes one token. Heartbeats (/api/activity/start)
+have their own, tighter scope. activity.py checks the buckets in a
+before_request hook, before the route decodes the body or opens a
+transaction.
+
+Buckets live in the worker process, so with N workers a client can get up to
+N times the configured rate. Idle buckets are dropped once there are more
+than RATE_LIMIT_MAX_BUCKETS of them (least recently used first).
+"""
+import math
+import threading
+import time
+from collections import OrderedDict
+
+
+class TokenBucketLimiter:
+    """
+    Per-key token buckets with shed/reject counters
+
+    Usage:
+        rate_limiter = TokenBucketLimiter()
+        rate_limiter.init_app(app)
+
+        allowed, retry_after = rate_limiter.consume('heartbeat', (uid, device_id))
+    """
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self.max_buckets = 100000
+        self.limits = {}            # scope -> (tokens per second, burst)
+        self._buckets = OrderedDict()   # (scope, key) -> [tokens, last refill]
+        self._lock = threading.Lock()
+        self._counters = {}
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config['RATE_LIMIT_ENABLED']
+        self.max_buckets = app.config['RATE_LIMIT_MAX_BUCKETS']
+        self.limits = {
+            'heartbeat': (
+                app.config['RATE_LIMIT_HEARTBEAT_PER_SECOND'],
+                app.config['RATE_LIMIT_HEARTBEAT_BURST']
+            ),
+            'default': (
+                app.config['RATE_LIMIT_DEFAULT_PER_SECOND'],
+                app.config['RATE_LIMIT_DEFAULT_BURST']
+            )
+        }
+        self._counters = {
+            scope: {'allowed': 0, 'shed': 0, 'rejected': 0}
+            for scope in self.limits
+        }
+        app.extensions['rate_limiter'] = self
+
+    def consume(self, scope, key, now=None):
+        """
+        Take one token from a bucket
+
+        Args:
+            scope (str): 'heartbeat' or 'default'
+            key (hashable): Identity within the scope, e.g. (uid, device_id)
+
+        Returns:
+            tuple: (allowed, retry_after) - retry_after is the number of whole
+                seconds until a token is available (0 when allowed)
+        """
+        rate, burst = self.limits[scope]
+        now = time.monotonic() if now is None else now
+        bucket_key = (scope, key)
+
+        with self._lock:
+            bucket = self._buckets.get(bucket_key)
+            if bucket is None:
+                bucket = [float(burst), now]
+                self._buckets[bucket_key] = bucket
+                while len(self._buckets) > self.max_buckets:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(bucket_key)
+                bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+                bucket[1] = now
+
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                self._counters[scope]['allowed'] += 1
+                return True, 0
+            missing = 1 - bucket[0]
+
+        retry_after = math.ceil(missing / rate) if rate > 0 else 60
+        return False, max(retry_after, 1)
+
+    def record(self, scope, outcome):
+        """Count a limited request as 'shed' (answered from cache) or 'rejected' (429)"""
+        with self._lock:
+            self._counters[scope][outcome] += 1
+
+    def counters(self):
+        """Counters for this process, per scope"""
+        with self._lock:
+            counters = {scope: dict(values) for scope, values in self._counters.items()}
+            buckets = len(self._buckets)
+        return {
+            'enabled': self.enabled,
+            'buckets': buckets,
+            'limits': {
+                scope: {'per_second': rate, 'burst': burst}
+                for scope, (rate, burst) in self.limits.items()
+            },
+            'scopes': counters
+        }
+
+
+rate_limiter = TokenBucketLimiter()
@@ -0,0 +1,203 @@
+"""
+Background reaper for stale typing sessions
+
+Sessions whose device stopped sending heartbeats stay open until something
+closes them. The reaper periodically closes every session with no update for
+REAPER_THRESHOLD_SECONDS in one set-based UPDATE (ended_at = updated_at),
+folds the closed sessions into the daily rollup, invalidates cached stats and
+notifies live streams. The same thread purges expired idempotency keys; the
+two jobs are switched on and off separately (REAPER_ENABLED,
+IDEMPOTENCY_PURGE_ENABLED), and the thread runs while either is on.
+
+Only the server starts the thread: command-line scripts build their app with
+create_app(background_jobs=False), so nothing closes sessions or writes
+rollup rows while they rebuild or export.
+
+Several workers may run the reaper: on PostgreSQL only the one holding a
+transaction-scoped advisory lock does the work, and the UPDATE re-checks
+``ended_at IS NULL`` so a session is never closed (or rolled up) twice.
+"""
+import atexit
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import select, func, update
+
+from models import db, TypingSession
+from heartbeat_buffer import heartbeat_buffer
+from rollup import record_closed_sessions
+from stats_cache import stats_cache
+from events import publish_session_changes
+from etags import bump_activity_version
+from idempotency import purge_expired_keys
+
+# Arbitrary application-wide key for pg_try_advisory_xact_lock
+REAPER_LOCK_KEY = 0x7374_6F72_6D00
+
+
+class StaleSessionReaper:
+    """
+    Periodically closes stale sessions in bulk
+
+    Usage:
+        stale_session_reaper = StaleSessionReaper()
+        stale_session_reaper.init_app(app)
+    """
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self.purge_enabled = False
+        self.interval = 60.0
+        self.threshold_seconds = 300
+        self.idempotency_ttl_seconds = 86400
+        self._app = None
+        self._thread = None
+        self._stop_event = threading.Event()
+        self._counters = {
+            'runs': 0,
+            'skipped': 0,
+            'errors': 0,
+            'closed_total': 0,
+            'last_closed': 0,
+            'purged_keys_total': 0,
+            'last_run_at': None,
+            'last_duration_ms': None
+        }
+        self._lock = threading.Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Read settings from the app config and start the reaper thread"""
+        self.enabled = app.config['REAPER_ENABLED']
+        self.purge_enabled = app.config['IDEMPOTENCY_PURGE_ENABLED']
+        self.interval = app.config['REAPER_INTERVAL_SECONDS']
+        self.threshold_seconds = app.config['REAPER_THRESHOLD_SECONDS']
+        self.idempotency_ttl_seconds = app.config['IDEMPOTENCY_TTL_SECONDS']
+        self._app = app
+        app.extensions['stale_session_reaper'] = self
+
+        if (self.enabled or self.purge_enabled) and self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name='stale-session-reaper', daemon=True
+            )
+            self._thread.start()
+            atexit.register(self._stop_event.set)
+
+    def run_once(self):
+        """
+        Close all stale sessions and purge expired idempotency keys now
+
+        Each job only runs when it is enabled. Must be called inside an app
+        context.
+
+        Returns:
+            int: Number of sessions closed, or None if another worker holds the lock
+        """
+        started = time.perf_counter()
+
+        # Persist this process's buffered heartbeats first so recently active
+        # sessions are not mistaken for stale ones
+        if self.enabled:
+            heartbeat_buffer.flush()
+
+        try:
+            if db.engine.dialect.name == 'postgresql':
+                got_lock = db.session.execute(
+                    select(func.pg_try_advisory_xact_lock(REAPER_LOCK_KEY))
+                ).scalar()
+                if not got_lock:
+                    db.session.rollback()
+                    self._record(skipped=True)
+                    return None
+
+            closed = self._close_stale() if self.enabled else []
+            purged = purge_expired_keys(self.idempotency_ttl_seconds) if self.purge_enabled else 0
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            self._record(error=True)
+            raise
+
+        closed_by_uid = {}
+        for row in closed:
+            closed_by_uid.setdefault(row.uid, []).append(row)
+        for uid, rows in closed_by_uid.items():
+            stats_cache.invalidate(uid)
+            publish_session_changes(uid, rows)
+
+        self._record(closed=len(closed), purged=purged, duration=time.perf_counter() - started)
+        return len(closed)
+
+    def _close_stale(self):
+        """Close stale sessions and roll them up, in the caller's transaction"""
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=self.threshold_seconds)
+
+        # Matches the idx_typing_sessions_active partial index (ended_at IS NULL)
+        stmt = (
+            update(TypingSession)
+            .where(
+                TypingSession.ended_at.is_(None),
+                TypingSession.updated_at < cutoff
+            )
+            .values(
+                ended_at=TypingSession.updated_at,
+                updated_at=TypingSession.updated_at
+            )
+            .returning(
+                TypingSession.typing_id,
+                TypingSession.uid,
+                TypingSession.started_at,
+                TypingSession.ended_at,
+                TypingSession.language_tag,
+                TypingSession.source,
+                TypingSession.device_id
+            )
+            .execution_options(synchronize_session=False)
+        )
+        closed = db.session.execute(stmt).all()
+
+        record_closed_sessions(closed)
+        bump_activity_version(row.uid for row in closed)
+        return closed
+
+    def counters(self):
+        """Counters for this process"""
+        with self._lock:
+            counters = dict(self._counters)
+        counters['enabled'] = self.enabled
+        counters['purge_enabled'] = self.purge_enabled
+        counters['interval_seconds'] = self.interval
+        counters['threshold_seconds'] = self.threshold_seconds
+        return counters
+
+    def _record(self, closed=0, purged=0, duration=None, skipped=False, error=False):
+        with self._lock:
+            self._counters['runs'] += 1
+            self._counters['last_run_at'] = datetime.now(timezone.utc).isoformat()
+            if skipped:
+                self._counters['skipped'] += 1
+            elif error:
+                self._counters['errors'] += 1
+            else:
+                self._counters['closed_total'] += closed
+                self._counters['last_closed'] = closed
+                self._counters['purged_keys_total'] += purged
+                self._counters['last_duration_ms'] = round(duration * 1000, 2)
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            with self._app.app_context():
+                try:
+                    closed = self.run_once()
+                    if closed:
+                        print(f"Reaper: closed {closed} stale sessions")
+                except Exception as e:
+                    print(f"Reaper: run failed: {e}")
+                finally:
+                    db.session.remove()
+
+
+stale_session_reaper = StaleSessionReaper()
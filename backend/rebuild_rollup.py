@@ -0,0 +1,39 @@
+"""
+Script to backfill or rebuild the daily typing rollup (and the heatmap
+arrays derived from it) from typing_sessions
+Usage: python rebuild_rollup.py [--uid UID]
+"""
+import argparse
+
+from app import create_app
+from models import db
+from rollup import rebuild_rollup
+from heatmap import rebuild_heatmap
+
+
+def main():
+    """Rebuild the rollup for one user or for everyone"""
+    parser = argparse.ArgumentParser(description='Rebuild typing_daily_rollup from typing_sessions')
+    parser.add_argument('--uid', type=int, help='Only rebuild this user (default: all users)')
+    args = parser.parse_args()
+    
+    app = create_app(background_jobs=False)
+    
+    with app.app_context():
+        target = f"user {args.uid}" if args.uid is not None else "all users"
+        print(f"Rebuilding daily rollup for {target}...")
+        
+        try:
+            session_count = rebuild_rollup(uid=args.uid)
+            heatmap_rows = rebuild_heatmap(uid=args.uid)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        
+        print(f"✓ Rolled up {session_count} closed sessions")
+        print(f"✓ Rebuilt {heatmap_rows} heatmap rows")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,226 @@
+"""
+Read-replica routing for read-only routes
+
+With SQLALCHEMY_REPLICA_URIS set, views decorated with ``@read_only`` run their
+queries on a replica: one healthy replica is picked per request, round-robin,
+and the whole request reads from it, so a response is consistent with a single
+snapshot. Everything else, and any flush or insert()/update()/delete() issued
+inside a read-only view, goes to the primary. The activity ETag version is
+always read from the primary; when the replica hasn't replayed it yet, the
+rest of the request reads from the primary too (see etags.activity_version).
+
+A background thread checks every replica each REPLICA_HEALTH_CHECK_SECONDS.
+A replica that cannot be reached, or whose replay lag exceeds
+REPLICA_MAX_LAG_SECONDS, is skipped until a later check passes; when no replica
+is usable, read-only routes fall back to the primary. Lag is only measured on
+PostgreSQL; other databases (e.g. SQLite files in tests) only get a
+connectivity check.
+
+Other reads from a replica may be up to REPLICA_MAX_LAG_SECONDS behind the
+writes of the same user.
+"""
+import atexit
+import itertools
+import threading
+import time
+from functools import wraps
+
+from flask import g, has_request_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, text
+from sqlalchemy.sql.dml import UpdateBase
+
+from config import engine_options
+
+# Seconds since the last replayed transaction, or 0 when the replica has
+# replayed everything it received (an idle primary sends no new transactions)
+POSTGRES_LAG_QUERY = text("""
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+    END
+""")
+
+
+class Replica:
+    """A replica engine and the result of its last health check"""
+
+    def __init__(self, name, engine):
+        self.name = name
+        self.engine = engine
+        self.healthy = False
+        self.lag_seconds = None
+        self.last_error = None
+        self.checked_at = None
+
+
+class ReplicaRouter:
+    """
+    Picks a healthy read replica per read-only request
+
+    Usage:
+        replica_router = ReplicaRouter()
+        replica_router.init_app(app)
+    """
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self.max_lag_seconds = 5.0
+        self.check_interval = 5.0
+        self.replicas = []
+        self._next = itertools.count()
+        self._thread = None
+        self._stop_event = threading.Event()
+        self._counters = {'replica': 0, 'primary': 0, 'behind': 0}
+        self._lock = threading.Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Create the replica engines, check them once and start the health check thread"""
+        uris = app.config['SQLALCHEMY_REPLICA_URIS']
+        self.max_lag_seconds = app.config['REPLICA_MAX_LAG_SECONDS']
+        self.check_interval = app.config['REPLICA_HEALTH_CHECK_SECONDS']
+        app.extensions['replica_router'] = self
+        self.enabled = bool(uris)
+        if not self.enabled:
+            return
+
+        self.replicas = []
+        for uri in uris:
+            engine = create_engine(uri, **engine_options(app.config, uri))
+            self.replicas.append(Replica(engine.url.render_as_string(hide_password=True), engine))
+        self.check_all()
+
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='replica-health-check', daemon=True)
+            self._thread.start()
+            atexit.register(self._stop_event.set)
+
+    @property
+    def engines(self):
+        return [replica.engine for replica in self.replicas]
+
+    def choose(self):
+        """
+        Engine of the next healthy replica, round-robin
+
+        Returns:
+            Engine: Replica engine, or None to use the primary
+        """
+        healthy = [replica for replica in self.replicas if replica.healthy]
+        with self._lock:
+            self._counters['replica' if healthy else 'primary'] += 1
+        if not healthy:
+            return None
+        return healthy[next(self._next) % len(healthy)].engine
+
+    def record_behind(self):
+        """Count a request moved back to the primary because its replica was behind"""
+        with self._lock:
+            self._counters['behind'] += 1
+
+    def check_all(self):
+        """Check connectivity and replication lag of every replica"""
+        for replica in self.replicas:
+            try:
+                with replica.engine.connect() as conn:
+                    if conn.dialect.name == 'postgresql':
+                        lag = conn.execute(POSTGRES_LAG_QUERY).scalar()
+                    else:
+                        conn.execute(text('SELECT 1'))
+                        lag = 0
+                if lag is None:
+                    replica.healthy, replica.lag_seconds = False, None
+                    replica.last_error = 'no transaction replayed yet'
+                else:
+                    replica.healthy = float(lag) <= self.max_lag_seconds
+                    replica.lag_seconds = float(lag)
+                    replica.last_error = None if replica.healthy else 'replication lag too high'
+            except Exception as e:
+                replica.healthy = False
+                replica.lag_seconds = None
+                replica.last_error = str(e).splitlines()[0]
+            replica.checked_at = time.time()
+
+    def counters(self):
+        """Routing decisions for this process and the state of each replica"""
+        with self._lock:
+            counters = dict(self._counters)
+        counters['enabled'] = self.enabled
+        counters['replicas'] = [
+            {
+                'name': replica.name,
+                'healthy': replica.healthy,
+                'lag_seconds': replica.lag_seconds,
+                'last_error': replica.last_error
+            }
+            for replica in self.replicas
+        ]
+        return counters
+
+    def _run(self):
+        while not self._stop_event.wait(self.check_interval):
+            self.check_all()
+
+
+replica_router = ReplicaRouter()
+
+
+def all_engines(app):
+    """The app's primary engine followed by its replica engines (for engine event listeners)"""
+    with app.app_context():
+        engines = [app.extensions['sqlalchemy'].engine]
+    router = app.extensions.get('replica_router')
+    if router is not None and router.enabled:
+        engines.extend(router.engines)
+    return engines
+
+
+def reading_from_replica():
+    """True when the current request's reads go to a replica"""
+    return replica_router.enabled and has_request_context() and g.get('_read_replica') is not None
+
+
+def use_primary():
+    """Send the remaining reads of the current request to the primary"""
+    if reading_from_replica():
+        g._read_replica = None
+        replica_router.record_behind()
+
+
+class RoutingSession(Session):
+    """
+    db.session class that sends the reads of read-only requests to a replica
+
+    Flushes and insert()/update()/delete() statements always use the
+    primary, so a read-only view that writes still writes to the right place.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if replica_router.enabled and bind is None and not self._flushing and has_request_context():
+            engine = g.get('_read_replica')
+            if engine is not None and not isinstance(clause, UpdateBase):
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def read_only(f):
+    """
+    Decorator for views that only read; their queries may run on a replica
+
+    Usage:
+        @app.route('/api/things')
+        @read_only
+        def get_things():
+            ...
+    """
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        if replica_router.enabled:
+            g._read_replica = replica_router.choose()
+        return f(*args, **kwargs)
+
+    return decorated
@@ -0,0 +1,257 @@
+"""
+Daily typing rollup
+
+Closed sessions are folded into ``typing_daily_rollup`` (one row per uid, date,
+language_tag and source) in the same transaction that closes them, so
+/api/activity/stats only has to read a handful of rows per day instead of
+re-aggregating every raw session. Sessions are attributed to the UTC date they
+started on.
+
+Totals are wall-clock time: when a user's sessions overlap (e.g. two devices),
+the shared time is counted once, for the session that started first (see
+intervals.py). Closing a session can therefore also take seconds away from
+already-recorded sessions it overlaps.
+
+The same closes also feed the per-user heatmap arrays (see heatmap.py).
+"""
+import itertools
+
+from sqlalchemy import text
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import db, User, TypingSession, TypingDailyRollup
+import heatmap
+from intervals import owned_lengths, ownership_changes
+from time_utils import as_utc
+
+# Rows per upsert statement when rebuilding
+REBUILD_CHUNK_SIZE = 5000
+
+
+def rollup_key(uid, started_at, language_tag, source):
+    """Primary key of the rollup row a session belongs to"""
+    return (uid, as_utc(started_at).date(), language_tag or '', source or 'web')
+
+
+def overlap_adjusted_seconds(uid, sessions, now=None):
+    """
+    Wall-clock seconds gained or lost per rollup row if sessions were counted
+
+    Compares the user's already-closed sessions that overlap the new ones
+    with and without them. Still-open sessions are treated as ending at now.
+
+    Args:
+        uid (int): Internal user id
+        sessions (list): Not-yet-counted sessions of this user, with
+            typing_id, started_at, ended_at, language_tag and source
+        now (datetime): End of open sessions
+
+    Returns:
+        dict: {rollup key: seconds}; negative for rows that lose overlap
+    """
+    if not sessions:
+        return {}
+
+    added = []
+    for session in sessions:
+        start = as_utc(session.started_at)
+        end = max(as_utc(session.ended_at or now), start)
+        added.append(((start.timestamp(), session.typing_id), start.timestamp(), end.timestamp()))
+
+    window_start = min(as_utc(session.started_at) for session in sessions)
+    window_end = max(as_utc(session.ended_at or now) for session in sessions)
+    new_ids = {session.typing_id for session in sessions}
+
+    counted = [
+        row for row in db.session.query(
+            TypingSession.typing_id,
+            TypingSession.started_at,
+            TypingSession.ended_at,
+            TypingSession.language_tag,
+            TypingSession.source
+        ).filter(
+            TypingSession.uid == uid,
+            TypingSession.ended_at.isnot(None),
+            TypingSession.ended_at > window_start,
+            TypingSession.started_at < window_end
+        )
+        if row.typing_id not in new_ids
+    ]
+    existing = []
+    for row in counted:
+        start = as_utc(row.started_at).timestamp()
+        existing.append(((start, row.typing_id), start, as_utc(row.ended_at).timestamp()))
+
+    deltas, owned = ownership_changes(existing, added)
+
+    seconds = {}
+    for row, delta in zip(counted, deltas):
+        if delta:
+            key = rollup_key(uid, row.started_at, row.language_tag, row.source)
+            seconds[key] = seconds.get(key, 0.0) + delta
+    for session, value in zip(sessions, owned):
+        key = rollup_key(uid, session.started_at, session.language_tag, session.source)
+        seconds[key] = seconds.get(key, 0.0) + value
+    return seconds
+
+
+def record_closed_sessions(sessions):
+    """
+    Add closed sessions to the daily rollup
+
+    Runs in the caller's transaction, so the rollup commits (or rolls back)
+    together with the session close. Closes for the same user are serialized
+    on their users row, so each sees the sessions the other one counted.
+
+    Args:
+        sessions (iterable): Closed TypingSession objects (or rows with
+            typing_id, uid, started_at, ended_at, language_tag and source)
+    """
+    by_uid = {}
+    for session in sessions:
+        if session.ended_at is not None:
+            by_uid.setdefault(session.uid, []).append(session)
+    if not by_uid:
+        return
+
+    # Pending sessions (batch replay) need their typing_id for ranking
+    db.session.flush()
+    _lock_users(sorted(by_uid))
+
+    totals = {}
+    for uid in sorted(by_uid):
+        for key, seconds in overlap_adjusted_seconds(uid, by_uid[uid]).items():
+            old_seconds, count = totals.get(key, (0.0, 0))
+            totals[key] = (old_seconds + seconds, count)
+        for session in by_uid[uid]:
+            key = rollup_key(uid, session.started_at, session.language_tag, session.source)
+            seconds, count = totals[key]
+            totals[key] = (seconds, count + 1)
+
+    _upsert(totals)
+
+    daily_seconds = {}
+    for (uid, date, _, _), (seconds, _) in totals.items():
+        daily_seconds[(uid, date)] = daily_seconds.get((uid, date), 0.0) + seconds
+    heatmap.add_seconds(daily_seconds)
+
+
+def daily_totals(uid, dates):
+    """
+    Closed-session totals of a user for the given dates
+
+    Returns:
+        list: [{'date', 'total_seconds', 'session_count'}] in date order,
+            including dates with no sessions
+    """
+    totals = db.session.query(
+        TypingDailyRollup.date,
+        db.func.sum(TypingDailyRollup.total_seconds),
+        db.func.sum(TypingDailyRollup.session_count)
+    ).filter(
+        TypingDailyRollup.uid == uid,
+        TypingDailyRollup.date.in_(dates)
+    ).group_by(TypingDailyRollup.date)
+    rows = {date: (seconds, count) for date, seconds, count in totals}
+
+    return [
+        {
+            'date': date.isoformat(),
+            'total_seconds': float(rows.get(date, (0, 0))[0] or 0),
+            'session_count': int(rows.get(date, (0, 0))[1] or 0)
+        }
+        for date in sorted(dates)
+    ]
+
+
+def rebuild_rollup(uid=None):
+    """
+    Recompute the rollup from typing_sessions (for one user or everyone)
+
+    Streams closed sessions so memory is bounded by the number of rollup rows
+    plus one user's sessions. The caller commits.
+
+    Returns:
+        int: Number of sessions folded into the rollup
+    """
+    if db.engine.dialect.name == 'postgresql':
+        # Block concurrent incremental upserts until the rebuild commits, so
+        # sessions closed meanwhile are neither lost nor counted twice
+        db.session.execute(text('LOCK TABLE typing_daily_rollup IN EXCLUSIVE MODE'))
+
+    delete_query = TypingDailyRollup.query
+    sessions_query = db.session.query(
+        TypingSession.typing_id,
+        TypingSession.uid,
+        TypingSession.started_at,
+        TypingSession.ended_at,
+        TypingSession.language_tag,
+        TypingSession.source
+    ).filter(TypingSession.ended_at.isnot(None))
+
+    if uid is not None:
+        delete_query = delete_query.filter_by(uid=uid)
+        sessions_query = sessions_query.filter(TypingSession.uid == uid)
+
+    delete_query.delete(synchronize_session=False)
+
+    # One user at a time, in rank order, so overlaps are counted once
+    totals = {}
+    session_count = 0
+    ordered = sessions_query.order_by(
+        TypingSession.uid,
+        TypingSession.started_at,
+        TypingSession.typing_id
+    ).yield_per(REBUILD_CHUNK_SIZE)
+    for row_uid, rows in itertools.groupby(ordered, key=lambda row: row.uid):
+        rows = list(rows)
+        owned = owned_lengths([
+            (as_utc(row.started_at).timestamp(), as_utc(row.ended_at).timestamp())
+            for row in rows
+        ])
+        for row, seconds in zip(rows, owned):
+            key = rollup_key(row_uid, row.started_at, row.language_tag, row.source)
+            old_seconds, count = totals.get(key, (0.0, 0))
+            totals[key] = (old_seconds + seconds, count + 1)
+        session_count += len(rows)
+
+    keys = sorted(totals)
+    for start in range(0, len(keys), REBUILD_CHUNK_SIZE):
+        _upsert({key: totals[key] for key in keys[start:start + REBUILD_CHUNK_SIZE]})
+
+    return session_count
+
+
+def _upsert(totals):
+    """Add (seconds, count) to rollup rows, creating them as needed"""
+    if not totals:
+        return
+
+    # Sorted so concurrent upserts lock rows in the same order
+    rows = [
+        {
+            'uid': uid,
+            'date': date,
+            'language_tag': language_tag,
+            'source': source,
+            'total_seconds': seconds,
+            'session_count': count
+        }
+        for (uid, date, language_tag, source), (seconds, count) in sorted(totals.items())
+    ]
+
+    insert = postgresql.insert if db.engine.dialect.name == 'postgresql' else sqlite.insert
+    stmt = insert(TypingDailyRollup).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['uid', 'date', 'language_tag', 'source'],
+        set_={
+            'total_seconds': TypingDailyRollup.total_seconds + stmt.excluded.total_seconds,
+            'session_count': TypingDailyRollup.session_count + stmt.excluded.session_count
+        }
+    )
+    db.session.execute(stmt)
+
+
+def _lock_users(uids):
+    """Lock users rows (in uid order) for the rest of the transaction"""
+    db.session.query(User.uid).filter(User.uid.in_(uids)).order_by(User.uid).with_for_update().all()
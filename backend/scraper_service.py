@@ -7,6 +7,8 @@ import shlex
 import requests
 from bs4 import BeautifulSoup
 
+from metrics import metrics
+
 # Optional: a tiny helper to sanitize incoming command names
 def _sanitize_command_name(cmd: str) -> str:
     # only allow simple command names (no pipes, args, etc.)
@@ -17,13 +19,14 @@ def _sanitize_command_name(cmd: str) -> str:
 
 def _try_local_man(cmd: str, timeout=6):
     try:
-        proc = subprocess.run(
-            ["man", "-P", "cat", cmd],
-            capture_output=True,
-            text=True,
-            check=True,
-            timeout=timeout
-        )
+        with metrics.subprocess_timer("man"):
+            proc = subprocess.run(
+                ["man", "-P", "cat", cmd],
+                capture_output=True,
+                text=True,
+                check=True,
+                timeout=timeout
+            )
         return proc.stdout
     except Exception:
         return None
@@ -31,48 +34,54 @@ def _try_local_man(cmd: str, timeout=6):
 
 def _try_wsl_man(cmd: str, timeout=6):
     try:
-        proc = subprocess.run(
-            ["man", "-P", "cat", cmd],
-            capture_output=True,
-            text=True,
-            check=True,
-            timeout=timeout
-        )
+        with metrics.subprocess_timer("man"):
+            proc = subprocess.run(
+                ["man", "-P", "cat", cmd],
+                capture_output=True,
+                text=True,
+                check=True,
+                timeout=timeout
+            )
         return proc.stdout
     except Exception:
         return None
 
 def _try_bash_man(cmd: str, timeout=6):
     try:
-        proc = subprocess.run(
-            ["man", "-P", "cat", cmd],
-            capture_output=True,
-            text=True,
-            check=True,
-            timeout=timeout
-        )
+        with metrics.subprocess_timer("man"):
+            proc = subprocess.run(
+                ["man", "-P", "cat", cmd],
+                capture_output=True,
+                text=True,
+                check=True,
+                timeout=timeout
+            )
         return proc.stdout
     except Exception:
         return None
 
 
 
+def _extract_man_text(html: str, cmd: str) -> str:
+    # Parse HTML
+    soup = BeautifulSoup(html, "html.parser")
+    
+    # Get all text in <pre> blocks (where man pages are usually)
+    pre_blocks = soup.find_all("pre")
+    if pre_blocks:
+        text = "\n\n".join(block.get_text() for block in pre_blocks)
+        return text.strip()
+    else:
+        return f"No online man page found for '{cmd}'."
+
+
 def get_online_man_page(cmd: str):
     try:
         url = f"https://man7.org/linux/man-pages/man1/{cmd}.1.html"
-        r = requests.get(url, timeout=6)
+        with metrics.http_client_timer("man7"):
+            r = requests.get(url, timeout=6)
         r.raise_for_status()
-        
-        # Parse HTML
-        soup = BeautifulSoup(r.text, "html.parser")
-        
-        # Get all text in <pre> blocks (where man pages are usually)
-        pre_blocks = soup.find_all("pre")
-        if pre_blocks:
-            text = "\n\n".join(block.get_text() for block in pre_blocks)
-            return text.strip()
-        else:
-            return f"No online man page found for '{cmd}'."
+        return _extract_man_text(r.text, cmd)
         
     except Exception as e:
         return f"Failed to fetch online man page for '{cmd}': {str(e)}"
@@ -88,13 +97,14 @@ def get_command_explanation(cmd: str):
 
     # Fallback to --help on Windows
     try:
-        proc = subprocess.run(
-            [cmd, "--help"],
-            capture_output=True,
-            text=True,
-            check=True,
-            timeout=6
-        )
+        with metrics.subprocess_timer("help"):
+            proc = subprocess.run(
+                [cmd, "--help"],
+                capture_output=True,
+                text=True,
+                check=True,
+                timeout=6
+            )
         return proc.stdout
     except Exception:
         pass
@@ -0,0 +1,226 @@
+"""
+Fast JSON serialization for list endpoints
+
+List endpoints select plain column tuples instead of hydrating ORM objects and
+calling to_dict() per row. Responses are encoded with orjson when it is
+installed (it serializes datetimes natively), falling back to the standard
+library json module otherwise.
+"""
+import csv
+import io
+import json
+import zlib
+from datetime import date, datetime
+
+from flask import Response
+from sqlalchemy import Float, Integer, cast, func
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
+
+from models import Post, TypingSession, User
+
+try:
+    import orjson
+except ImportError:  # optional dependency
+    orjson = None
+
+
+class session_duration(FunctionElement):
+    """
+    ended_at - started_at in seconds, NULL while the session is open
+
+    Computed by the database, to the microsecond, so it equals
+    TypingSession.to_dict()'s timedelta.total_seconds() on every backend.
+    """
+    type = Float()
+    inherit_cache = True
+
+
+@compiles(session_duration)
+def _session_duration(element, compiler, **kw):
+    return compiler.process(cast(
+        func.extract('epoch', TypingSession.ended_at) - func.extract('epoch', TypingSession.started_at),
+        Float
+    ), **kw)
+
+
+def _sqlite_epoch_microseconds(column):
+    # Stored as 'YYYY-MM-DD HH:MM:SS.ffffff'. strftime() works in milliseconds
+    # and may round up a second, so it only gets the whole-second part
+    return (
+        cast(func.strftime('%s', func.substr(column, 1, 19)), Integer) * 1000000
+        + cast(func.substr(column, 21, 6), Integer)
+    )
+
+
+@compiles(session_duration, 'sqlite')
+def _session_duration_sqlite(element, compiler, **kw):
+    # Whole microseconds first, then one division, like timedelta.total_seconds()
+    return compiler.process(
+        (_sqlite_epoch_microseconds(TypingSession.ended_at) - _sqlite_epoch_microseconds(TypingSession.started_at))
+        / 1000000.0,
+        **kw
+    )
+
+
+# Columns returned for a typing session, in to_dict() order
+SESSION_COLUMNS = (
+    TypingSession.typing_id,
+    TypingSession.uid,
+    TypingSession.started_at,
+    TypingSession.ended_at,
+    TypingSession.language_tag,
+    TypingSession.source,
+    TypingSession.device_id,
+    TypingSession.created_at,
+    TypingSession.updated_at,
+    session_duration().label('duration_seconds')
+)
+
+SESSION_FIELDS = tuple(column.key for column in SESSION_COLUMNS)
+
+# Columns returned for a user, in to_dict() order
+USER_COLUMNS = (
+    User.uid,
+    User.github_id,
+    User.username,
+    User.email,
+    User.avatar_url,
+    User.name,
+    User.created_at,
+    User.updated_at
+)
+
+USER_FIELDS = tuple(column.key for column in USER_COLUMNS)
+
+# Columns returned for a post, in to_dict() order
+POST_COLUMNS = (
+    Post.id,
+    Post.title,
+    Post.content,
+    Post.created_at,
+    Post.user_id
+)
+
+POST_FIELDS = tuple(column.key for column in POST_COLUMNS)
+
+
+def _default(value):
+    """json fallback for values orjson handles natively"""
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+def dumps(payload):
+    """
+    Serialize a payload to JSON bytes
+
+    Args:
+        payload: JSON-compatible data; datetimes are written as ISO 8601
+
+    Returns:
+        bytes: UTF-8 encoded JSON
+    """
+    if orjson is not None:
+        return orjson.dumps(payload, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(payload, default=_default, separators=(',', ':')).encode()
+
+
+def loads(data):
+    """Parse JSON produced by dumps()"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def wants_columnar(args):
+    """True when the request asked for ?format=columnar"""
+    return args.get('format', '').lower() == 'columnar'
+
+
+def json_response(payload, status=200):
+    """Drop-in replacement for ``jsonify(payload), status`` using dumps()"""
+    return Response(dumps(payload), status=status, mimetype='application/json')
+
+
+def rows_to_dicts(rows, fields):
+    """One dict per row, keyed by field name"""
+    return [dict(zip(fields, row)) for row in rows]
+
+
+def rows_to_columnar(rows, fields):
+    """
+    Parallel arrays, one per field
+
+    Returns:
+        dict: {field: [value for each row]}
+    """
+    columns = list(zip(*rows)) if rows else [()] * len(fields)
+    return {field: list(values) for field, values in zip(fields, columns)}
+
+
+def serialize_rows(rows, fields, columnar=False):
+    """Rows as a list of dicts, or as parallel arrays when columnar=True"""
+    if columnar:
+        return rows_to_columnar(rows, fields)
+    return rows_to_dicts(rows, fields)
+
+
+def iter_ndjson(rows, fields, chunk_size=1000):
+    """
+    Encode rows as newline-delimited JSON, one chunk per chunk_size rows
+
+    Args:
+        rows (iterable): Row tuples, consumed lazily
+        fields (tuple): Field names, in row order
+
+    Yields:
+        bytes: Complete lines
+    """
+    lines = []
+    for row in rows:
+        lines.append(dumps(dict(zip(fields, row))))
+        if len(lines) >= chunk_size:
+            yield b'\n'.join(lines) + b'\n'
+            lines = []
+    if lines:
+        yield b'\n'.join(lines) + b'\n'
+
+
+def iter_csv(rows, fields, chunk_size=1000):
+    """
+    Encode rows as CSV with a header line, one chunk per chunk_size rows
+
+    Datetimes are written as ISO 8601 and None as an empty field.
+
+    Yields:
+        bytes: Complete lines
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(fields)
+
+    pending = 0
+    for row in rows:
+        writer.writerow([
+            value.isoformat() if isinstance(value, (datetime, date)) else value
+            for value in row
+        ])
+        pending += 1
+        if pending >= chunk_size:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+    yield buffer.getvalue().encode()
+
+
+def gzip_stream(chunks, level=6):
+    """Compress a stream of byte chunks into a single gzip member"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
@@ -0,0 +1,252 @@
+"""
+Slow-query log with sampled EXPLAIN plans
+
+Every SQL statement on the app's engine is timed with SQLAlchemy cursor
+events. Statements slower than SLOW_QUERY_THRESHOLD_MS are queued together with
+their bound parameters and the route that ran them; a background thread writes
+them to a rotating log file, one JSON object per line.
+
+For a sample of slow SELECT statements (SLOW_QUERY_EXPLAIN_SAMPLE_RATE) the
+thread first runs ``EXPLAIN (ANALYZE, BUFFERS)`` on a separate connection, in a
+transaction that is rolled back, and adds the plan to the entry. Other
+statements are explained without ANALYZE, since that would execute them
+again. So are SELECTs that take locks (FOR UPDATE / FOR SHARE, advisory locks)
+or call functions with side effects: re-running them would queue behind the
+transaction that made them slow and block other writers on the same rows.
+Plans are only captured on PostgreSQL.
+
+Requests never wait for the log: when the queue is full, entries are dropped
+and counted.
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from logging.handlers import RotatingFileHandler
+
+from flask import has_request_context, request
+from sqlalchemy import event
+
+from replicas import all_engines
+
+QUEUE_SIZE = 1000
+MAX_PARAMETER_LENGTH = 200
+# Upper bound for re-running a sampled statement under EXPLAIN ANALYZE
+EXPLAIN_TIMEOUT_MS = 30000
+# Statements PostgreSQL can EXPLAIN (not DDL, SET, COPY, ...)
+EXPLAINABLE = ('select', 'insert', 'update', 'delete', 'with', 'values')
+# Row-locking clauses and calls that lock, write or wait; a SELECT containing
+# one is explained without ANALYZE
+_NOT_ANALYZABLE = re.compile(
+    r'\bfor\s+(?:no\s+key\s+update|key\s+share|update|share)\b'
+    r'|\b(?:pg_advisory\w*|pg_try_advisory\w*|nextval|setval|pg_sleep\w*|pg_notify|set_config'
+    r'|pg_terminate_backend|pg_cancel_backend|lo_\w+|dblink\w*)\s*\(',
+    re.IGNORECASE
+)
+
+
+def _truncate(value):
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        value = bytes(value)
+        return f'<{len(value)} bytes>'
+    if isinstance(value, str) and len(value) > MAX_PARAMETER_LENGTH:
+        return value[:MAX_PARAMETER_LENGTH] + '...'
+    return value
+
+
+def _loggable_parameters(parameters, executemany):
+    if executemany:
+        return {'rows': len(parameters), 'first': _loggable_parameters(parameters[0], False) if parameters else None}
+    if isinstance(parameters, dict):
+        return {key: _truncate(value) for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [_truncate(value) for value in parameters]
+    return parameters
+
+
+def _can_analyze(statement):
+    """
+    Whether a statement is safe to re-run under EXPLAIN ANALYZE
+
+    Only plain SELECTs qualify: no locking clause, no SELECT INTO and no call
+    to a function that locks, writes or waits.
+    """
+    if statement.lstrip()[:6].lower() != 'select':
+        return False
+    if re.search(r'\binto\b', statement, re.IGNORECASE):
+        return False
+    return _NOT_ANALYZABLE.search(statement) is None
+
+
+class SlowQueryLog:
+    """
+    Records slow SQL statements to a rotating log file
+
+    Usage:
+        slow_query_log = SlowQueryLog()
+        slow_query_log.init_app(app)
+    """
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self.threshold_seconds = 0.2
+        self.explain_sample_rate = 0.1
+        self._logger = None
+        self._queue = queue.Queue(maxsize=QUEUE_SIZE)
+        self._local = threading.local()
+        self._engines = set()
+        self._thread = None
+        self._counters = {'recorded': 0, 'explained': 0, 'dropped': 0, 'errors': 0}
+        self._lock = threading.Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Read settings from the app config, open the log and start the writer thread"""
+        self.enabled = app.config['SLOW_QUERY_LOG_ENABLED']
+        self.threshold_seconds = app.config['SLOW_QUERY_THRESHOLD_MS'] / 1000
+        self.explain_sample_rate = app.config['SLOW_QUERY_EXPLAIN_SAMPLE_RATE']
+        app.extensions['slow_query_log'] = self
+        if not self.enabled:
+            return
+
+        if self._logger is None:
+            self._logger = self._open_log(
+                app.config['SLOW_QUERY_LOG_PATH'],
+                app.config['SLOW_QUERY_LOG_MAX_BYTES'],
+                app.config['SLOW_QUERY_LOG_BACKUP_COUNT']
+            )
+
+        for engine in all_engines(app):
+            if engine not in self._engines:
+                self._engines.add(engine)
+                event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+                event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='slow-query-log', daemon=True)
+            self._thread.start()
+            atexit.register(self.shutdown)
+
+    def counters(self):
+        """Counters for this process"""
+        with self._lock:
+            counters = dict(self._counters)
+        counters['enabled'] = self.enabled
+        counters['queued'] = self._queue.qsize()
+        return counters
+
+    def shutdown(self):
+        """Write the entries still queued, without explaining them"""
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+
+    @staticmethod
+    def _open_log(path, max_bytes, backup_count):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger = logging.getLogger('slow_queries')
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        logger.addHandler(handler)
+        return logger
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    # SQLAlchemy cursor events
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self._local.started = time.perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - self._local.started
+        if elapsed < self.threshold_seconds or getattr(self._local, 'explaining', False):
+            return
+
+        entry = {
+            'time': datetime.now(timezone.utc).isoformat(),
+            'duration_ms': round(elapsed * 1000, 3),
+            'statement': statement,
+            'parameters': _loggable_parameters(parameters, executemany),
+            'rowcount': cursor.rowcount
+        }
+        if has_request_context():
+            entry['route'] = request.endpoint
+            entry['method'] = request.method
+            entry['path'] = request.path
+        else:
+            entry['route'] = None
+            entry['thread'] = threading.current_thread().name
+
+        keyword = statement.lstrip().split(None, 1)[0].lower() if statement.strip() else ''
+        explain = (
+            not executemany and keyword in EXPLAINABLE and conn.dialect.name == 'postgresql'
+            and random.random() < self.explain_sample_rate
+        )
+        try:
+            self._queue.put_nowait((entry, conn.engine if explain else None, parameters))
+        except queue.Full:
+            self._count('dropped')
+
+    # Writer thread
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._drain()
+                return
+            entry, engine, parameters = item
+            if engine is not None:
+                entry['plan'] = self._explain(engine, entry['statement'], parameters)
+            self._write(entry)
+
+    def _drain(self):
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if item is not None:
+                self._write(item[0])
+
+    def _explain(self, engine, statement, parameters):
+        options = 'ANALYZE, BUFFERS' if _can_analyze(statement) else 'COSTS'
+        self._local.explaining = True
+        try:
+            with engine.connect() as conn:
+                # connect() rolls back on exit, so nothing the statement did is kept
+                conn.exec_driver_sql(f'SET LOCAL statement_timeout = {EXPLAIN_TIMEOUT_MS}')
+                rows = conn.exec_driver_sql(f'EXPLAIN ({options}) {statement}', parameters).all()
+            self._count('explained')
+            return [row[0] for row in rows]
+        except Exception as e:
+            self._count('errors')
+            return f'EXPLAIN failed: {e}'
+        finally:
+            self._local.explaining = False
+
+    def _write(self, entry):
+        try:
+            self._logger.info(json.dumps(entry, default=str))
+            self._count('recorded')
+        except Exception as e:
+            self._count('errors')
+            print(f"Slow query log: write failed: {e}")
+
+
+slow_query_log = SlowQueryLog()
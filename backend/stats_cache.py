@@ -0,0 +1,263 @@
+"""
+Per-user response cache for the activity read endpoints
+
+Sits in front of /api/activity/stats and /api/activity/sessions. Entries are
+keyed by uid, endpoint and query parameters, bounded in number (LRU) and expire
+after a TTL. activity.py invalidates a user's entries whenever it creates or
+closes one of their sessions.
+
+Two backends are available:
+- 'memory': per-process OrderedDict (default)
+- 'sqlite': a local SQLite file shared by every worker on the same host
+"""
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlencode
+
+from serializers import dumps, loads
+
+
+class MemoryBackend:
+    """Per-process LRU with TTL"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()   # key -> (uid, expires_at, payload)
+        self._keys_by_uid = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, now):
+        """Return (payload, expired); payload is None on a miss"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None, False
+            uid, expires_at, payload = entry
+            if expires_at <= now:
+                self._remove(key, uid)
+                return None, True
+            self._entries.move_to_end(key)
+            return payload, False
+
+    def set(self, key, uid, payload, expires_at):
+        """Store an entry and return how many entries were evicted"""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            self._entries[key] = (uid, expires_at, payload)
+            self._keys_by_uid.setdefault(uid, set()).add(key)
+
+            evicted = 0
+            while len(self._entries) > self.max_entries:
+                old_key, (old_uid, _, _) = self._entries.popitem(last=False)
+                self._discard_key(old_key, old_uid)
+                evicted += 1
+            return evicted
+
+    def invalidate(self, uid):
+        with self._lock:
+            keys = self._keys_by_uid.pop(uid, set())
+            for key in keys:
+                self._entries.pop(key, None)
+            return len(keys)
+
+    def size(self):
+        return len(self._entries)
+
+    def _remove(self, key, uid):
+        self._entries.pop(key, None)
+        self._discard_key(key, uid)
+
+    def _discard_key(self, key, uid):
+        keys = self._keys_by_uid.get(uid)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_uid[uid]
+
+
+class SQLiteBackend:
+    """LRU with TTL in a local SQLite file, shared by all workers on a host"""
+
+    def __init__(self, max_entries, path):
+        self.max_entries = max_entries
+        self.path = path
+        self._local = threading.local()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS stats_cache ('
+                ' key TEXT PRIMARY KEY,'
+                ' uid INTEGER NOT NULL,'
+                ' expires_at REAL NOT NULL,'
+                ' accessed_at REAL NOT NULL,'
+                ' payload TEXT NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_stats_cache_uid ON stats_cache (uid)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_stats_cache_accessed ON stats_cache (accessed_at)')
+
+    def get(self, key, now):
+        conn = self._connection()
+        with conn:
+            row = conn.execute(
+                'SELECT expires_at, payload FROM stats_cache WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None:
+                return None, False
+            if row[0] <= now:
+                conn.execute('DELETE FROM stats_cache WHERE key = ?', (key,))
+                return None, True
+            conn.execute('UPDATE stats_cache SET accessed_at = ? WHERE key = ?', (now, key))
+        return loads(row[1]), False
+
+    def set(self, key, uid, payload, expires_at):
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO stats_cache (key, uid, expires_at, accessed_at, payload)'
+                ' VALUES (?, ?, ?, ?, ?)',
+                (key, uid, expires_at, time.time(), dumps(payload).decode())
+            )
+            overflow = conn.execute('SELECT COUNT(*) FROM stats_cache').fetchone()[0] - self.max_entries
+            if overflow <= 0:
+                return 0
+            cursor = conn.execute(
+                'DELETE FROM stats_cache WHERE key IN ('
+                ' SELECT key FROM stats_cache ORDER BY accessed_at LIMIT ?)',
+                (overflow,)
+            )
+            return cursor.rowcount
+
+    def invalidate(self, uid):
+        conn = self._connection()
+        with conn:
+            return conn.execute('DELETE FROM stats_cache WHERE uid = ?', (uid,)).rowcount
+
+    def size(self):
+        return self._connection().execute('SELECT COUNT(*) FROM stats_cache').fetchone()[0]
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+        return conn
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+
+class StatsCache:
+    """
+    Response cache with hit/miss/eviction counters
+
+    Usage:
+        stats_cache = StatsCache()
+        stats_cache.init_app(app)
+
+        payload = stats_cache.get(uid, 'stats', request.args)
+        stats_cache.set(uid, 'stats', request.args, payload)
+        stats_cache.invalidate(uid)
+    """
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self.ttl = 30
+        self.backend = None
+        self._counters = {
+            'hits': 0,
+            'misses': 0,
+            'expirations': 0,
+            'evictions': 0,
+            'invalidations': 0
+        }
+        self._counter_lock = threading.Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config['STATS_CACHE_ENABLED']
+        self.ttl = app.config['STATS_CACHE_TTL_SECONDS']
+        max_entries = app.config['STATS_CACHE_MAX_ENTRIES']
+
+        backend = app.config['STATS_CACHE_BACKEND']
+        if backend == 'memory':
+            self.backend = MemoryBackend(max_entries)
+        elif backend == 'sqlite':
+            self.backend = SQLiteBackend(max_entries, app.config['STATS_CACHE_PATH'])
+        else:
+            raise ValueError(f"Unknown STATS_CACHE_BACKEND: {backend}")
+
+        app.extensions['stats_cache'] = self
+
+    def get(self, uid, name, params=None):
+        """
+        Look up a cached response payload
+
+        Args:
+            uid (int): Internal user id
+            name (str): Endpoint name, e.g. 'stats'
+            params (MultiDict|dict): Query parameters the response depends on
+
+        Returns:
+            dict: Cached payload, or None on a miss
+        """
+        if not self.enabled:
+            return None
+
+        payload, expired = self.backend.get(self._key(uid, name, params), time.time())
+        self._count('hits' if payload is not None else 'misses')
+        if expired:
+            self._count('expirations')
+        return payload
+
+    def set(self, uid, name, params, payload):
+        """Cache a JSON-serializable response payload"""
+        if not self.enabled:
+            return
+
+        evicted = self.backend.set(self._key(uid, name, params), uid, payload, time.time() + self.ttl)
+        if evicted:
+            self._count('evictions', evicted)
+
+    def invalidate(self, uid):
+        """Drop every cached response for a user"""
+        if not self.enabled:
+            return
+
+        removed = self.backend.invalidate(uid)
+        self._count('invalidations', removed)
+
+    def counters(self):
+        """Counters for this process, plus the current number of entries"""
+        with self._counter_lock:
+            counters = dict(self._counters)
+        counters['enabled'] = self.enabled
+        counters['entries'] = self.backend.size() if self.enabled else 0
+        return counters
+
+    def _count(self, name, amount=1):
+        with self._counter_lock:
+            self._counters[name] += amount
+
+    @staticmethod
+    def _key(uid, name, params):
+        if params is None:
+            query = ''
+        elif hasattr(params, 'items') and hasattr(params, 'getlist'):
+            query = urlencode(sorted(params.items(multi=True)))
+        else:
+            query = urlencode(sorted(params.items()))
+        return f'{uid}:{name}:{query}'
+
+
+stats_cache = StatsCache()
@@ -0,0 +1,78 @@
+"""Heartbeats over the rate limit"""
+import pytest
+
+import config
+from models import db, User, TypingSession
+
+GITHUB_ID = 5_000_000_001
+
+
+@pytest.fixture
+def client(request, tmp_path, monkeypatch):
+    # app.py builds its Gemini client at import time
+    monkeypatch.setenv('GEMINI_API_KEY', 'test')
+    from app import create_app
+    from auth_utils import generate_jwt_token
+
+    class TestConfig(config.Config):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{tmp_path / 'test.db'}"
+        RATE_LIMIT_ENABLED = True
+        # One heartbeat, then nothing refills during the test
+        RATE_LIMIT_HEARTBEAT_BURST = 1
+        RATE_LIMIT_HEARTBEAT_PER_SECOND = 0.001
+        HEARTBEAT_BUFFER_ENABLED = True
+        SLOW_QUERY_LOG_ENABLED = False
+        PROFILING_ENABLED = False
+
+    monkeypatch.setitem(config.config, 'test', TestConfig)
+    app = create_app('test', background_jobs=False)
+    with app.app_context():
+        db.create_all()
+        user = User(github_id=GITHUB_ID, username='rate-limit-test')
+        db.session.add(user)
+        db.session.commit()
+        token = generate_jwt_token({'id': GITHUB_ID, 'uid': user.uid, 'login': 'rate-limit-test',
+                                    'name': None, 'email': None, 'avatar_url': None})
+
+    client = app.test_client()
+    client.environ_base['HTTP_AUTHORIZATION'] = f'Bearer {token}'
+    # The rate limiter and heartbeat buffer outlive the app: one device per test
+    client.device_id = request.node.name
+    yield client
+
+    with app.app_context():
+        db.drop_all()
+        db.engine.dispose()
+
+
+def heartbeat(client, **body):
+    return client.post('/api/activity/start', json={'device_id': client.device_id, **body})
+
+
+def test_same_language_heartbeat_is_shed(client):
+    first = heartbeat(client, language_tag='python', source='vscode')
+    assert first.status_code == 201
+
+    response = heartbeat(client, language_tag='python', source='vscode')
+    assert response.status_code == 200
+    assert response.get_json()['rate_limited'] is True
+    assert response.get_json()['session']['typing_id'] == first.get_json()['session']['typing_id']
+
+
+def test_rate_limited_language_switch_is_rejected(client):
+    first = heartbeat(client, language_tag='python', source='vscode')
+    assert first.status_code == 201
+
+    response = heartbeat(client, language_tag='typescript', source='vscode')
+    assert response.status_code == 429
+    assert 'Retry-After' in response.headers
+
+    # Not acknowledged, so the client retries; nothing changed in the meantime
+    with client.application.app_context():
+        sessions = TypingSession.query.filter_by(device_id=client.device_id).all()
+    assert [(s.language_tag, s.ended_at) for s in sessions] == [('python', None)]
+
+
+def test_rate_limited_source_change_is_rejected(client):
+    assert heartbeat(client, language_tag='python', source='vscode').status_code == 201
+    assert heartbeat(client, language_tag='python', source='web').status_code == 429
@@ -0,0 +1,48 @@
+"""Which slow statements are re-run under EXPLAIN ANALYZE"""
+import pytest
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql
+
+from activity import _DEVICE_LOCK_SQL
+from models import User, UserActivityHeatmap
+from slow_query import _can_analyze
+
+
+def _sql(statement):
+    return str(statement.compile(dialect=postgresql.dialect()))
+
+
+@pytest.mark.parametrize('statement', [
+    'SELECT uid, username FROM users WHERE uid = %(uid)s',
+    '  select count(*) from typing_sessions where ended_at is null',
+    'SELECT language_tag FROM typing_sessions ORDER BY updated_at',
+])
+def test_plain_select_is_analyzed(statement):
+    assert _can_analyze(statement)
+
+
+@pytest.mark.parametrize('statement', [
+    'UPDATE users SET activity_version = activity_version + 1',
+    'WITH closed AS (UPDATE typing_sessions SET ended_at = now() RETURNING *) SELECT * FROM closed',
+    'SELECT * INTO scratch FROM users',
+    'SELECT uid FROM users FOR UPDATE',
+    'SELECT uid FROM users FOR NO KEY UPDATE SKIP LOCKED',
+    'select uid from users for share',
+    'SELECT uid FROM users FOR KEY SHARE',
+    'SELECT pg_try_advisory_lock(1)',
+    "SELECT nextval('typing_sessions_typing_id_seq')",
+    'SELECT pg_sleep(1)',
+])
+def test_locking_or_writing_statement_is_not_analyzed(statement):
+    assert not _can_analyze(statement)
+
+
+def test_repo_locking_statements_are_not_analyzed():
+    # Heartbeat device lock, rollup users lock and heatmap row lock
+    statements = [
+        _DEVICE_LOCK_SQL.text,
+        _sql(select(User.uid).where(User.uid.in_([1, 2])).order_by(User.uid).with_for_update()),
+        _sql(select(UserActivityHeatmap).filter_by(uid=1, year=2026).with_for_update()),
+    ]
+    for statement in statements:
+        assert not _can_analyze(statement), statement
@@ -0,0 +1,19 @@
+"""
+Datetime helpers shared by the activity modules
+"""
+from datetime import timezone
+
+
+def as_utc(value):
+    """
+    Treat naive datetimes (from datetime.utcnow()) as UTC
+    
+    Args:
+        value (datetime): Naive or timezone-aware datetime
+        
+    Returns:
+        datetime: Timezone-aware datetime
+    """
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value